@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from model import Features
+
+
+class Saturated(Exception):
+    """
+    Raised when a render was shed because all render slots and the queue are taken.
+    """
+
+
+class AdmissionControl:
+    """
+    Limits the renders of a process.
+
+    At most max_concurrent renders run at a time and at most max_queued renders wait for a free slot, any further
+    render is shed right away. Callers which can fall back to an earlier result do not wait at all: they are shed as
+    soon as every slot is taken, so they can serve the last good result instead of queueing. Renders admitted while
+    degrade_queued or more renders are waiting are told to render in the cheaper degraded mode.
+
+    The number of running and queued renders, the time spent in the queue and the number of shed and degraded
+    renders are sent as admission.* metrics.
+    """
+    _log = logging.getLogger('admission_control')
+
+    def __init__(self, max_concurrent=4, max_queued=8, queue_timeout=10, degrade_queued=2, metrics=None):
+        """
+        :param max_concurrent: Number of renders running at the same time
+        :param max_queued: Number of renders waiting for a free slot
+        :param queue_timeout: Seconds a render waits for a free slot before it is shed
+        :param degrade_queued: Number of waiting renders from which on renders are degraded, None never degrades
+        :param metrics: MetricsSender receiving the admission metrics
+        """
+        self._max_concurrent = max_concurrent
+        self._max_queued = max_queued
+        self._queue_timeout = queue_timeout
+        self._degrade_queued = degrade_queued
+        self._metrics = metrics
+        self._running = 0
+        self._queued = 0
+        self._condition = threading.Condition()
+        self.shed = 0
+        self.degraded = 0
+
+    @property
+    def saturated(self):
+        """
+        :return: True if a render could not start right away
+        """
+        return self._running >= self._max_concurrent
+
+    @contextmanager
+    def admit(self, wait=True):
+        """
+        Runs the with block as one render, waiting for a free slot if necessary.
+
+        :param wait: False sheds the render right away if no slot is free, e.g. if an earlier result can be served
+        :return: Context manager yielding True if the render should be degraded
+        :raises Saturated: If the render was shed
+        """
+        start = time.perf_counter()
+        with self._condition:
+            admitted = self._running < self._max_concurrent
+            if not admitted and wait and self._queued < self._max_queued:
+                self._queued += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self._running < self._max_concurrent,
+                                                        self._queue_timeout)
+                finally:
+                    self._queued -= 1
+            if admitted:
+                self._running += 1
+                degraded = self._degrade_queued is not None and self._queued >= self._degrade_queued
+                if degraded:
+                    self.degraded += 1
+            else:
+                self.shed += 1
+            running, queued = self._running, self._queued
+
+        if not admitted:
+            self._log.warning("Shedding render, running=%d queued=%d", running, queued)
+            self._send('shed', 1)
+            raise Saturated("All %d render slots and %d queue places are taken" % (self._max_concurrent,
+                                                                                   self._max_queued))
+        self._send('running', running)
+        self._send('queued', queued)
+        self._send('wait_ms', round((time.perf_counter() - start) * 1000, 3))
+        if degraded:
+            self._send('degraded', 1)
+        try:
+            yield degraded
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify()
+
+    def _send(self, name, value):
+        if self._metrics is not None:
+            self._metrics.send("admission." + name, value)
+
+
+class DegradedMode:
+    """
+    Cheaper settings of a render under load: a lower resolution, a cheaper label placer and only every
+    metar_stride-th METAR.
+    """
+
+    def __init__(self, dpi=60, label_placer=None, metar_stride=2):
+        """
+        :param dpi: Resolution of degraded renders
+        :param label_placer: Label placer of degraded renders, None keeps the regular placer
+        :param metar_stride: Only every metar_stride-th METAR is plotted
+        """
+        self.dpi = dpi
+        self.label_placer = label_placer
+        self._metar_stride = metar_stride
+
+    def thin(self, features):
+        """
+        :param features: Features of a region
+        :return: Features with only every metar_stride-th METAR
+        """
+        if self._metar_stride <= 1:
+            return features
+        metars = features.metars.select(np.arange(0, len(features.metars), self._metar_stride))
+        return Features(features.sigmets_international, features.sigmets_us, features.cwa_us, metars)
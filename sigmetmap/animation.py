@@ -0,0 +1,261 @@
+import hashlib
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from matplotlib.text import Text
+from PIL import Image
+
+from admission import Saturated
+from model import PublishedMap
+
+# Supported formats: file extension and mime type
+ANIMATION_FORMATS = {'apng': ('.png', 'image/apng'),
+                     'gif': ('.gif', 'image/gif'),
+                     'mp4': ('.mp4', 'video/mp4')}
+
+
+def available_formats():
+    """
+    :return: Animation formats which can be written, mp4 requires ffmpeg on the PATH
+    """
+    return [name for name in ANIMATION_FORMATS if name != 'mp4' or shutil.which('ffmpeg') is not None]
+
+
+class FrameEncoder:
+    """
+    Stands in for the ImageEncoder of PlotFeatures while the frames of an animation are rendered.
+
+    The base map is drawn only once and kept as background. Every frame restores the background and draws only the
+    artists which were plotted on top of the base map, then hands the cropped image to the AnimationWriter.
+    """
+
+    def __init__(self, plot_definition, image_encoder, writer):
+        """
+        :param plot_definition: PlotDefinition with nothing plotted on top of the base map yet
+        :param image_encoder: ImageEncoder providing the tight crop of the region
+        :param writer: AnimationWriter receiving the frames
+        """
+        canvas = plot_definition.fig.canvas
+        canvas.draw()
+        self._background = canvas.copy_from_bbox(plot_definition.fig.bbox)
+        self._image_encoder = image_encoder
+        self._writer = writer
+
+    def encode(self, plot_definition, output_path, timings):
+        """
+        Draws the frame and adds it to the animation, output_path is ignored.
+        """
+        canvas = plot_definition.fig.canvas
+        ax = plot_definition.ax
+        with timings.stage('draw'):
+            canvas.restore_region(self._background)
+            # The titles belong to the base map, but their texts change with every frame
+            overlay = [artist for artist in ax.get_children()
+                       if artist not in plot_definition.base_artists or
+                       (isinstance(artist, Text) and artist.get_text())]
+            for artist in sorted(overlay, key=lambda artist: artist.get_zorder()):
+                ax.draw_artist(artist)
+        with timings.stage('encode'):
+            rows, columns = self._image_encoder.crop(plot_definition)
+            self._writer.add(Image.fromarray(np.asarray(canvas.buffer_rgba())[rows, columns], 'RGBA'))
+
+
+class AnimationWriter:
+    """
+    Collects the frames of an animation and encodes them as APNG, GIF or MP4.
+
+    APNG and GIF frames are reduced to a palette when they are added, Pillow then only stores the part of every
+    frame which differs from the previous one. MP4 frames are streamed to ffmpeg.
+    """
+    _log = logging.getLogger('animation_writer')
+
+    def __init__(self, format='apng', frame_seconds=0.5):
+        """
+        :param format: One of ANIMATION_FORMATS
+        :param frame_seconds: Duration of every frame
+        :raises ValueError: If the format is not available
+        """
+        if format not in available_formats():
+            raise ValueError("Unsupported animation format %s, expected one of %s" % (format, available_formats()))
+        self.format = format
+        self._frame_seconds = frame_seconds
+        self._frames = []
+        self._size = None
+        self._ffmpeg = None
+        self._output_path = None
+
+    @property
+    def extension(self):
+        return ANIMATION_FORMATS[self.format][0]
+
+    def add(self, image):
+        """
+        :param image: PIL RGBA image of the frame, all frames must have the same size
+        """
+        if self._size is None:
+            self._size = image.size
+        elif image.size != self._size:
+            # The tight crop of a region does not change, but a frame of a different size must not break the loop
+            image = image.crop((0, 0) + self._size)
+        rgb = image.convert('RGB')
+        if self.format == 'mp4':
+            self._stream(rgb)
+        else:
+            self._frames.append(rgb.quantize(256, method=Image.Quantize.FASTOCTREE))
+
+    def finish(self):
+        """
+        :return: Encoded animation
+        :raises ValueError: If no frame was added
+        """
+        if self._size is None:
+            raise ValueError("An animation needs at least one frame")
+        if self.format == 'mp4':
+            return self._finish_stream()
+        output = io.BytesIO()
+        duration = int(self._frame_seconds * 1000)
+        if self.format == 'gif':
+            self._frames[0].save(output, 'GIF', save_all=True, append_images=self._frames[1:], duration=duration,
+                                 loop=0)
+        else:
+            self._frames[0].save(output, 'PNG', save_all=True, append_images=self._frames[1:], duration=duration,
+                                 loop=0, compress_level=3)
+        return output.getvalue()
+
+    def _stream(self, rgb):
+        if self._ffmpeg is None:
+            fd, self._output_path = tempfile.mkstemp(suffix='.mp4')
+            os.close(fd)
+            width, height = self._size
+            self._ffmpeg = subprocess.Popen(
+                ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                 '-s', '%dx%d' % (width, height), '-framerate', str(1 / self._frame_seconds), '-i', '-',
+                 # yuv420p, which every player supports, needs an even width and height
+                 '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+                 '-movflags', '+faststart', self._output_path],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._ffmpeg.stdin.write(rgb.tobytes())
+
+    def _finish_stream(self):
+        try:
+            _, errors = self._ffmpeg.communicate()
+            if self._ffmpeg.returncode != 0:
+                raise RuntimeError("ffmpeg failed: %s" % errors.decode("utf-8", "replace").strip())
+            with open(self._output_path, 'rb') as output:
+                return output.read()
+        finally:
+            os.unlink(self._output_path)
+
+
+class Animations:
+    """
+    Publishes animated loops of the snapshot history of the regions.
+
+    An animation is only rendered again when the snapshots it shows changed, otherwise the published animation is
+    served. Renders of an animation are single flight across all processes. Animations are stored in the artifact
+    store without pinning them, so they expire once nobody requests them any more.
+
+    While all render slots of the admission control are taken, the animation published before is served instead of
+    waiting for a render.
+    """
+    _log = logging.getLogger('animations')
+
+    def __init__(self, history, animate, artifact_store, cache, single_flight, frame_seconds=0.5, admission=None):
+        """
+        :param history: SnapshotHistory of the regions
+        :param animate: Callable rendering an animation, e.g. RenderPool.animate
+        :param artifact_store: ArtifactStore storing the animations
+        :param cache: Cache shared by all processes, storing the published animations
+        :param single_flight: SingleFlight locks shared by all processes
+        :param frame_seconds: Duration of every frame
+        :param admission: AdmissionControl limiting the concurrent renders, None renders without a limit
+        """
+        self._history = history
+        self._animate = animate
+        self._artifact_store = artifact_store
+        self._cache = cache
+        self._single_flight = single_flight
+        self._frame_seconds = frame_seconds
+        self._admission = admission
+
+    def get(self, region, format='apng', frames=None):
+        """
+        Provides the animation of the most recent snapshots of a region.
+
+        :param region: Name of the region
+        :param format: Animation format, one of available_formats()
+        :param frames: Number of the most recent snapshots shown, clamped to at least one and at most the recorded
+            snapshots. None shows all of them.
+        :return: PublishedMap of the animation, None if no snapshot of the region was recorded yet
+        :raises ValueError: If the format is not available
+        :raises Saturated: If all render slots are taken and the animation was never published before
+        """
+        if format not in available_formats():
+            raise ValueError("Unsupported animation format %s, expected one of %s" % (format, available_formats()))
+        index = self._history.index(region)
+        if not index:
+            return None
+        if frames is not None:
+            # Every number of frames showing the same snapshots shares one animation
+            index = index[-max(1, frames):]
+        key = "animation_%s_%s_%d" % (region, format, len(index))
+        animation_hash = self._hash(format, index)
+
+        published = self._published(key, animation_hash)
+        if published is not None:
+            return published
+        with self._single_flight.lock(key):
+            # Another thread or process might have rendered the animation while waiting for the lock
+            published = self._published(key, animation_hash)
+            if published is not None:
+                return published
+
+            snapshots = self._history.snapshots(region, len(index))
+            if not snapshots:
+                # The data of every snapshot expired from the cache
+                return None
+            previous = self._published(key)
+            try:
+                result = self._render(region, snapshots, format, previous)
+            except Saturated:
+                if previous is None:
+                    raise
+                self._log.warning("Render slots are saturated, serving the previous animation of region=%s", region)
+                return previous
+            file_name = self._artifact_store.put(result.image, ANIMATION_FORMATS[format][0])
+            now = time.time()
+            published = PublishedMap(region, file_name, result.info, result.failed, now, animation_hash, now)
+            self._cache.set(key, published, timeout=0)
+            self._log.info("Published animation of region=%s with %d frames file=%s", region, len(snapshots),
+                           file_name)
+            return published
+
+    def _render(self, region, snapshots, format, previous):
+        if self._admission is None:
+            return self._animate(region, snapshots, format, self._frame_seconds)
+        # An animation which was published before does not wait for a render slot
+        with self._admission.admit(wait=previous is None):
+            return self._animate(region, snapshots, format, self._frame_seconds)
+
+    def _published(self, key, animation_hash=None):
+        """
+        :param animation_hash: Content hash the published animation must have, None accepts any
+        """
+        published = self._cache.get(key)
+        if (published is None or animation_hash is not None and published.content_hash != animation_hash or
+                published.file_name not in self._artifact_store):
+            return None
+        self._artifact_store.touch(published.file_name)
+        return published
+
+    def _hash(self, format, index):
+        digest = hashlib.sha256(("%s %s" % (format, self._frame_seconds)).encode("utf-8"))
+        for snapshot in index:
+            digest.update(snapshot.content_hash.encode("utf-8"))
+        return digest.hexdigest()[:32]
@@ -0,0 +1,197 @@
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+class ArtifactStore:
+    """
+    Content addressed store of the rendered images.
+
+    Artifacts are named after the hash of their content, so identical renders are only stored once. The most
+    recently used artifacts are kept in memory up to max_bytes. If a directory is given every artifact is also
+    written to disk, which lets all worker processes of the service serve it and keeps it available after it was
+    evicted from memory.
+
+    Artifacts expire max_age seconds after they were last stored or pinned. Expiry walks the index of the store
+    instead of the directory. Pinned artifacts, the currently published map of every region, never expire.
+    """
+    _log = logging.getLogger('artifact_store')
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_age=2 * 60 * 60):
+        """
+        :param max_bytes: Maximum size of all artifacts kept in memory
+        :param directory: Directory backing the store on disk, None keeps the artifacts only in memory
+        :param max_age: Seconds after which an artifact which was neither stored nor pinned again expires
+        """
+        self._max_bytes = max_bytes
+        self._directory = directory
+        self._max_age = max_age
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+        # Time every known artifact was last stored or pinned
+        self._index = {}
+        self._pinned = {}
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def key(data, extension):
+        return hashlib.sha256(data).hexdigest()[:32] + extension
+
+    def put(self, data, extension):
+        """
+        Stores an artifact, storing the same content again only refreshes it.
+
+        :param data: Content of the artifact
+        :param extension: File extension of the artifact, e.g. .png
+        :return: Key of the artifact
+        """
+        key = self.key(data, extension)
+        now = time.time()
+        with self._lock:
+            self._index[key] = now
+            self._remember(key, data)
+        if self._directory is not None:
+            self._write(key, data, now)
+        return key
+
+    def get(self, key):
+        """
+        :param key: Key of the artifact
+        :return: Content of the artifact, None if it is unknown or expired
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if self._directory is None or not self._valid_key(key):
+            return None
+        try:
+            with open(os.path.join(self._directory, key), "rb") as artifact:
+                data = artifact.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._index.setdefault(key, time.time())
+            self._remember(key, data)
+        return data
+
+    def pin(self, name, key):
+        """
+        Protects the artifact from expiring until another artifact is pinned under the same name.
+
+        :param name: Name of the pin, e.g. the region whose published map the artifact is
+        :param key: Key of the artifact
+        """
+        with self._lock:
+            self._pinned[name] = key
+        self.touch(key)
+
+    def touch(self, key):
+        """
+        Restarts the max_age of the artifact without pinning it, e.g. for maps of custom regions, which must not
+        keep their artifacts forever once nobody requests them any more.
+
+        :param key: Key of the artifact
+        """
+        now = time.time()
+        with self._lock:
+            self._index[key] = now
+        if self._directory is not None:
+            try:
+                os.utime(os.path.join(self._directory, key), (now, now))
+            except FileNotFoundError:
+                pass
+
+    def expire(self):
+        """
+        Removes all artifacts which were not stored or pinned within max_age from memory and disk.
+
+        :return: Number of expired artifacts
+        """
+        deadline = time.time() - self._max_age
+        with self._lock:
+            pinned = set(self._pinned.values())
+            expired = [key for key, stored in self._index.items() if stored < deadline and key not in pinned]
+            for key in expired:
+                del self._index[key]
+                data = self._memory.pop(key, None)
+                if data is not None:
+                    self._memory_bytes -= len(data)
+
+        for key in expired:
+            if self._directory is not None:
+                self._remove(key, deadline)
+        if expired:
+            self._log.info("Expired %d artifacts", len(expired))
+        return len(expired)
+
+    def __contains__(self, key):
+        """
+        Also finds the artifacts another process wrote to the directory since this store indexed it.
+        """
+        with self._lock:
+            if key in self._index:
+                return True
+        if self._directory is None or not self._valid_key(key):
+            return False
+        try:
+            stored = os.path.getmtime(os.path.join(self._directory, key))
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._index.setdefault(key, stored)
+        return True
+
+    def __len__(self):
+        return len(self._index)
+
+    def _remember(self, key, data):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self._max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _write(self, key, data, now):
+        path = os.path.join(self._directory, key)
+        if os.path.exists(path):
+            os.utime(path, (now, now))
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, prefix='.' + key)
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+    def _remove(self, key, deadline):
+        path = os.path.join(self._directory, key)
+        try:
+            # Another process might have stored or pinned the same artifact since
+            if os.path.getmtime(path) < deadline:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self):
+        """
+        Indexes the artifacts written by previous runs, so that they expire as well.
+        """
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.is_file() and self._valid_key(entry.name):
+                    self._index[entry.name] = entry.stat().st_mtime
+        self._log.info("Indexed %d artifacts in %s", len(self._index), self._directory)
+
+    @staticmethod
+    def _valid_key(key):
+        return not key.startswith('.') and os.path.basename(key) == key
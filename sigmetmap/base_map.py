@@ -0,0 +1,199 @@
+import collections
+import logging
+import threading
+
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import numpy as np
+from shapely.geometry import box, LineString
+
+from model import BaseMap, BaseLayer
+
+# NaturalEarth 50m layers of every base map: (category, name)
+NATURAL_EARTH_LAYERS = (('cultural', 'admin_0_countries'), ('physical', 'coastline'), ('physical', 'lakes'))
+
+# Per layer: (list of geometries, array of their bounds), read once per process
+_natural_earth = {}
+_natural_earth_lock = threading.Lock()
+
+
+def natural_earth_geometries(category, name):
+    """
+    Provides the geometries of a NaturalEarth 50m layer, reading its shapefile on first use.
+
+    :param category: NaturalEarth category, e.g. cultural
+    :param name: Name of the layer, e.g. admin_0_countries
+    :return: List of the geometries in PlateCarree and an array of their bounds (x_min, y_min, x_max, y_max)
+    """
+    with _natural_earth_lock:
+        layer = _natural_earth.get((category, name))
+        if layer is None:
+            feature = cfeature.NaturalEarthFeature(category=category, name=name, scale='50m')
+            geometries = [geom for geom in feature.geometries() if geom is not None]
+            layer = (geometries, np.array([geom.bounds for geom in geometries]).reshape(-1, 4))
+            _natural_earth[(category, name)] = layer
+        return layer
+
+
+def load_natural_earth():
+    """
+    Reads the shapefiles of all layers of the base maps, so that building a base map only projects geometries.
+    """
+    for category, name in NATURAL_EARTH_LAYERS:
+        natural_earth_geometries(category, name)
+
+
+class BaseMapCache:
+    """
+    Caches the base map of every region and color scheme.
+
+    The NaturalEarth countries, coastlines and lakes are clipped to the region and projected into the region's
+    projection only once. Every render afterwards adds the already projected geometries to its axis, which
+    skips reading the shapefiles and re-projecting the geometries on each request.
+
+    Base maps of custom regions are kept in a separate LRU of at most max_custom entries, so that arbitrary extents
+    can not exhaust the memory. They are built without holding the lock of the cache, every custom region is only
+    built once at a time. Listeners are notified about every custom region which was evicted.
+    """
+    _log = logging.getLogger('base_map_cache')
+
+    def __init__(self, max_custom=16):
+        """
+        :param max_custom: Maximum number of base maps of custom regions
+        """
+        self._base_maps = {}
+        self._projected_layers = {}
+        self._custom = collections.OrderedDict()
+        # Lock per custom region whose base map is being built
+        self._building = {}
+        self._max_custom = max_custom
+        self._eviction_listeners = []
+        self._lock = threading.Lock()
+
+    def add_eviction_listener(self, listener):
+        """
+        :param listener: Callable receiving the name of every custom region whose base map was evicted
+        """
+        self._eviction_listeners.append(listener)
+
+    def get(self, region, projection, extent, color_scheme, custom=False):
+        """
+        Provides the base map for the region, building it on first use.
+
+        :param region: Name of the region, used as the cache key together with the color scheme
+        :param projection: Projection of the region
+        :param extent: Extent of the region in PlateCarree coordinates [x0, x1, y0, y1]
+        :param color_scheme: The color scheme to use for the base map features
+        :param custom: True if the region is a custom region, which is kept in the LRU
+        :return: BaseMap of the region
+        """
+        key = (region, color_scheme)
+        if custom:
+            return self._get_custom(key, projection, extent)
+        with self._lock:
+            base_map = self._base_maps.get(key)
+            if base_map is None:
+                base_map = self._build(region, projection, extent, color_scheme, self._projected_layers)
+                self._base_maps[key] = base_map
+            return base_map
+
+    def _get_custom(self, key, projection, extent):
+        region, color_scheme = key
+        with self._lock:
+            base_map = self._cached_custom(key)
+            if base_map is not None:
+                return base_map
+            building = self._building.setdefault(key, threading.Lock())
+
+        # Built outside of the cache lock, so renders of other regions do not wait for it. Concurrent requests of
+        # the same custom region wait for the first one and take its base map.
+        evicted = []
+        with building:
+            with self._lock:
+                base_map = self._cached_custom(key)
+            if base_map is not None:
+                return base_map
+            try:
+                # The projected layers of a custom region are only needed to build its single base map
+                base_map = self._build(region, projection, extent, color_scheme, {})
+                with self._lock:
+                    self._custom[key] = base_map
+                    while len(self._custom) > self._max_custom:
+                        (evicted_region, _), _ = self._custom.popitem(last=False)
+                        evicted.append(evicted_region)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+
+        for evicted_region in evicted:
+            self._log.debug("Evicted the base map of custom region=%s", evicted_region)
+            for listener in self._eviction_listeners:
+                listener(evicted_region)
+        return base_map
+
+    def _cached_custom(self, key):
+        base_map = self._custom.get(key)
+        if base_map is not None:
+            self._custom.move_to_end(key)
+        return base_map
+
+    def _build(self, region, projection, extent, color_scheme, projected_layers):
+        self._log.info("Building base map for region=%s color_scheme=%s", region, color_scheme.__name__)
+
+        # Same projection of the extent as done by GeoAxes.set_extent, so the region box matches the
+        # view limits of the axis exactly
+        x0, x1, y0, y1 = extent
+        domain = LineString([(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)])
+        view_x0, view_y0, view_x1, view_y1 = projection.project_geometry(domain, projection.as_geodetic()).bounds
+
+        # Since the original extend box is a rectangle only in the PlateCarree projection we need to
+        # project this bounding box onto the actual projection obtaining a more complex shape in general
+        unprojected_poly = box(view_x0, view_y0, view_x1, view_y1)
+        region_box = ccrs.PlateCarree().project_geometry(unprojected_poly, projection)
+
+        # Returns minimum bounding region (minx, miny, maxx, maxy)
+        # This region covers all of the actually visible map or more, since it is a box in the
+        # PlatteCarree projection which completely fills the actual projection
+        x_min, y_min, x_max, y_max = region_box.bounds
+        bbox = str(x_min) + "," + str(y_min) + "," + str(x_max) + "," + str(y_max)
+
+        if region not in projected_layers:
+            projected_layers[region] = self._project_layers(projection, (x_min, x_max, y_min, y_max))
+        countries, coastlines, lakes = projected_layers[region]
+
+        layers = [BaseLayer(countries, dict(facecolor=color_scheme.MAP_COLOR_LAND,
+                                            edgecolor=color_scheme.MAP_COLOR_COUNTRIES,
+                                            linewidth=0.3)),
+                  BaseLayer(coastlines, dict(facecolor='none',
+                                             edgecolor=color_scheme.MAP_COLOR_COASTLINES,
+                                             linewidth=0.5)),
+                  BaseLayer(lakes, dict(facecolor=color_scheme.MAP_COLOR_WATER,
+                                        edgecolor=color_scheme.MAP_COLOR_COASTLINES,
+                                        linewidth=0.25))]
+
+        return BaseMap(region, projection, extent, region_box, bbox, color_scheme, layers,
+                       (view_x0, view_y0, view_x1, view_y1))
+
+    @staticmethod
+    def _project_layers(projection, extent):
+        """
+        Reads the countries, coastlines and lakes and projects every geometry intersecting extent.
+
+        :param projection: Target projection
+        :param extent: Extent in PlateCarree coordinates [x0, x1, y0, y1] for which geometries are needed
+        :return: Tuple of projected geometry lists (countries, coastlines, lakes)
+        """
+        data_crs = ccrs.PlateCarree()
+        x0, x1, y0, y1 = extent
+        extent_box = box(x0, y0, x1, y1)
+
+        def project(category, name):
+            geometries, bounds = natural_earth_geometries(category, name)
+            # Same selection as NaturalEarthFeature.intersecting_geometries, without reading the shapefile again
+            candidates = ((bounds[:, 0] <= x1) & (bounds[:, 2] >= x0) &
+                          (bounds[:, 1] <= y1) & (bounds[:, 3] >= y0)).nonzero()[0]
+            projected = [projection.project_geometry(geometries[i], data_crs)
+                         for i in candidates if extent_box.intersects(geometries[i])]
+            return [geom for geom in projected if not geom.is_empty]
+
+        return tuple(project(category, name) for category, name in NATURAL_EARTH_LAYERS)
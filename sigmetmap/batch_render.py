@@ -0,0 +1,144 @@
+"""
+Renders the maps of all regions in one pass, e.g. for static hosting.
+
+The worldwide sources are fetched once and shared by all regions, which are then rendered in parallel worker
+processes. For every region the image <region><extension> and the info JSON <region>.json are written atomically
+into the output directory.
+
+    python batch_render.py --output-dir maps/ --processes 4
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from feature_store import FeatureStore
+from fetcher import Fetcher
+from image_encoder import ImageEncoder
+from instrumentation import Timings
+from label_placement import create_label_placer
+from render_pool import RenderPool
+from render_worker import create_sigmet_map
+
+_log = logging.getLogger('batch_render')
+
+# Stages printed in the timing summary, in pipeline order
+SUMMARY_STAGES = ('load', 'create', 'sigmets', 'metars', 'labels', 'draw', 'encode', 'total')
+
+def write_atomically(path, content):
+    """
+    Writes content to a temporary file next to path and moves it over path, so readers never see a partial file.
+
+    :param path: Path of the file
+    :param content: bytes to write
+    """
+    directory, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory or '.', prefix='.' + name)
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(content)
+        os.replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def render_all(regions, sigmet_map, render_pool, image_encoder, output_dir):
+    """
+    Loads the features of all regions and renders them in the render pool.
+
+    :return: Dictionary of the Timings per region and a dictionary of the errors of failed regions
+    """
+    timings = {region: Timings() for region in regions}
+    errors = {}
+
+    def render_region(region):
+        with timings[region].stage('load'):
+            features = sigmet_map.load_features(region)
+        with timings[region].stage('total'):
+            result = render_pool.render(region, features, None)
+        timings[region].merge(result.timings)
+
+        file_name = region + image_encoder.extension
+        write_atomically(os.path.join(output_dir, file_name), result.image)
+        info = json.dumps(dict(file=file_name, infos=result.info, failed=result.failed, published=time.time()))
+        write_atomically(os.path.join(output_dir, region + ".json"), info.encode("utf-8"))
+
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        futures = {region: executor.submit(render_region, region) for region in regions}
+        for region, future in futures.items():
+            try:
+                future.result()
+            except Exception as error:
+                _log.exception("Rendering region=%s failed", region)
+                errors[region] = error
+    return timings, errors
+
+
+def print_summary(fetch_seconds, timings, errors, out=sys.stdout):
+    out.write("fetched all sources in %.0fms\n" % (fetch_seconds * 1000))
+    out.write("%-8s" % "region" + "".join("%10s" % stage for stage in SUMMARY_STAGES) + "\n")
+    for region, region_timings in timings.items():
+        if region in errors:
+            out.write("%-8s failed: %s\n" % (region, errors[region]))
+            continue
+        durations = region_timings.durations
+        out.write("%-8s" % region + "".join("%8.0fms" % (durations.get(stage, 0.0) * 1000)
+                                            for stage in SUMMARY_STAGES) + "\n")
+
+
+def render_batch(regions, sigmet_map, render_pool, feature_store, image_encoder, output_dir, out=sys.stdout):
+    """
+    Fetches all sources of the feature store once, renders all regions and prints the timing summary.
+
+    :return: Exit status, 1 if any region failed
+    """
+    start = time.perf_counter()
+    sources = feature_store.get_source_names()
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        list(executor.map(feature_store.refresh, sources))
+    fetch_seconds = time.perf_counter() - start
+
+    timings, errors = render_all(regions, sigmet_map, render_pool, image_encoder, output_dir)
+    print_summary(fetch_seconds, timings, errors, out)
+    return 1 if errors else 0
+
+
+def main():
+    # Imported here, the rendering stack is only needed when the command runs
+    from sigmet_map import MapProvider, FeatureProvider, SigmetMap, LegendProvider
+
+    parser = argparse.ArgumentParser(description="Renders the maps of all regions into a directory")
+    parser.add_argument("--output-dir", required=True, help="directory the images and info JSON files are written to")
+    parser.add_argument("--processes", type=int, default=config.render_pool['processes'],
+                        help="number of render worker processes, one per CPU by default")
+    parser.add_argument("--region", action="append", help="region to render, may be given several times")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    map_provider = MapProvider()
+    map_provider.prepare()
+    fetcher = Fetcher(config.fetch)
+    feature_store = FeatureStore(fetcher.load)
+    image_encoder = ImageEncoder(**config.image)
+    sigmet_map = SigmetMap(map_provider, FeatureProvider(feature_store, fetcher), LegendProvider(),
+                           label_placer=create_label_placer(config.labels), image_encoder=image_encoder)
+    regions = args.region or map_provider.get_regions()
+
+    render_pool = RenderPool(create_sigmet_map, processes=args.processes, timeout=config.render_pool['timeout'])
+    try:
+        return render_batch(regions, sigmet_map, render_pool, feature_store, image_encoder, args.output_dir)
+    finally:
+        render_pool.close()
+        fetcher.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,11 @@
+import time
+
+import numpy as np
+from matplotlib.colors import to_rgba_array
+
+from model import Metars
+
+
 class DefaultColorScheme:
     MAP_COLOR_LAND = '#FEF9F0'
     MAP_COLOR_WATER = '#B0F8FF'
@@ -19,3 +27,26 @@ class DefaultColorScheme:
 
 class NorthAmericaColorScheme(DefaultColorScheme):
     METAR_ALPHA = 0.4
+
+
+def metar_colors(color_scheme, category, observation_time, now=None):
+    """
+    Colors METARs by their flight category, fading them out once they are older than an hour.
+
+    :param color_scheme: Color scheme of the map
+    :param category: Flight category codes of the METARs
+    :param observation_time: Observation times of the METARs in seconds since the epoch
+    :param now: Time the age of the METARs is measured from, defaults to the current time
+    :return: RGBA array with one row per METAR
+    """
+    palette = to_rgba_array([color_scheme.METAR_FLIGHT_CATEGORY_COLORS.get(label, color_scheme.METAR_COLOR_UNKOWN)
+                             for label in Metars.CATEGORIES])
+    colors = palette[category]
+
+    now = now if now is not None else time.time()
+    age_m = (now - observation_time) / 60
+    alpha_age_factor = np.minimum(1, -1/90 * age_m + 4/3)
+    # Invalid observation times are treated as current
+    alpha_age_factor[observation_time == Metars.MISSING_TIME] = 1
+    colors[:, 3] = np.clip(color_scheme.METAR_ALPHA * alpha_age_factor, 0, 1)
+    return colors
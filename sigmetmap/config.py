@@ -1,4 +1,96 @@
 metrics = {'host': 'ip-172-31-15-21.eu-west-1.compute.internal',
            'port': 2003}
 
-cleanup = {'max_age': 2*60*60}
\ No newline at end of file
+# Rendered images: up to max_bytes of them are kept in memory, all of them in directory, which is shared by all worker
+# processes. None keeps them only in memory, which only works with a single process. Images expire after max_age
+# seconds unless they are still published.
+artifacts = {'max_bytes': 64 * 1024 * 1024,
+             'directory': 'artifacts/',
+             'max_age': 2*60*60}
+
+# Timeout in seconds, number of retries and backoff in seconds before the first retry per upstream source
+fetch = {'default': {'timeout': 10, 'retries': 2, 'backoff': 0.5},
+         'metars': {'timeout': 30, 'retries': 2, 'backoff': 1}}
+
+# Refresh interval in seconds of every globally shared upstream source
+feature_refresh = {'sigmets_international': 60,
+                   'sigmets_us': 60,
+                   'metars': 120,
+                   'cwa_us': 60}
+
+# Label placement engine, 'greedy' or 'adjust_text'. All other entries are passed to the placer.
+labels = {'engine': 'greedy',
+          'max_seconds': 0.5}
+
+# Worker processes rendering the maps, processes None uses one worker per CPU
+render_pool = {'processes': None,
+               'max_pending': 32,
+               'timeout': 30,
+               'max_tasks_per_child': 200,
+               'start_timeout': 300}
+
+# Seconds between two pre-renders of all regions if no upstream data changed
+prerender = {'interval': 60}
+
+# Cache of the published maps shared by all worker processes. Maps are revalidated in the background once they are
+# older than 'fresh' seconds, requests only wait for a render if the map is older than 'max_stale' seconds. Once the
+# cache holds more than 'threshold' entries the expired and then the oldest ones are removed, the threshold has to stay
+# well above the entries of the built-in regions: published maps, overlays, snapshots and animations.
+render_cache = {'dir': 'cache/',
+                'lock_dir': 'cache_locks/',
+                'fresh': 60,
+                'max_stale': 600,
+                'threshold': 10000}
+
+# Output images: 'png' or 'webp'. PNGs are written with the zlib compress_level (0-9) and reduced to a palette of
+# quantize_colors colors, None keeps the full RGBA image. webp_quality (0-100) only applies to WebP images.
+image = {'format': 'png',
+         'compress_level': 3,
+         'quantize_colors': 256,
+         'webp_quality': 80}
+
+# Vector overlays, checked for changed inputs after 'fresh' seconds. Coordinates are simplified with a tolerance of
+# 'tolerance' pixels at the requested zoom level, 0 being the resolution of the rendered map.
+overlay = {'fresh': 60,
+           'tolerance': 1.0,
+           'max_zoom': 6}
+
+# Hazard queries: METARs are returned within metar_radius nautical miles around the queried point, airports or route
+hazards = {'metar_radius': 25}
+
+# Transparent XYZ tiles in Web Mercator: up to max_tiles rendered tiles of up to max_zoom are kept, clients may cache
+# a tile for max_age seconds, after which tiles showing METARs are rendered again.
+tiles = {'max_zoom': 10,
+         'max_tiles': 4096,
+         'size': 256,
+         'max_age': 60}
+
+# Snapshot history of the features of every region, shown by the animations: a snapshot is taken at most every
+# 'interval' seconds, each region keeps at most max_snapshots snapshots taking at most max_bytes compressed
+history = {'max_snapshots': 36,
+           'max_bytes': 16 * 1024 * 1024,
+           'interval': 600}
+
+# Every frame of an animation is shown for frame_seconds
+animation = {'frame_seconds': 0.5}
+
+# Renders of a process: at most max_concurrent run at a time and at most max_queued wait up to queue_timeout seconds
+# for a free slot, further renders are shed. Regions which were published before keep their map instead of waiting.
+# Renders admitted while degrade_queued or more renders are waiting are rendered in the degraded mode.
+admission = {'max_concurrent': 4,
+             'max_queued': 8,
+             'queue_timeout': 10,
+             'degrade_queued': 2}
+
+# Degraded mode under load: lower resolution, labels left at their anchors and only every metar_stride-th METAR
+degraded = {'dpi': 60,
+            'labels': {'engine': 'anchored'},
+            'metar_stride': 2}
+
+# Custom regions: base maps of up to max_base_maps of them are kept, the least recently used one is dropped first.
+# Their published maps and overlays expire from the shared cache max_age seconds after they were last checked.
+custom_regions = {'max_base_maps': 16,
+                  'max_age': 3600}
+
+# Directory to which the cProfile stats of every render are written, None disables profiling
+profiling = {'dir': None}
@@ -0,0 +1,30 @@
+import hashlib
+import json
+
+
+def content_hash(region, features, title):
+    """
+    Calculates a stable hash of everything a render of the region depends on.
+
+    Two renders with the same hash produce the same map, so the previous result can be reused.
+
+    :param region: Name of the region
+    :param features: Features object of the region
+    :param title: Title of the map, the current time with minute resolution
+    :return: Hex digest of the inputs
+    """
+    digest = hashlib.sha256()
+    digest.update(region.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(title.encode("utf-8"))
+
+    for collection in (features.sigmets_international, features.sigmets_us, features.cwa_us):
+        normalized = json.dumps(collection.get("features", []), sort_keys=True, separators=(',', ':'))
+        digest.update(b"\0")
+        digest.update(normalized.encode("utf-8"))
+
+    metars = features.metars
+    for column in (metars.longitude, metars.latitude, metars.category, metars.observation_time):
+        digest.update(b"\0")
+        digest.update(column.tobytes())
+    return digest.hexdigest()[:32]
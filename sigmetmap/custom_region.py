@@ -0,0 +1,91 @@
+"""
+Custom regions are arbitrary extents which are rendered like the built-in regions.
+
+A custom region is identified by a name encoding its extent rounded to CUSTOM_PRECISION degrees, so that nearby
+requests of a popular view share one base map, one cached map and one render.
+"""
+
+CUSTOM_PREFIX = "custom"
+# Extents are rounded to this many degrees
+CUSTOM_PRECISION = 0.1
+# Lambert Conformal maps of larger extents are too distorted to be useful
+MAX_WIDTH = 120
+MAX_HEIGHT = 80
+MIN_SIZE = 1
+MAX_LATITUDE = 85
+
+
+def custom_region(west, east, south, north):
+    """
+    :param west: Western edge in degrees
+    :param east: Eastern edge in degrees, greater than west
+    :param south: Southern edge in degrees
+    :param north: Northern edge in degrees, greater than south
+    :return: Name of the custom region
+    :raises ValueError: If the extent is not supported
+    """
+    # Adding 0.0 turns -0.0 into 0.0, which would otherwise be a different name of the same extent
+    west, east, south, north = (round(value / CUSTOM_PRECISION) * CUSTOM_PRECISION + 0.0
+                                for value in (west, east, south, north))
+    if not -MAX_LATITUDE <= south < north <= MAX_LATITUDE:
+        raise ValueError("Latitudes must be increasing and within +-%d degrees" % MAX_LATITUDE)
+    if not -360 <= west < east <= 360:
+        raise ValueError("Longitudes must be increasing and within +-360 degrees")
+    if not MIN_SIZE <= east - west <= MAX_WIDTH or not MIN_SIZE <= north - south <= MAX_HEIGHT:
+        raise ValueError("Custom regions must be between %d and %dx%d degrees" % (MIN_SIZE, MAX_WIDTH, MAX_HEIGHT))
+    return "%s_%.1f_%.1f_%.1f_%.1f" % (CUSTOM_PREFIX, west, east, south, north)
+
+
+def custom_region_around(longitude, latitude, span):
+    """
+    :param longitude: Longitude of the center in degrees
+    :param latitude: Latitude of the center in degrees
+    :param span: Width and height of the region in degrees
+    :return: Name of the custom region
+    :raises ValueError: If the extent is not supported
+    """
+    return custom_region(longitude - span / 2, longitude + span / 2,
+                         max(latitude - span / 2, -MAX_LATITUDE), min(latitude + span / 2, MAX_LATITUDE))
+
+
+def is_custom_region(region):
+    return region.startswith(CUSTOM_PREFIX + "_")
+
+
+def custom_extent(region):
+    """
+    :param region: Name of a custom region
+    :return: Extent of the region [west, east, south, north]
+    :raises ValueError: If the name is not the name of a valid custom region
+    """
+    parts = region.split("_")
+    if len(parts) != 5 or parts[0] != CUSTOM_PREFIX:
+        raise ValueError("%s is not a custom region" % region)
+    west, east, south, north = (float(part) for part in parts[1:])
+    # Only names created by custom_region are accepted
+    if custom_region(west, east, south, north) != region:
+        raise ValueError("%s is not a custom region" % region)
+    return [west, east, south, north]
+
+
+def lambert_conformal_parameters(extent):
+    """
+    Derives a Lambert Conformal projection of the extent, centered on the extent with standard parallels at one
+    and five sixths of its latitude span.
+
+    :param extent: [west, east, south, north]
+    :return: Dictionary of the keyword arguments of cartopy's LambertConformal
+    """
+    west, east, south, north = extent
+    span = north - south
+    parallels = [south + span / 6, south + 5 * span / 6]
+    # The cone degenerates if the standard parallels are symmetric to the equator
+    if abs(parallels[0] + parallels[1]) < 1:
+        parallels[1] += 1 if parallels[0] + parallels[1] >= 0 else -1
+    # The cone opens towards the pole of the hemisphere its parallels are in, the map is cut off beyond the extent
+    if parallels[0] + parallels[1] > 0:
+        cutoff = max(-89, min(-30, south - 10))
+    else:
+        cutoff = min(89, max(30, north + 10))
+    return dict(central_longitude=(west + east) / 2, central_latitude=(south + north) / 2,
+                standard_parallels=tuple(parallels), cutoff=cutoff)
@@ -0,0 +1,242 @@
+import datetime
+import json
+import logging
+import threading
+import time
+
+from fetcher import Fetcher
+from metar_ingest import csv_metar_decoder
+from model import FeatureSnapshot, Metars, SIGMET_SOURCES
+
+
+def json_decoder(response):
+    response_decoded = response.read().decode("utf-8")
+    return json.loads(response_decoded)
+
+
+# Worldwide sources which are shared by all regions: (name, url, decoder)
+GLOBAL_SOURCES = [("sigmets_international",
+                   "https://www.aviationweather.gov/gis/scripts/IsigmetJSON.php", json_decoder),
+                  ("sigmets_us",
+                   "https://www.aviationweather.gov/gis/scripts/SigmetJSON.php", json_decoder),
+                  ("metars",
+                   "https://www.aviationweather.gov/adds/dataserver_current/current/metars.cache.csv.gz",
+                   csv_metar_decoder)]
+
+# CWAs of a bbox "x_min,y_min,x_max,y_max" appended to the url
+CWA_URL = "https://aviationweather.gov/cgi-bin/json/CwaJSON.php?zoom=4&bbox="
+
+# Worldwide CWAs, shared by the hazard queries and the map tiles
+WORLDWIDE_CWA_SOURCE = ("cwa_us", CWA_URL + "-180,-90,180,90", json_decoder)
+
+_NO_FEATURES = {"features": []}
+
+
+def sigmet_collections(snapshot):
+    """
+    :param snapshot: FeatureSnapshot of a FeatureStore
+    :return: Dictionary of the feature collection of every source in SIGMET_SOURCES, sources which the store does not
+        load are empty
+    """
+    return {source: snapshot.payloads.get(source, _NO_FEATURES) for source, _, _ in SIGMET_SOURCES}
+
+
+class FeatureStore:
+    """
+    Process wide store of the worldwide upstream features.
+
+    Every source is downloaded and decoded once and refreshed on its own schedule. Renders read an immutable
+    FeatureSnapshot and clip it to their region, so that rendering all regions only downloads and parses the
+    global data once.
+
+    A store whose refreshes are not scheduled, e.g. outside of the HTTP service, is created with refresh_on_read.
+    Its sources are then refreshed when a snapshot is read after their refresh interval.
+    """
+    _log = logging.getLogger('feature_store')
+
+    def __init__(self, loader=None, sources=GLOBAL_SOURCES, refresh_intervals=None, refresh_on_read=False):
+        """
+        :param loader: Callable downloading and decoding one source definition (name, url, decoder),
+            returning (name, decoded). Defaults to the load method of a new Fetcher.
+        :param sources: List of source definitions (name, url, decoder)
+        :param refresh_intervals: Dictionary of refresh intervals in seconds per source name
+        :param refresh_on_read: True refreshes sources older than their refresh interval when a snapshot is read,
+            for stores which are not scheduled
+        """
+        self._loader = loader if loader is not None else Fetcher().load
+        self._sources = {source[0]: source for source in sources}
+        self._refresh_intervals = refresh_intervals or {}
+        self._refresh_on_read = refresh_on_read
+        self._snapshot = FeatureSnapshot({}, {}, {})
+        self._snapshot_lock = threading.Lock()
+        self._source_locks = {name: threading.Lock() for name in self._sources}
+        self._listeners = []
+
+    def get_source_names(self):
+        return list(self._sources.keys())
+
+    def snapshot(self):
+        """
+        Provides the current snapshot of all sources. Sources which were never loaded are loaded first, with
+        refresh_on_read sources older than their refresh interval are refreshed first.
+
+        :return: FeatureSnapshot which will never be modified afterwards
+        """
+        snapshot = self._snapshot
+        outdated = [name for name in self._sources if self._outdated(snapshot, name)]
+        for name in outdated:
+            self._refresh_if_outdated(name)
+        return self._snapshot
+
+    def add_listener(self, listener):
+        """
+        Registers a listener which is called with (name, snapshot) whenever a refresh of the source name
+        published changed data.
+
+        :param listener: Callable receiving the name of the changed source and the new snapshot
+        """
+        self._listeners.append(listener)
+
+    def refresh_all(self):
+        for name in self._sources:
+            self.refresh(name)
+
+    def refresh(self, name):
+        """
+        Downloads and decodes the source name and publishes a new snapshot containing it.
+
+        If the download fails the previous payload of the source is kept.
+
+        :param name: Name of the source to refresh
+        """
+        with self._source_locks[name]:
+            self._refresh(name)
+
+    def schedule(self, scheduler):
+        """
+        Adds one refresh job per source to an APScheduler scheduler, using the configured refresh interval.
+
+        The first refresh runs immediately, so that the sources are usually loaded before the first request.
+
+        :param scheduler: The scheduler to which the jobs will be added
+        """
+        for name in self._sources:
+            interval = self._refresh_intervals.get(name, 60)
+            scheduler.add_job(self.refresh, trigger='interval', seconds=interval, args=[name],
+                              id='feature_store_' + name, max_instances=1, coalesce=True,
+                              next_run_time=datetime.datetime.now())
+
+    def _outdated(self, snapshot, name):
+        if name not in snapshot.payloads:
+            return True
+        return (self._refresh_on_read and
+                time.time() - snapshot.updated[name] > self._refresh_intervals.get(name, 60))
+
+    def _refresh_if_outdated(self, name):
+        with self._source_locks[name]:
+            # Another thread might have loaded the source while waiting for the lock
+            if self._outdated(self._snapshot, name):
+                self._refresh(name)
+
+    def _refresh(self, name):
+        self._log.info("Refreshing source=%s", name)
+        try:
+            _, payload = self._loader(self._sources[name])
+        except Exception:
+            self._log.exception("Refreshing source=%s failed, keeping the previous payload", name)
+            if name in self._snapshot.payloads:
+                return
+            raise
+
+        bounds = feature_bounds(payload) if isinstance(payload, dict) else None
+
+        # Only this thread refreshes the source, so the previous payload can be compared outside of the lock
+        changed = not _payload_equals(self._snapshot.payloads.get(name), payload)
+
+        with self._snapshot_lock:
+            previous = self._snapshot
+            payloads = dict(previous.payloads)
+            all_bounds = dict(previous.bounds)
+            updated = dict(previous.updated)
+            payloads[name] = payload
+            all_bounds[name] = bounds
+            updated[name] = time.time()
+            self._snapshot = FeatureSnapshot(payloads, all_bounds, updated)
+            snapshot = self._snapshot
+
+        if changed:
+            for listener in self._listeners:
+                try:
+                    listener(name, snapshot)
+                except Exception:
+                    self._log.exception("Listener of source=%s failed", name)
+
+
+def _payload_equals(previous, payload):
+    if previous is payload:
+        # Not modified upstream, the fetcher returned the previously decoded payload
+        return True
+    if previous is None or type(previous) is not type(payload):
+        return False
+    if isinstance(payload, Metars):
+        return previous.equals(payload)
+    return previous == payload
+
+
+def feature_bounds(feature_collection):
+    """
+    Calculates the bounds of every feature in a GEOJSON feature collection.
+
+    :param feature_collection: GEOJSON feature collection
+    :return: List of (minx, miny, maxx, maxy) tuples, None for features without coordinates
+    """
+    def flatten(coordinates):
+        if len(coordinates) > 0 and isinstance(coordinates[0], (int, float)):
+            yield coordinates
+        else:
+            for nested in coordinates:
+                yield from flatten(nested)
+
+    bounds = []
+    for feat in feature_collection.get("features", []):
+        points = list(flatten((feat.get("geometry") or {}).get("coordinates", [])))
+        if points:
+            xs = [point[0] for point in points]
+            ys = [point[1] for point in points]
+            bounds.append((min(xs), min(ys), max(xs), max(ys)))
+        else:
+            bounds.append(None)
+    return bounds
+
+
+def clip_feature_collection(feature_collection, bounds, bbox):
+    """
+    Selects the features of a GEOJSON feature collection whose bounds intersect bbox.
+
+    :param feature_collection: GEOJSON feature collection
+    :param bounds: Bounds of the features as calculated by feature_bounds
+    :param bbox: Region bounds (minx, miny, maxx, maxy)
+    :return: New feature collection containing only the intersecting features
+    """
+    x_min, y_min, x_max, y_max = bbox
+    features = [feat for feat, feat_bounds in zip(feature_collection.get("features", []), bounds)
+                # Features without coordinates are kept, plotting them reports them as failed
+                if feat_bounds is None or (feat_bounds[0] <= x_max and feat_bounds[2] >= x_min and
+                                           feat_bounds[1] <= y_max and feat_bounds[3] >= y_min)]
+    clipped = dict(feature_collection)
+    clipped["features"] = features
+    return clipped
+
+
+def clip_metars(metars, bbox):
+    """
+    Selects the METARs located inside bbox.
+
+    :param metars: Metars
+    :param bbox: Region bounds (minx, miny, maxx, maxy)
+    :return: Metars only containing stations inside bbox
+    """
+    x_min, y_min, x_max, y_max = bbox
+    mask = ((metars.longitude >= x_min) & (metars.longitude <= x_max) &
+            (metars.latitude >= y_min) & (metars.latitude <= y_max))
+    return metars.select(mask)
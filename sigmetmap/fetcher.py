@@ -0,0 +1,179 @@
+import collections
+import gzip
+import http.client
+import io
+import logging
+import queue
+import threading
+import time
+from urllib.parse import urlsplit, urljoin
+
+
+class FetchError(IOError):
+    """
+    Raised when a source could not be fetched within its retry budget.
+    """
+
+
+class Fetcher:
+    """
+    Fetches and decodes the upstream sources over pooled keep-alive connections.
+
+    Every source has its own timeout and retry budget. Requests are conditional: if the upstream answers with
+    304 Not Modified the previously decoded payload is returned without transferring or decoding it again. The
+    validators and payloads of at most max_validated urls are kept, the least recently fetched url is dropped first,
+    since custom regions query the CWAs of arbitrary extents.
+    """
+    _log = logging.getLogger('fetcher')
+
+    _default_policy = {'timeout': 10, 'retries': 2, 'backoff': 0.5}
+    _max_redirects = 3
+
+    def __init__(self, policies=None, max_idle_connections=4, metrics=None, max_validated=64):
+        """
+        :param policies: Dictionary of policies per source name, the policy 'default' applies to all other sources.
+            A policy is a dictionary with the timeout in seconds, the number of retries and the backoff in seconds
+            before the first retry, which doubles for every further retry.
+        :param max_idle_connections: Number of idle connections kept per host
+        :param metrics: MetricsSender receiving the fetch and decode durations per source
+        :param max_validated: Number of urls whose validators and decoded payload are kept for conditional requests
+        """
+        self._policies = policies or {}
+        self._metrics = metrics
+        self._max_idle_connections = max_idle_connections
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        # Validators and decoded payload of the last successful response per url: (etag, last_modified, decoded)
+        self._validated = collections.OrderedDict()
+        self._max_validated = max_validated
+        self._validated_lock = threading.Lock()
+
+    def load(self, definition):
+        """
+        Fetches and decodes one source.
+
+        :param definition: Source definition (name, url, decoder)
+        :return: Tuple (name, decoded payload)
+        :raises FetchError: If the source could not be fetched within its retry budget
+        """
+        name, url, decoder = definition
+        policy = dict(self._default_policy, **self._policies.get('default', {}))
+        policy.update(self._policies.get(name, {}))
+
+        for attempt in range(policy['retries'] + 1):
+            if attempt > 0:
+                time.sleep(policy['backoff'] * 2 ** (attempt - 1))
+            try:
+                return name, self._fetch(name, url, decoder, policy['timeout'])
+            except (OSError, http.client.HTTPException) as error:
+                self._log.warning("Fetching source=%s attempt=%d failed: %s", name, attempt + 1, error)
+                self._send("fetch.%s.failures" % name, 1)
+        raise FetchError("Fetching source %s failed after %d attempts" % (name, policy['retries'] + 1))
+
+    def close(self):
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+
+    def _send(self, name, value):
+        if self._metrics is not None:
+            self._metrics.send(name, value)
+
+    def _fetch(self, name, url, decoder, timeout):
+        headers = {'Accept-Encoding': 'gzip'}
+        with self._validated_lock:
+            validated = self._validated.get(url)
+            if validated is not None:
+                self._validated.move_to_end(url)
+        if validated is not None:
+            etag, last_modified, _ = validated
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        start = time.perf_counter()
+        request_url = url
+        for _ in range(self._max_redirects + 1):
+            status, response_headers, body = self._request(request_url, headers, timeout)
+            if status in (301, 302, 303, 307, 308):
+                request_url = urljoin(request_url, response_headers.get('Location'))
+                continue
+            break
+        else:
+            raise http.client.HTTPException("Too many redirects for %s" % url)
+
+        self._send("fetch.%s_ms" % name, round((time.perf_counter() - start) * 1000, 3))
+
+        if status == 304 and validated is not None:
+            self._log.debug("Not modified url=%s", url)
+            self._send("fetch.%s.not_modified" % name, 1)
+            return validated[2]
+        if status != 200:
+            raise http.client.HTTPException("Unexpected status %d for %s" % (status, url))
+
+        if response_headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        start = time.perf_counter()
+        decoded = decoder(io.BytesIO(body))
+        self._send("decode.%s_ms" % name, round((time.perf_counter() - start) * 1000, 3))
+        with self._validated_lock:
+            self._validated[url] = (response_headers.get('ETag'), response_headers.get('Last-Modified'), decoded)
+            self._validated.move_to_end(url)
+            while len(self._validated) > self._max_validated:
+                self._validated.popitem(last=False)
+        return decoded
+
+    def _request(self, url, headers, timeout):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        pool = self._pool(parts.scheme, parts.netloc)
+
+        while True:
+            try:
+                connection = pool.get_nowait()
+                reused = True
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+            except queue.Empty:
+                reused = False
+                connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                    else http.client.HTTPConnection)
+                connection = connection_class(parts.netloc, timeout=timeout)
+
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (ConnectionError, http.client.RemoteDisconnected) as error:
+                connection.close()
+                # The upstream closed an idle connection, which is retried right away on another connection
+                if not reused:
+                    raise
+                self._log.debug("Pooled connection to %s was closed: %s", parts.netloc, error)
+            except Exception:
+                connection.close()
+                raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, response.headers, body
+
+    def _pool(self, scheme, netloc):
+        with self._pools_lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                pool = queue.LifoQueue(self._max_idle_connections)
+                self._pools[(scheme, netloc)] = pool
+            return pool
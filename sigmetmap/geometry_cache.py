@@ -0,0 +1,137 @@
+import hashlib
+import json
+import logging
+import threading
+
+from shapely.geometry import asShape, Point
+from shapely.prepared import prep
+
+from model import CachedGeometry
+
+
+class GeometryCache:
+    """
+    Caches the repaired shapely geometries of SIGMET, AIRMET and CWA features and their visible part per region.
+
+    Entries are keyed by the content of the GEOJSON geometry, so an unchanged feature is only converted and repaired
+    once, no matter how many regions and renders it appears in. An entry is evicted as soon as the feature is no
+    longer part of any feature collection it was synced with.
+    """
+    _log = logging.getLogger('geometry_cache')
+
+    def __init__(self):
+        self._entries = {}
+        self._references = {}
+        self._prepared_regions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(feat):
+        """
+        :param feat: GEOJSON feature
+        :return: Key identifying the geometry of the feature by its content
+        """
+        content = json.dumps(feat["geometry"], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def sync(self, region, source, features):
+        """
+        Records which features are currently part of a feature collection and evicts all entries which are no
+        longer part of any feature collection.
+
+        :param region: Region in which the features are plotted
+        :param source: Name of the feature collection, e.g. sigmets_international
+        :param features: The list of GEOJSON features currently in the collection
+        """
+        keys = set(self.key(feat) for feat in features)
+        with self._lock:
+            previous = self._references.get((region, source), set())
+            self._references[(region, source)] = keys
+            removed = [key for key in previous - keys
+                       if not any(key in referenced for referenced in self._references.values())]
+            for key in removed:
+                self._entries.pop(key, None)
+        if removed:
+            self._log.debug("Evicted %d geometries which left region=%s source=%s", len(removed), region, source)
+
+    def get(self, feat):
+        """
+        Provides the repaired shapely geometry of a feature.
+
+        :param feat: GEOJSON feature
+        :return: CachedGeometry, its geometry is None if the polygon has less than 3 elements in its shell
+        :raises ValueError: If the geometry is neither a polygon nor a point
+        """
+        key = self.key(feat)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = CachedGeometry(key, self._to_shape(feat))
+            with self._lock:
+                entry = self._entries.setdefault(key, entry)
+        return entry
+
+    def region_centroid(self, entry, region, region_box):
+        """
+        Provides the centroid of the part of the geometry which is visible in the region.
+
+        :param entry: CachedGeometry as returned by get
+        :param region: Name of the region
+        :param region_box: Polygon of the visible region in PlateCarree coordinates
+        :return: Centroid Point or None if the geometry does not intersect the region
+        """
+        if region not in entry.region_centroids:
+            if self._prepared(region, region_box).intersects(entry.geometry):
+                centroid = entry.geometry.intersection(region_box).centroid
+            else:
+                centroid = None
+            entry.region_centroids[region] = centroid
+        return entry.region_centroids[region]
+
+    def _prepared(self, region, region_box):
+        prepared = self._prepared_regions.get(region)
+        if prepared is None or prepared.context is not region_box:
+            prepared = prep(region_box)
+            with self._lock:
+                self._prepared_regions[region] = prepared
+                # Centroids were calculated for a different region box
+                for entry in self._entries.values():
+                    entry.region_centroids.pop(region, None)
+        return prepared
+
+    def _to_shape(self, feat):
+        if feat["geometry"]["type"] == "Polygon":
+            # convert the geometry to shapely
+            geom_raw = asShape(feat["geometry"])
+            if len(geom_raw.shell) > 2:
+                return geom_raw.buffer(0)
+            self._log.warning("Encountered feature which had less than 2 elements in its shell feature=%s", feat)
+            return None
+        elif feat["geometry"]["type"] == "Point":
+            return Point(feat["geometry"]["coordinates"][0], feat["geometry"]["coordinates"][1])
+        else:
+            self._log.error("Encountered geometry which was neither a polygon nor a point. feature=%s", feat)
+            raise ValueError('Geometry type was neither Polygon nor Point.')
+
+    def forget(self, region):
+        """
+        Drops everything recorded for a region which will not be rendered again, e.g. an evicted custom region.
+
+        :param region: Name of the region
+        """
+        with self._lock:
+            for key in [key for key in self._references if key[0] == region]:
+                del self._references[key]
+            self._prepared_regions.pop(region, None)
+            for entry in self._entries.values():
+                entry.region_centroids.pop(region, None)
+            referenced = set().union(*self._references.values())
+            for key in [key for key in self._entries if key not in referenced]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
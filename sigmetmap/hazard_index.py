@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+
+from shapely.geometry import Point, LineString, MultiPoint
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from feature_store import sigmet_collections
+from geometry_cache import GeometryCache
+from model import Metars, SIGMET_SOURCES
+
+# Distances are given in nautical miles and applied in degrees, one nautical mile being one minute of latitude
+NAUTICAL_MILES_PER_DEGREE = 60.0
+
+
+class HazardIndex:
+    """
+    Answers which SIGMETs, AIRMETs and CWAs affect a point, a list of airports or a route.
+
+    Every feature collection has its own STRtree of its repaired geometries, which is only rebuilt when the feature
+    store published a changed payload of the collection. Geometries of features which did not change are taken
+    from the geometry cache instead of being repaired again. The worldwide CWAs are one of the sources of the
+    feature store.
+    """
+    _log = logging.getLogger('hazard_index')
+
+    def __init__(self, feature_store, geometry_cache=None, metar_radius=25):
+        """
+        :param feature_store: FeatureStore providing the worldwide SIGMETs, AIRMETs, CWAs and METARs
+        :param geometry_cache: GeometryCache of the repaired feature geometries
+        :param metar_radius: Nautical miles around the queried geometry in which METARs are returned
+        """
+        self._feature_store = feature_store
+        self._geometry_cache = geometry_cache if geometry_cache is not None else GeometryCache()
+        self._metar_radius = metar_radius
+        # Per collection: (indexed payload, list of (feature, geometry), STRtree)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        feature_store.add_listener(self._on_change)
+
+    def query(self, geometry, buffer=0):
+        """
+        Finds all hazards intersecting the geometry and the METARs close to it.
+
+        :param geometry: Point, MultiPoint or LineString in PlateCarree coordinates
+        :param buffer: Nautical miles around the geometry which are searched for hazards
+        :return: Dictionary with the list of hazards and the list of METARs, both empty if the searched area is empty
+        """
+        start = time.perf_counter()
+        area = geometry.buffer(buffer / NAUTICAL_MILES_PER_DEGREE) if buffer > 0 else geometry
+        if area.is_empty:
+            return {"hazards": [], "metars": []}
+        prepared_area = prep(area)
+
+        snapshot = self._feature_store.snapshot()
+        payloads = sigmet_collections(snapshot)
+        hazards = []
+        for source, label_property, text_property in SIGMET_SOURCES:
+            _, entries, tree = self._index(source, payloads[source])
+            for item in sorted(tree.query_items(area)):
+                feat, feature_geometry = entries[item]
+                if prepared_area.intersects(feature_geometry):
+                    hazards.append({"source": source,
+                                    "hazard": feat["properties"].get(label_property),
+                                    "text": feat["properties"].get(text_property),
+                                    "unknown": feat["properties"].get("geom", "") == "UNK"})
+
+        metars = self._nearby_metars(snapshot.payloads["metars"],
+                                     geometry.buffer((buffer + self._metar_radius) / NAUTICAL_MILES_PER_DEGREE))
+        self._log.debug("Queried hazards in %.1fms", (time.perf_counter() - start) * 1000)
+        return {"hazards": hazards, "metars": metars}
+
+    def query_point(self, longitude, latitude, buffer=0):
+        return self.query(Point(longitude, latitude), buffer)
+
+    def query_airports(self, airports, buffer=0):
+        """
+        :param airports: List of (longitude, latitude) of the airports
+        :param buffer: Nautical miles around each airport which are searched for hazards
+        :return: List of query results, one per airport
+        """
+        return [self.query_point(longitude, latitude, buffer) for longitude, latitude in airports]
+
+    def query_route(self, waypoints, buffer=0):
+        """
+        :param waypoints: List of (longitude, latitude) of the route
+        :param buffer: Nautical miles on both sides of the route which are searched for hazards
+        :return: Query result of the whole route
+        """
+        route = LineString(waypoints) if len(waypoints) > 1 else MultiPoint(waypoints)
+        return self.query(route, buffer)
+
+    def _on_change(self, name, snapshot):
+        if any(name == source for source, _, _ in SIGMET_SOURCES):
+            self._index(name, snapshot.payloads[name])
+
+    def _index(self, source, payload):
+        index = self._indexes.get(source)
+        if index is not None and index[0] is payload:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(source)
+            if index is not None and index[0] is payload:
+                return index
+            start = time.perf_counter()
+            features = payload.get("features", [])
+            self._geometry_cache.sync("hazard_index", source, features)
+            entries = []
+            for feat in features:
+                try:
+                    geometry = self._geometry_cache.get(feat).geometry
+                except ValueError:
+                    continue
+                if geometry is not None and not geometry.is_empty:
+                    entries.append((feat, geometry))
+            # query_items of the tree returns the positions of the geometries in entries
+            tree = STRtree([geometry for _, geometry in entries])
+            index = (payload, entries, tree)
+            self._indexes[source] = index
+            self._log.info("Indexed %d geometries of source=%s in %.1fms", len(entries), source,
+                           (time.perf_counter() - start) * 1000)
+            return index
+
+    @staticmethod
+    def _nearby_metars(metars, area):
+        if area.is_empty:
+            return []
+        x_min, y_min, x_max, y_max = area.bounds
+        candidates = ((metars.longitude >= x_min) & (metars.longitude <= x_max) &
+                      (metars.latitude >= y_min) & (metars.latitude <= y_max)).nonzero()[0]
+        # Only the few stations within the bounds of the area are tested exactly
+        prepared_area = prep(area)
+        inside = [i for i in candidates
+                  if prepared_area.contains(Point(float(metars.longitude[i]), float(metars.latitude[i])))]
+        return [{"longitude": float(metars.longitude[i]), "latitude": float(metars.latitude[i]),
+                 "flight_category": Metars.CATEGORIES[metars.category[i]],
+                 "observation_time": int(metars.observation_time[i])} for i in inside]
@@ -0,0 +1,113 @@
+import logging
+import math
+import threading
+
+import numpy as np
+from matplotlib.transforms import Affine2D
+from PIL import Image, features as pil_features
+
+
+class ImageEncoder:
+    """
+    Encodes a drawn figure straight from the RGBA buffer of its Agg canvas.
+
+    The figure is drawn once and cropped to its tight bounding box, which is only computed for the first render
+    of a region and then reused, since the title, the legend and the map of a region never move. Saving with
+    bbox_inches="tight" in comparison draws the whole figure twice for every render.
+    """
+    _log = logging.getLogger('image_encoder')
+
+    FORMATS = ('png', 'webp')
+
+    def __init__(self, format='png', compress_level=3, quantize_colors=256, webp_quality=80, pad_inches=0.2):
+        """
+        :param format: Image format, 'png' or 'webp'
+        :param compress_level: zlib compression level of PNG images from 0 to 9, lower levels are faster
+        :param quantize_colors: Number of colors of a palette PNG, None keeps all colors of the RGBA image
+        :param webp_quality: Quality of lossy WebP images from 0 to 100
+        :param pad_inches: Padding around the tight bounding box
+        :raises ValueError: If the format is not supported
+        """
+        if format not in self.FORMATS:
+            raise ValueError("Unsupported image format %s, expected one of %s" % (format, self.FORMATS))
+        if format == 'webp' and not pil_features.check('webp'):
+            raise ValueError("Pillow was built without WebP support")
+        self.format = format
+        self._compress_level = compress_level
+        self._quantize_colors = quantize_colors
+        self._webp_quality = webp_quality
+        self._pad_inches = pad_inches
+        self._crops = {}
+        self._crops_lock = threading.Lock()
+
+    @property
+    def extension(self):
+        return "." + self.format
+
+    def encode(self, plot_definition, output_path, timings):
+        """
+        Draws the figure of the PlotDefinition and writes it cropped to its tight bounding box.
+
+        :param plot_definition: PlotDefinition with all features plotted
+        :param output_path: Path or binary file object the image is written to
+        :param timings: Timings receiving the draw and encode stages
+        """
+        fig = plot_definition.fig
+        canvas = fig.canvas
+        with timings.stage('draw'):
+            canvas.draw()
+        with timings.stage('encode'):
+            rows, columns = self.crop(plot_definition)
+            self.save(Image.fromarray(np.asarray(canvas.buffer_rgba())[rows, columns], 'RGBA'), output_path)
+
+    def save(self, image, output_path):
+        """
+        Writes an RGBA image in the format of this encoder.
+
+        :param image: PIL RGBA image
+        :param output_path: Path or binary file object the image is written to
+        """
+        if self.format == 'webp':
+            image.save(output_path, 'WEBP', quality=self._webp_quality, method=0)
+        elif self._quantize_colors is not None:
+            image.quantize(self._quantize_colors, method=Image.Quantize.FASTOCTREE).save(
+                output_path, 'PNG', compress_level=self._compress_level)
+        else:
+            image.save(output_path, 'PNG', compress_level=self._compress_level)
+
+    def forget(self, region):
+        """
+        Drops the tight crops of a region which will not be rendered again.
+        """
+        with self._crops_lock:
+            for key in [key for key in self._crops if key[0] == region]:
+                del self._crops[key]
+
+    def crop(self, plot_definition):
+        """
+        :param plot_definition: PlotDefinition with all features plotted
+        :return: Slices of the rows and columns of the tight bounding box in the RGBA buffer
+        """
+        fig = plot_definition.fig
+        width, height = fig.canvas.get_width_height()
+        key = (plot_definition.region, width, height, fig.dpi)
+        crop = self._crops.get(key)
+        if crop is None:
+            crop = self._tight_crop(fig, width, height)
+            with self._crops_lock:
+                self._crops[key] = crop
+            self._log.debug("Computed the tight crop of region=%s rows=%s columns=%s", plot_definition.region,
+                            crop[0], crop[1])
+        return crop
+
+    def _tight_crop(self, fig, width, height):
+        """
+        Computes the pixel rows and columns of the tight bounding box the same way print_figure does.
+        """
+        renderer = fig.canvas.get_renderer()
+        bbox = fig.get_tightbbox(renderer, bbox_extra_artists=[]).padded(self._pad_inches)
+        pixels = bbox.transformed(Affine2D().scale(fig.dpi))
+        # The buffer starts at the top of the figure, display coordinates at the bottom
+        x0, x1 = max(0, math.floor(pixels.x0)), min(width, math.ceil(pixels.x1))
+        y0, y1 = max(0, math.floor(height - pixels.y1)), min(height, math.ceil(height - pixels.y0))
+        return slice(y0, y1), slice(x0, x1)
@@ -0,0 +1,102 @@
+import cProfile
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Timings:
+    """
+    Durations of the stages and counters of one render.
+
+    Timings only contain plain dictionaries, so they can be returned from a render worker process.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the duration of the with block and adds it to the stage name.
+
+        :param name: Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def merge(self, other):
+        for name, duration in other.durations.items():
+            self.durations[name] = self.durations.get(name, 0.0) + duration
+        for name, value in other.counts.items():
+            self.count(name, value)
+
+
+class MetricsSender:
+    """
+    Sends metrics to Graphite using the client created by FlaskGraphite.
+
+    If no client is available the metrics are only logged.
+    """
+    _log = logging.getLogger('metrics_sender')
+
+    def __init__(self, client=None, prefix='sigmet_map'):
+        """
+        :param client: graphitesend GraphiteClient, usually app.graphite
+        :param prefix: Prefix of all metric names
+        """
+        self._client = client
+        self._prefix = prefix
+        self._lock = threading.Lock()
+
+    def send(self, name, value):
+        metric = self._prefix + "." + name
+        self._log.debug("metric %s=%s", metric, value)
+        if self._client is None:
+            return
+        try:
+            with self._lock:
+                self._client.send(metric, value)
+        except Exception as error:
+            self._log.warning("Sending metric=%s failed: %s", metric, error)
+
+    def send_timings(self, prefix, timings):
+        """
+        Sends all stage durations in milliseconds and all counters of timings.
+
+        :param prefix: Prefix of the metric names, e.g. render.eu
+        :param timings: Timings to send
+        """
+        for name, duration in timings.durations.items():
+            self.send("%s.%s_ms" % (prefix, name), round(duration * 1000, 3))
+        for name, value in timings.counts.items():
+            self.send("%s.%s" % (prefix, name), value)
+
+
+@contextmanager
+def profiled(output_path):
+    """
+    Profiles the with block with cProfile and writes the stats to output_path, does nothing if it is None.
+
+    :param output_path: Path of the stats file, which can be read with pstats
+    """
+    if output_path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(output_path)
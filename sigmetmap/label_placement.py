@@ -0,0 +1,168 @@
+import logging
+import math
+import time
+
+ARROW_PROPS = dict(arrowstyle='->', color='0.15', shrinkA=3, shrinkB=3, connectionstyle="arc3,rad=0.")
+
+
+class AdjustTextLabelPlacer:
+    """
+    Places the labels using adjust_text, which iteratively repels all overlapping labels.
+    """
+    _log = logging.getLogger('adjust_text_label_placer')
+
+    def place(self, ax, texts):
+        """
+        Moves the texts on ax so that they do not overlap.
+
+        :param ax: Axis containing the texts
+        :param texts: List of matplotlib Text objects to place
+        """
+        # adjustText imports pyplot, it is only loaded if this placer is used
+        from adjustText import adjust_text
+
+        self._log.debug("Placing %d labels", len(texts))
+        adjust_text(texts, ha='center', va='center', expand_text=(0.9, 0.9), autoalign=False,
+                    on_basemap=True, text_from_points=False, arrowprops=ARROW_PROPS, force_text=(0.8, 0.8))
+
+
+class GreedyLabelPlacer:
+    """
+    Places the labels one after another at the first position around their anchor which does not collide with an
+    already placed label.
+
+    The extents of the texts are cached across renders and collisions are checked against a grid index of the
+    placed labels. Once max_seconds have passed all remaining labels stay at their anchor, which bounds the time
+    spent on placing labels no matter how busy the map is.
+    """
+    _log = logging.getLogger('greedy_label_placer')
+
+    # Directions tried on every ring around the anchor, starting straight above
+    _directions = [(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (1, -1), (-1, -1), (-1, 1)]
+
+    def __init__(self, max_seconds=0.5, max_rings=6, padding=2):
+        """
+        :param max_seconds: Time budget for placing all labels of one map
+        :param max_rings: Number of rings of candidate positions tried around the anchor
+        :param padding: Padding in pixels added around every label
+        """
+        self._max_seconds = max_seconds
+        self._max_rings = max_rings
+        self._padding = padding
+        self._extents = {}
+
+    def place(self, ax, texts):
+        """
+        Moves the texts on ax so that they do not overlap.
+
+        :param ax: Axis containing the texts
+        :param texts: List of matplotlib Text objects to place
+        """
+        if not texts:
+            return
+        renderer = ax.get_figure().canvas.get_renderer()
+        deadline = time.perf_counter() + self._max_seconds
+        axis_box = ax.bbox.extents
+        to_display = ax.transData.transform
+        to_data = ax.transData.inverted().transform
+
+        sizes = [self._extent(text, renderer) for text in texts]
+        cell_size = max(max(width, height) for width, height in sizes)
+        grid = SpatialGrid(cell_size)
+
+        moved = 0
+        for text, (width, height) in zip(texts, sizes):
+            anchor_x, anchor_y = to_display(text.get_position())
+            x, y = anchor_x, anchor_y
+            if time.perf_counter() < deadline:
+                x, y = self._free_position(grid, anchor_x, anchor_y, width, height, axis_box)
+
+            grid.insert(_box(x, y, width, height))
+            if (x, y) != (anchor_x, anchor_y):
+                moved += 1
+                text.set_position(to_data((x, y)))
+                ax.annotate("", xy=to_data((anchor_x, anchor_y)), xytext=to_data((x, y)), arrowprops=ARROW_PROPS,
+                            zorder=text.get_zorder())
+
+        self._log.debug("Placed %d labels, moved %d of them", len(texts), moved)
+
+    def _free_position(self, grid, anchor_x, anchor_y, width, height, axis_box):
+        step_x = width / 2
+        step_y = height / 2
+        candidates = [(anchor_x, anchor_y)]
+        for ring in range(1, self._max_rings + 1):
+            candidates.extend((anchor_x + direction_x * step_x * ring, anchor_y + direction_y * step_y * ring)
+                              for direction_x, direction_y in self._directions)
+
+        for x, y in candidates:
+            candidate = _box(x, y, width, height)
+            inside = (candidate[0] >= axis_box[0] and candidate[1] >= axis_box[1] and
+                      candidate[2] <= axis_box[2] and candidate[3] <= axis_box[3])
+            if inside and not grid.collides(candidate):
+                return x, y
+        return anchor_x, anchor_y
+
+    def _extent(self, text, renderer):
+        key = (text.get_text(), text.get_fontsize(), text.get_fontweight(), renderer.dpi)
+        extent = self._extents.get(key)
+        if extent is None:
+            window_extent = text.get_window_extent(renderer)
+            extent = (window_extent.width + 2 * self._padding, window_extent.height + 2 * self._padding)
+            self._extents[key] = extent
+        return extent
+
+
+class SpatialGrid:
+    """
+    Uniform grid index of axis aligned boxes (x0, y0, x1, y1).
+    """
+
+    def __init__(self, cell_size):
+        self._cell_size = max(cell_size, 1)
+        self._cells = {}
+
+    def insert(self, box):
+        for cell in self._cells_of(box):
+            self._cells.setdefault(cell, []).append(box)
+
+    def collides(self, box):
+        for cell in self._cells_of(box):
+            for other in self._cells.get(cell, ()):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    return True
+        return False
+
+    def _cells_of(self, box):
+        x0, y0 = math.floor(box[0] / self._cell_size), math.floor(box[1] / self._cell_size)
+        x1, y1 = math.floor(box[2] / self._cell_size), math.floor(box[3] / self._cell_size)
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def _box(x, y, width, height):
+    return x - width / 2, y - height / 2, x + width / 2, y + height / 2
+
+
+class AnchoredLabelPlacer:
+    """
+    Leaves every label at its anchor, e.g. for degraded renders under load.
+    """
+
+    def place(self, ax, texts):
+        pass
+
+
+LABEL_PLACERS = {'adjust_text': AdjustTextLabelPlacer,
+                 'greedy': GreedyLabelPlacer,
+                 'anchored': AnchoredLabelPlacer}
+
+
+def create_label_placer(settings):
+    """
+    Creates the label placer configured in settings.
+
+    :param settings: Dictionary with the name of the placer in 'engine', all other entries are passed to the placer
+    :return: Label placer instance
+    """
+    settings = dict(settings)
+    engine = settings.pop('engine', 'adjust_text')
+    return LABEL_PLACERS[engine](**settings)
@@ -0,0 +1,321 @@
+import collections
+import hashlib
+import io
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from descartes import PolygonPatch
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PatchCollection
+from matplotlib.figure import Figure
+from PIL import Image
+from shapely.geometry import box, Point
+from shapely.ops import transform
+
+from color_scheme import DefaultColorScheme, metar_colors
+from feature_store import sigmet_collections
+from geometry_cache import GeometryCache
+from image_encoder import ImageEncoder
+from model import MapTile, SIGMET_SOURCES
+
+EARTH_RADIUS = 6378137.0
+# Half of the width and height of the Web Mercator world in meters
+WEB_MERCATOR_EXTENT = math.pi * EARTH_RADIUS
+WEB_MERCATOR_MAX_LATITUDE = 85.0511287798
+# Pixels around a tile in which features are still drawn into it, covering the outlines and METAR markers which
+# reach over the edge of the tile
+MARGIN_PIXELS = 8
+
+_WEB_MERCATOR_BOX = box(-360, -WEB_MERCATOR_MAX_LATITUDE, 360, WEB_MERCATOR_MAX_LATITUDE)
+
+
+def web_mercator(longitude, latitude):
+    """
+    :param longitude: Longitudes in degrees, a number or an array
+    :param latitude: Latitudes in degrees, a number or an array
+    :return: x and y in Web Mercator meters
+    """
+    latitude = np.clip(latitude, -WEB_MERCATOR_MAX_LATITUDE, WEB_MERCATOR_MAX_LATITUDE)
+    return (np.radians(longitude) * EARTH_RADIUS,
+            np.log(np.tan(np.pi / 4 + np.radians(latitude) / 2)) * EARTH_RADIUS)
+
+
+def tile_bounds(zoom, x, y):
+    """
+    :param zoom: Zoom level of the tile
+    :param x: Column of the tile, counted from the west
+    :param y: Row of the tile, counted from the north
+    :return: Bounds of the tile (x_min, y_min, x_max, y_max) in Web Mercator meters
+    """
+    size = 2 * WEB_MERCATOR_EXTENT / 2 ** zoom
+    x_min = -WEB_MERCATOR_EXTENT + x * size
+    y_max = WEB_MERCATOR_EXTENT - y * size
+    return x_min, y_max - size, x_min + size, y_max
+
+
+class MapTiles:
+    """
+    Renders the SIGMETs, AIRMETs, CWAs and METARs as transparent XYZ tiles in Web Mercator for web maps.
+
+    Tiles are rendered when they are requested and kept in an LRU of at most max_tiles tiles. The tiles are drawn
+    from the current snapshot of the feature store, the repaired geometries are taken from the geometry cache and
+    projected into Web Mercator only once per feature. When a new snapshot arrives, only the cached tiles which
+    overlap a feature or a METAR that appeared, changed or disappeared are dropped, all other tiles stay valid.
+    METARs fade out with their age, so tiles showing METARs are additionally rendered again after max_age seconds,
+    when clients request them again.
+    """
+    _log = logging.getLogger('map_tiles')
+
+    def __init__(self, feature_store, geometry_cache=None, image_encoder=None, color_scheme=None, max_zoom=10,
+                 max_tiles=4096, size=256, max_age=60):
+        """
+        :param feature_store: FeatureStore providing the worldwide SIGMETs, AIRMETs, CWAs and METARs
+        :param geometry_cache: GeometryCache of the repaired feature geometries
+        :param image_encoder: ImageEncoder writing the tiles, it has to write PNGs to keep them transparent
+        :param color_scheme: Color scheme of the tiles
+        :param max_zoom: Highest supported zoom level
+        :param max_tiles: Number of rendered tiles which are kept
+        :param size: Width and height of a tile in pixels
+        :param max_age: Seconds after which a tile showing METARs is rendered again with their current age
+        """
+        self._feature_store = feature_store
+        self._geometry_cache = geometry_cache if geometry_cache is not None else GeometryCache()
+        self._image_encoder = image_encoder if image_encoder is not None else ImageEncoder()
+        self._color_scheme = color_scheme if color_scheme is not None else DefaultColorScheme
+        self.max_zoom = max_zoom
+        self._max_tiles = max_tiles
+        self._size = size
+        self._max_age = max_age
+        # Payloads the shapes and METARs were built from
+        self._inputs = None
+        # Per shape key: (style, projected geometry), the bounds of all shapes are kept in one array
+        self._shapes = {}
+        self._shape_list = []
+        self._shape_bounds = np.empty((0, 4))
+        self._metars = None
+        self._metar_records = set()
+        self._metar_x = np.empty(0)
+        self._metar_y = np.empty(0)
+        # Per tile key: (MapTile, time after which it is rendered again or None)
+        self._tiles = collections.OrderedDict()
+        self._empty_tile = None
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, zoom, x, y):
+        """
+        Provides a tile, rendering it only if it is not cached for the current snapshot.
+
+        :param zoom: Zoom level from 0 to max_zoom
+        :param x: Column of the tile, counted from the west
+        :param y: Row of the tile, counted from the north
+        :return: MapTile
+        :raises ValueError: If the tile does not exist
+        """
+        if not 0 <= zoom <= self.max_zoom:
+            raise ValueError("Zoom level %d is not between 0 and %d" % (zoom, self.max_zoom))
+        if not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+            raise ValueError("Tile %d/%d does not exist at zoom level %d" % (x, y, zoom))
+
+        self._sync()
+        key = (zoom, x, y)
+        with self._lock:
+            tile = self._cached(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+
+        # Matplotlib is not thread safe, tiles are cheap enough to be drawn one at a time
+        with self._render_lock:
+            with self._lock:
+                # Another thread might have rendered the tile while waiting for the lock
+                tile = self._cached(key)
+                shapes, metars = self._shape_list, (self._metars, self._metar_x, self._metar_y)
+                shape_bounds = self._shape_bounds
+            if tile is not None:
+                return tile
+            self.misses += 1
+            now = time.time()
+            tile, shows_metars = self._render(zoom, x, y, shapes, shape_bounds, metars, now)
+
+        with self._lock:
+            # Only keep the tile if no new snapshot arrived while it was rendered
+            if shapes is self._shape_list and metars[0] is self._metars:
+                self._tiles[key] = (tile, now + self._max_age if shows_metars else None)
+                while len(self._tiles) > self._max_tiles:
+                    self._tiles.popitem(last=False)
+        return tile
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def _cached(self, key):
+        cached = self._tiles.get(key)
+        if cached is None:
+            return None
+        tile, expires = cached
+        if expires is not None and time.time() >= expires:
+            return None
+        return tile
+
+    def _sync(self):
+        """
+        Rebuilds the shapes and METARs if the snapshot changed and drops the tiles overlapping the changes.
+        """
+        snapshot = self._feature_store.snapshot()
+        payloads = dict(sigmet_collections(snapshot), metars=snapshot.payloads["metars"])
+        inputs = tuple(payloads[source] for source, _, _ in SIGMET_SOURCES) + (payloads["metars"],)
+        if self._inputs is not None and all(current is previous for current, previous in zip(inputs, self._inputs)):
+            return
+
+        with self._lock:
+            if self._inputs is not None and all(current is previous
+                                                for current, previous in zip(inputs, self._inputs)):
+                return
+            start = time.perf_counter()
+            shapes = {}
+            for (source, _, _), payload in zip(SIGMET_SOURCES, inputs):
+                self._add_shapes(shapes, source, payload.get("features", []))
+            # Shapes which appeared or disappeared, a changed feature has a new key
+            changed = [(self._shapes.get(key) or shapes.get(key))[1].bounds
+                       for key in self._shapes.keys() ^ shapes.keys()]
+
+            metars = inputs[-1]
+            records = set(zip(metars.longitude.tolist(), metars.latitude.tolist(), metars.category.tolist(),
+                              metars.observation_time.tolist()))
+            changed_metars = list(records ^ self._metar_records)
+            if changed_metars:
+                longitude, latitude, _, _ = zip(*changed_metars)
+                metar_x, metar_y = web_mercator(np.array(longitude), np.array(latitude))
+                changed.extend(zip(metar_x, metar_y, metar_x, metar_y))
+
+            first = self._inputs is None
+            self._inputs = inputs
+            self._shapes = shapes
+            self._shape_list = list(shapes.values())
+            self._shape_bounds = np.array([geometry.bounds for _, geometry in self._shape_list]).reshape(-1, 4)
+            self._metars = metars
+            self._metar_records = records
+            self._metar_x, self._metar_y = web_mercator(metars.longitude.astype(float), metars.latitude.astype(float))
+            invalidated = len(self._tiles) if first else self._invalidate(np.array(changed).reshape(-1, 4))
+            if first:
+                self._tiles.clear()
+        self._log.info("Synced %d shapes and %d METARs in %.1fms, %d changes invalidated %d tiles", len(shapes),
+                       len(metars), (time.perf_counter() - start) * 1000, len(changed), invalidated)
+
+    def _add_shapes(self, shapes, source, features):
+        self._geometry_cache.sync("map_tiles", source, features)
+        for feat in features:
+            try:
+                entry = self._geometry_cache.get(feat)
+            except ValueError:
+                continue
+            if entry.geometry is None or entry.geometry.is_empty:
+                continue
+            if isinstance(entry.geometry, Point):
+                style = "point"
+            elif feat["properties"].get("geom", "") == "UNK":
+                style = "unknown"
+            else:
+                style = "sigmet"
+            key = (entry.key, style)
+            shape = self._shapes.get(key)
+            if shape is None:
+                # Shapes of unchanged features keep their projected geometry
+                geometry = entry.geometry.intersection(_WEB_MERCATOR_BOX)
+                if geometry.is_empty:
+                    continue
+                shape = (style, transform(web_mercator, geometry))
+            shapes[key] = shape
+
+    def _invalidate(self, changed):
+        """
+        :param changed: Array of the bounds (x_min, y_min, x_max, y_max) of all changes in Web Mercator meters
+        :return: Number of dropped tiles
+        """
+        if len(changed) == 0:
+            return 0
+        invalidated = []
+        for zoom, x, y in self._tiles:
+            x_min, y_min, x_max, y_max = self._drawn_bounds(zoom, x, y)
+            if ((changed[:, 0] <= x_max) & (changed[:, 2] >= x_min) &
+                    (changed[:, 1] <= y_max) & (changed[:, 3] >= y_min)).any():
+                invalidated.append((zoom, x, y))
+        for key in invalidated:
+            del self._tiles[key]
+        return len(invalidated)
+
+    def _drawn_bounds(self, zoom, x, y):
+        """
+        :return: Bounds of the tile including the margin in which features are drawn into the tile
+        """
+        x_min, y_min, x_max, y_max = tile_bounds(zoom, x, y)
+        margin = (x_max - x_min) / self._size * MARGIN_PIXELS
+        return x_min - margin, y_min - margin, x_max + margin, y_max + margin
+
+    def _render(self, zoom, x, y, shapes, shape_bounds, metars, now):
+        """
+        :param now: Time from which the age of the METARs is measured
+        :return: MapTile and True if it shows METARs
+        """
+        x_min, y_min, x_max, y_max = self._drawn_bounds(zoom, x, y)
+        visible_shapes = ((shape_bounds[:, 0] <= x_max) & (shape_bounds[:, 2] >= x_min) &
+                          (shape_bounds[:, 1] <= y_max) & (shape_bounds[:, 3] >= y_min)).nonzero()[0]
+        metars, metar_x, metar_y = metars
+        visible_metars = ((metar_x >= x_min) & (metar_x <= x_max) &
+                          (metar_y >= y_min) & (metar_y <= y_max)).nonzero()[0]
+        if len(visible_shapes) == 0 and len(visible_metars) == 0:
+            return self._empty(zoom, x, y), False
+
+        dpi = 100
+        fig = Figure(figsize=(self._size / dpi, self._size / dpi), dpi=dpi)
+        FigureCanvasAgg(fig)
+        fig.patch.set_alpha(0)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        x0, y0, x1, y1 = tile_bounds(zoom, x, y)
+        ax.set_xlim(x0, x1)
+        ax.set_ylim(y0, y1)
+
+        color_scheme = self._color_scheme
+        patches = {"sigmet": [], "unknown": []}
+        for index in visible_shapes:
+            style, geometry = shapes[index]
+            if style == "point":
+                ax.plot(geometry.x, geometry.y, 'o', color=color_scheme.SIGMET_COLOR, markersize=8, zorder=35)
+            else:
+                patches[style].append(PolygonPatch(geometry))
+        ax.add_collection(PatchCollection(patches["sigmet"], facecolor=color_scheme.SIGMET_COLOR,
+                                          edgecolor=color_scheme.SIGMET_COLOR, linewidths=1.5,
+                                          alpha=color_scheme.SIGMET_ALPHA, zorder=40))
+        ax.add_collection(PatchCollection(patches["unknown"], facecolor=color_scheme.SIGMET_UNKNOWN_COLOR,
+                                          linestyle='dashed', edgecolor=color_scheme.SIGMET_UNKNOWN_COLOR,
+                                          hatch="/", linewidths=1.5, alpha=color_scheme.SIGMET_UNKNOWN_ALPHA,
+                                          zorder=39))
+        if len(visible_metars):
+            colors = metar_colors(color_scheme, metars.category[visible_metars],
+                                  metars.observation_time[visible_metars], now)
+            ax.scatter(metar_x[visible_metars], metar_y[visible_metars], c=colors, edgecolors='face', s=4 ** 2,
+                       linewidths=1, marker='o', zorder=30)
+
+        fig.canvas.draw()
+        tile = self._encode(zoom, x, y, Image.fromarray(np.asarray(fig.canvas.buffer_rgba()), 'RGBA'))
+        return tile, len(visible_metars) > 0
+
+    def _empty(self, zoom, x, y):
+        # All tiles without features share one encoded transparent image
+        if self._empty_tile is None:
+            self._empty_tile = self._encode(0, 0, 0, Image.new('RGBA', (self._size, self._size)))
+        return MapTile(zoom, x, y, self._empty_tile.content_hash, self._empty_tile.image)
+
+    def _encode(self, zoom, x, y, image):
+        output = io.BytesIO()
+        self._image_encoder.save(image, output)
+        data = output.getvalue()
+        return MapTile(zoom, x, y, hashlib.sha1(data).hexdigest(), data)
@@ -0,0 +1,61 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from model import Metars
+
+_log = logging.getLogger('metar_ingest')
+
+# Only the columns which are plotted are parsed
+COLUMNS = ['observation_time', 'latitude', 'longitude', 'flight_category']
+CHUNK_SIZE = 4096
+
+
+def csv_metar_decoder(response):
+    """
+    Decompresses and parses the gzipped METAR cache CSV in chunks into compact column arrays.
+
+    :param response: File like object containing the gzipped CSV
+    :return: Metars
+    """
+    start = time.perf_counter()
+    longitude, latitude, category, observation_time = [], [], [], []
+
+    chunks = pd.read_csv(response, skiprows=5, compression='gzip', usecols=COLUMNS, chunksize=CHUNK_SIZE,
+                         dtype={'latitude': np.float32, 'longitude': np.float32, 'flight_category': 'category',
+                                'observation_time': str})
+    for chunk in chunks:
+        # Stations without a position can not be plotted
+        chunk = chunk.dropna(subset=['longitude', 'latitude'])
+        longitude.append(chunk['longitude'].to_numpy(dtype=np.float32))
+        latitude.append(chunk['latitude'].to_numpy(dtype=np.float32))
+        category.append(_category_codes(chunk['flight_category']))
+        observation_time.append(_epoch_seconds(chunk['observation_time']))
+
+    metars = Metars(_concatenate(longitude, np.float32), _concatenate(latitude, np.float32),
+                    _concatenate(category, np.int8), _concatenate(observation_time, np.int64))
+    metars.parse_seconds = time.perf_counter() - start
+    _log.info("Parsed %d METARs in %.3fs into %d bytes", len(metars), metars.parse_seconds, metars.nbytes)
+    return metars
+
+
+def _category_codes(flight_category):
+    known = Metars.CATEGORIES[:-1]
+    codes = pd.Categorical(flight_category, categories=known).codes.astype(np.int8)
+    codes[codes < 0] = len(known)
+    return codes
+
+
+def _epoch_seconds(observation_time):
+    parsed = pd.to_datetime(observation_time, utc=True, errors='coerce')
+    seconds = parsed.to_numpy(dtype='datetime64[s]').astype(np.int64)
+    seconds[parsed.isna().to_numpy()] = Metars.MISSING_TIME
+    return seconds
+
+
+def _concatenate(arrays, dtype):
+    if not arrays:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
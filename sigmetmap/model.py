@@ -1,3 +1,10 @@
+# Feature collections which are plotted and labeled, in the order in which their labels are numbered:
+# (name of the collection in Features, property containing the label, property containing the info text)
+SIGMET_SOURCES = (("sigmets_international", "hazard", "rawSigmet"),
+                  ("sigmets_us", "hazard", "rawAirSigmet"),
+                  ("cwa_us", "hazard", "cwaText"))
+
+
 class Features:
     def __init__(self, sigmets_international, sigmets_us, cwa_us, metars):
         self.metars = metars
@@ -6,18 +13,149 @@ class Features:
         self.sigmets_international = sigmets_international
 
 
+class Metars:
+    """
+    Compact column arrays of the METARs which are plotted.
+    """
+    # Flight categories in the order of their codes, all unknown categories are coded as the last entry
+    CATEGORIES = ('VFR', 'MVFR', 'IFR', 'LIFR', '?')
+    # Observation time of METARs whose observation time could not be parsed
+    MISSING_TIME = -1
+
+    def __init__(self, longitude, latitude, category, observation_time, parse_seconds=0.0):
+        """
+        :param longitude: float32 array of the station longitudes
+        :param latitude: float32 array of the station latitudes
+        :param category: int8 array of the flight category codes, indices into CATEGORIES
+        :param observation_time: int64 array of the observation times in seconds since the epoch
+        :param parse_seconds: Time it took to parse the METARs
+        """
+        self.longitude = longitude
+        self.latitude = latitude
+        self.category = category
+        self.observation_time = observation_time
+        self.parse_seconds = parse_seconds
+
+    def __len__(self):
+        return len(self.longitude)
+
+    @property
+    def nbytes(self):
+        return self.longitude.nbytes + self.latitude.nbytes + self.category.nbytes + self.observation_time.nbytes
+
+    def select(self, mask):
+        """
+        :param mask: Boolean array or index array selecting METARs
+        :return: New Metars containing only the selected METARs
+        """
+        return Metars(self.longitude[mask], self.latitude[mask], self.category[mask], self.observation_time[mask],
+                      self.parse_seconds)
+
+    def equals(self, other):
+        return (len(self) == len(other) and
+                all((mine == others).all() for mine, others in zip(self._columns(), other._columns())))
+
+    def _columns(self):
+        return self.longitude, self.latitude, self.category, self.observation_time
+
+
 class PlotDefinition:
-    def __init__(self, projection, fig, ax, region_box, bbox_string, color_scheme):
+    def __init__(self, projection, fig, ax, region_box, bbox_string, color_scheme, region=None):
+        self.region = region
         self.projection = projection
         self.fig = fig
         self.ax = ax
         self.region_box = region_box
         self.bbox_string = bbox_string
         self.color_scheme = color_scheme
+        # Artists of the base map, everything else is removed when the figure is reused
+        self.base_artists = set()
 
 
 class PlotResult:
-    def __init__(self, plot_path, info, failed):
+    def __init__(self, plot_path, info, failed, timings=None, image=None):
         self.plot_path = plot_path
         self.info = info
         self.failed = failed
+        self.timings = timings
+        # Encoded image if the plot was not saved to a path
+        self.image = image
+
+
+class BaseLayer:
+    def __init__(self, geometries, style):
+        self.geometries = geometries
+        self.style = style
+
+
+class BaseMap:
+    def __init__(self, region, projection, extent, region_box, bbox_string, color_scheme, layers, view_limits):
+        self.region = region
+        self.projection = projection
+        self.extent = extent
+        self.region_box = region_box
+        # Visible part of the map in the region's projection (x0, y0, x1, y1)
+        self.view_limits = view_limits
+        self.bbox_string = bbox_string
+        self.color_scheme = color_scheme
+        self.layers = layers
+
+
+class FeatureSnapshot:
+    def __init__(self, payloads, bounds, updated):
+        self.payloads = payloads
+        self.bounds = bounds
+        self.updated = updated
+
+
+class CachedGeometry:
+    def __init__(self, key, geometry):
+        self.key = key
+        self.geometry = geometry
+        # Centroid of the visible part per region, None if the geometry is not visible in the region
+        self.region_centroids = {}
+
+
+class PublishedMap:
+    def __init__(self, region, file_name, info, failed, published, content_hash, checked, degraded=False):
+        self.region = region
+        self.file_name = file_name
+        self.info = info
+        self.failed = failed
+        self.published = published
+        self.content_hash = content_hash
+        # Last time the inputs of the region were compared to the content hash
+        self.checked = checked
+        # Rendered in the degraded mode under load, it is replaced by a regular render as soon as possible
+        self.degraded = degraded
+
+
+class VectorOverlay:
+    def __init__(self, region, zoom, content_hash, body, gzipped, checked):
+        self.region = region
+        self.zoom = zoom
+        self.content_hash = content_hash
+        # Compact JSON document and its gzip compressed version
+        self.body = body
+        self.gzipped = gzipped
+        # Last time the inputs of the region were compared to the content hash
+        self.checked = checked
+
+
+class MapTile:
+    def __init__(self, zoom, x, y, content_hash, image):
+        self.zoom = zoom
+        self.x = x
+        self.y = y
+        # Hash of the encoded image, used as its ETag
+        self.content_hash = content_hash
+        self.image = image
+
+
+class RegionSnapshot:
+    def __init__(self, time, content_hash, size):
+        # Time at which the features were loaded
+        self.time = time
+        self.content_hash = content_hash
+        # Size of the compacted features in bytes
+        self.size = size
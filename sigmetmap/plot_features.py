@@ -1,19 +1,21 @@
 import matplotlib
 matplotlib.use('Agg')
+import io
 import logging
-from datetime import datetime, timezone
-import dateutil.parser
 
 import cartopy.crs as ccrs
-from adjustText import adjust_text, get_renderer, get_bboxes
 from descartes import PolygonPatch  # integrating geom object to matplot
-from matplotlib.backends.backend_template import FigureCanvas
 from matplotlib.collections import PatchCollection
 from matplotlib.lines import Line2D
 from matplotlib.patches import Patch
-from shapely.geometry import asShape, Point  # manipulating geometry
+from shapely import vectorized
 
-from model import PlotResult
+from color_scheme import metar_colors
+from geometry_cache import GeometryCache
+from image_encoder import ImageEncoder
+from instrumentation import Timings
+from label_placement import AdjustTextLabelPlacer
+from model import PlotResult, SIGMET_SOURCES
 
 
 class PlotFeatures:
@@ -23,10 +25,26 @@ class PlotFeatures:
     """
     _log = logging.getLogger('plot_features')
 
-    def __init__(self, plot_definition, get_title):
+    def __init__(self, plot_definition, get_title, geometry_cache=None, label_placer=None, timings=None,
+                 image_encoder=None, now=None):
+        """
+        :param plot_definition: PlotDefinition of the map the features are plotted on
+        :param get_title: Callable providing the title of the map
+        :param geometry_cache: GeometryCache of the projected features
+        :param label_placer: Label placement engine, adjust_text if None
+        :param timings: Timings receiving the stages of the plot
+        :param image_encoder: ImageEncoder writing the image, a PNG encoder if None
+        :param now: Time from which the age of the METARs is measured, e.g. the time of an animation frame. Defaults
+            to the current time.
+        """
         self._color_scheme = plot_definition.color_scheme
         self._plot_definition = plot_definition
         self._get_title = get_title
+        self._geometry_cache = geometry_cache if geometry_cache is not None else GeometryCache()
+        self._label_placer = label_placer if label_placer is not None else AdjustTextLabelPlacer()
+        self._timings = timings if timings is not None else Timings()
+        self._image_encoder = image_encoder if image_encoder is not None else ImageEncoder()
+        self._now = now
 
     def plot(self, features, output_path):
         """
@@ -34,28 +52,33 @@ class PlotFeatures:
         class was instantiated.
 
         :param features: Feature object containing the parsed GEOJSON data
-        :param output_path: Path to where the plot will be saved. Only PNG supported for now!
-        :return:
+        :param output_path: Path to where the plot will be saved in the format of the image encoder, if None the
+            encoded image is returned in the PlotResult
+        :return: PlotResult
         """
         self._log.debug("Plotting features onto axis")
 
         # Storage of return values
         texts = []
+        texts_by_position = {}
         plotting_failed = []
         info = {}
 
         ax = self._plot_definition.ax
         data_crs = ccrs.PlateCarree()
 
-        def plot_features(features, label_property, text_property):
+        def plot_features(source, features, label_property, text_property):
             """
             Plots a collection of features onto the map.
 
+            :param source: Name of the feature collection, used for evicting geometries from the geometry cache
             :param features: The list of GEOJSON features
             :param label_property: Field in features[i]["properties"] which contains the label to be plotted onto the map
             :param text_property: Field in features[i]["properties"] which will be added to the infos.
             :return: Information dictionary { idx: info_text, ... }
             """
+            self._geometry_cache.sync(self._plot_definition.region, source, features)
+
             patches = []
             patches_unkown = []
             for feat in features:
@@ -89,60 +112,51 @@ class PlotFeatures:
             :param text_property: Field in feat["properties"] which contains the text will be added to the info
             :return: Information dictionary with one element { idx: info_text }
             """
+            entry = self._geometry_cache.get(feat)
+            geom = entry.geometry
+            if geom is None:
+                # Polygon with less than 3 elements in its shell, already reported by the geometry cache
+                return
+
             if feat["geometry"]["type"] == "Polygon":
-                # convert the geometry to shapely
-                geom_raw = asShape(feat["geometry"])
-                if len(geom_raw.shell) > 2:
-                    geom = geom_raw.buffer(0)
-                    label_geometry(geom, feat, label_property, text_property)
-
-                    if feat["properties"].get("geom", "") == "UNK":
-                        patches_unkown.append(PolygonPatch(geom))
-                    else:
-                        patches.append(PolygonPatch(geom))
+                label_geometry(entry, feat, label_property, text_property)
+
+                if feat["properties"].get("geom", "") == "UNK":
+                    patches_unkown.append(PolygonPatch(geom))
                 else:
-                    self._log.warning("Encountered feature which had less than 2 elements in its shell feature=%s",
-                                      feat)
-            elif feat["geometry"]["type"] == "Point":
-                geom = Point(feat["geometry"]["coordinates"][0], feat["geometry"]["coordinates"][1])
+                    patches.append(PolygonPatch(geom))
+            else:
                 ax.plot(geom.x, geom.y, 'o', color=self._color_scheme.SIGMET_COLOR, markersize=8,
                         zorder=35, transform=data_crs)
-                label_geometry(geom, feat, label_property, text_property)
-            else:
-                self._log.error("Encountered geometry which was neither a polygon nor a point. feature=%s", feat)
-                raise ValueError('Geometry type was neither Polygon nor Point.')
+                label_geometry(entry, feat, label_property, text_property)
 
-        def find_text(x, y):
-            for text in texts:
-                text_x, text_y = text.get_position()
-                if text_x == x and text_y == y:
-                    return text
-            return None
-
-        def label_geometry(geom, feat, label_property, text_property):
+        def label_geometry(entry, feat, label_property, text_property):
             """
             Labels one geometry elements. Usually a  SIMGET or AIRMET patch.
 
-            The label will be placed in the centroid of the visible part of geom.
+            The label will be placed in the centroid of the visible part of the geometry.
 
-            :param geom: Geometry to be labeled.
+            :param entry: CachedGeometry to be labeled.
             :param feat: GEOJSON Feature
             :param label_property: Field in feat["properties"] which contains the label to be plotted on the map
             :param text_property: Field in feat["properties"] which contains the text will be added to the info
             :return: Information dictionary with one element { idx: info_text }
             """
-            centroid = geom.intersection(self._plot_definition.region_box).centroid
+            centroid = self._geometry_cache.region_centroid(entry, self._plot_definition.region,
+                                                            self._plot_definition.region_box)
 
-            if geom.intersects(self._plot_definition.region_box):
+            if centroid is not None:
                 idx = len(info) + 1
                 label = feat["properties"][label_property]
                 label = self._color_scheme.TEXT_REPLACEMENT.get(label, label)
                 text = label + "\n" + str(idx) + "."
 
                 text_x, text_y = self._plot_definition.projection.transform_point(centroid.x, centroid.y, data_crs)
-                conflicting_text = find_text(text_x, text_y)
+                conflicting_text = texts_by_position.get((text_x, text_y))
                 if conflicting_text:
                     self._log.debug("Resolving conflicting text")
+                    # adjustText imports pyplot, it is only loaded if two labels share their position
+                    from adjustText import get_renderer, get_bboxes
                     r = get_renderer(self._plot_definition.ax.get_figure())
                     bbox = get_bboxes([conflicting_text], r, (1.0, 1.0), ax)
                     text_x = text_x - bbox[0].width / 10
@@ -152,51 +166,58 @@ class PlotFeatures:
                                    verticalalignment='center', zorder=50, fontweight="heavy",
                                    fontsize=8)
                 texts.append(new_text)
+                texts_by_position[(text_x, text_y)] = new_text
                 info[idx] = feat["properties"][text_property]
 
-        def plot_metars(metar_features):
+        def plot_metars(metars):
             """
             Plots metars on the map.
 
-            :param metar_features: GEOJSON METAR feature list
+            All stations inside the region are drawn by a single scatter artist, the containment test, colors and
+            age based transparency are calculated for all stations at once.
+
+            :param metars: Metars of the region
             :return:
             """
             self._log.debug("Plotting METARs")
 
-            for index, feat in metar_features.iterrows():
-                geom = Point(feat['longitude'], feat['latitude'])
-
-                if self._plot_definition.region_box.contains(geom):
-                    label = feat['flight_category']
-                    color = self._color_scheme.METAR_FLIGHT_CATEGORY_COLORS.get(label,
-                                                                                self._color_scheme.METAR_COLOR_UNKOWN)
-
-                    age = datetime.now(timezone.utc) - dateutil.parser.parse(feat['observation_time'])
-                    age_m = age.total_seconds()/60
-                    alpha_age_factor = min(1, -1/90 * age_m + 4/3)
-                    alpha = self._color_scheme.METAR_ALPHA * alpha_age_factor
-
-                    ax.plot(geom.x, geom.y, 'o', color=color, markersize=4,
-                            zorder=30, alpha=alpha, transform=data_crs)
-
-        plot_features(features.sigmets_international["features"], "hazard", "rawSigmet")
-        plot_features(features.sigmets_us["features"], "hazard", "rawAirSigmet")
-        plot_features(features.cwa_us["features"], "hazard", "cwaText")
-
-        plot_metars(features.metars)
-
-        adjust_text(texts, ha='center', va='center', expand_text=(0.9, 0.9), autoalign=False,
-                    on_basemap=True, text_from_points=False,
-                    arrowprops=dict(arrowstyle='->', color='0.15', shrinkA=3, shrinkB=3, connectionstyle="arc3,rad=0."),
-                    force_text=(0.8, 0.8))
+            longitude = metars.longitude.astype(float)
+            latitude = metars.latitude.astype(float)
+            inside = vectorized.contains(self._plot_definition.region_box, longitude, latitude)
+            if not inside.any():
+                return
+
+            colors = metar_colors(self._color_scheme, metars.category[inside], metars.observation_time[inside],
+                                  self._now)
+            ax.scatter(longitude[inside], latitude[inside], c=colors, edgecolors='face', s=4 ** 2, linewidths=1,
+                       marker='o', zorder=30, transform=data_crs)
+
+        timings = self._timings
+        hits, misses = self._geometry_cache.hits, self._geometry_cache.misses
+        with timings.stage('sigmets'):
+            for source, label_property, text_property in SIGMET_SOURCES:
+                plot_features(source, getattr(features, source)["features"], label_property, text_property)
+        timings.count('sigmets', sum(len(getattr(features, source)["features"]) for source, _, _ in SIGMET_SOURCES))
+        timings.count('geometry_cache_hits', self._geometry_cache.hits - hits)
+        timings.count('geometry_cache_misses', self._geometry_cache.misses - misses)
+
+        with timings.stage('metars'):
+            plot_metars(features.metars)
+        timings.count('metars', len(features.metars))
+
+        with timings.stage('labels'):
+            self._label_placer.place(ax, texts)
+        timings.count('labels', len(texts))
 
         self._plot_legend(ax, plotting_failed)
 
-        canvas = FigureCanvas(self._plot_definition.fig)
-        canvas.print_figure(output_path, format="png", pad_inches=0.2, bbox_inches="tight",
-                            bbox_extra_artists=[], dpi=90)
+        if output_path is None:
+            image = io.BytesIO()
+            self._image_encoder.encode(self._plot_definition, image, timings)
+            return PlotResult(None, info, plotting_failed, timings, image.getvalue())
 
-        return PlotResult(output_path, info, plotting_failed)
+        self._image_encoder.encode(self._plot_definition, output_path, timings)
+        return PlotResult(output_path, info, plotting_failed, timings)
 
     def _plot_legend(self, ax, plotting_failed):
         """
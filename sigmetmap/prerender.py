@@ -0,0 +1,228 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from admission import Saturated
+from content_hash import content_hash
+from custom_region import is_custom_region
+from instrumentation import Timings
+from model import PublishedMap
+
+
+class PreRenderer:
+    """
+    Renders every region ahead of the requests and publishes the newest map of each region.
+
+    The regions are rendered whenever the feature store received changed data and additionally on a fixed interval,
+    which picks up changed CWAs. A new map is only published after its image was stored in the artifact store,
+    requests always get the latest published map without waiting for a render.
+
+    If the content hash of the inputs of a region did not change since the last render, the published map is kept
+    and nothing is rendered.
+
+    Published maps are kept in a cache shared by all worker processes. Renders of a region are single flight: only
+    one thread of all processes renders a region at a time. A map which was checked more than fresh seconds ago is
+    still served while it is revalidated in the background, only a map older than max_stale makes requests wait.
+
+    Custom regions are rendered on their first request and then revalidated like the other regions while they are
+    requested. Their artifacts are not pinned, so they expire once nobody requests the region any more.
+
+    Renders pass the admission control. While all render slots are taken, a region which was published before keeps
+    its map instead of queueing for a render, only regions without any map wait. A map rendered in the degraded mode
+    is replaced by a regular render on the next revalidation.
+    """
+    _log = logging.getLogger('pre_renderer')
+
+    def __init__(self, regions, load_features, render, get_title, artifact_store, cache, single_flight, fresh=60,
+                 max_stale=600, metrics=None, extension=".png", history=None, admission=None, custom_max_age=3600):
+        """
+        :param regions: List of regions to render
+        :param load_features: Callable loading the Features of a region, load_features(region)
+        :param render: Callable rendering features, render(region, features, output_path, degraded) returning a
+            PlotResult. It is called with output_path None and has to return the encoded image in the PlotResult.
+        :param get_title: Callable providing the title of the map
+        :param artifact_store: ArtifactStore storing the images
+        :param cache: Cache shared by all processes, storing the published maps
+        :param single_flight: SingleFlight locks shared by all processes
+        :param fresh: Seconds after which a published map is revalidated in the background
+        :param max_stale: Seconds after which a published map is no longer served without revalidating it first
+        :param metrics: MetricsSender receiving the stage timings of every render
+        :param extension: File extension of the rendered images
+        :param history: SnapshotHistory recording the loaded features of the regions
+        :param admission: AdmissionControl limiting the concurrent renders, None renders without a limit
+        :param custom_max_age: Seconds after their last check after which published maps of custom regions expire
+            from the cache
+        """
+        self._regions = regions
+        self._load_features = load_features
+        self._render_region = render
+        self._get_title = get_title
+        self._artifact_store = artifact_store
+        self._cache = cache
+        self._single_flight = single_flight
+        self._fresh = fresh
+        self._max_stale = max_stale
+        self._metrics = metrics
+        self._extension = extension
+        self._history = history
+        self._admission = admission
+        self._custom_max_age = custom_max_age
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=len(regions), thread_name_prefix='pre_render')
+
+    def get(self, region):
+        """
+        Provides the latest published map of the region.
+
+        Only waits for a render if the region was never published or its map is older than max_stale.
+
+        :param region: Name of the region
+        :return: PublishedMap
+        """
+        published = self._cache.get(self._key(region))
+        if published is not None and self._admission is not None and self._admission.saturated:
+            # Serve the last good map instead of queueing for the lock of a render which could not start anyway
+            return published
+        if published is None or self._age(published) > self._max_stale:
+            with self._single_flight.lock(self._key(region)):
+                # Another thread or process might have rendered the region while waiting for the lock
+                published = self._cache.get(self._key(region))
+                if published is None or self._age(published) > self._max_stale:
+                    published = self._render_and_publish(region, published)
+        elif self._age(published) > self._fresh or published.degraded:
+            self._revalidate(region)
+        return published
+
+    def render(self, region):
+        """
+        Renders the region and publishes the result, unless its inputs did not change or another thread or process
+        is already rendering the region.
+
+        :param region: Name of the region
+        :return: The published map, None if the region is rendered by somebody else
+        """
+        with self._single_flight.lock(self._key(region), blocking=False) as acquired:
+            if not acquired:
+                self._log.debug("Region=%s is already rendered elsewhere", region)
+                return None
+            return self._render_and_publish(region, self._cache.get(self._key(region)))
+
+    def render_all(self):
+        """
+        Renders all regions in parallel and publishes every successful render.
+        """
+        self._log.info("Pre-rendering all regions")
+        futures = {region: self._executor.submit(self.render, region) for region in self._regions}
+        for region, future in futures.items():
+            try:
+                future.result()
+            except Exception:
+                self._log.exception("Pre-rendering region=%s failed, keeping the previously published map", region)
+
+    def schedule(self, scheduler, feature_store, interval, debounce=2):
+        """
+        Renders all regions every interval seconds and shortly after the feature store received changed data.
+
+        :param scheduler: APScheduler scheduler running the renders
+        :param feature_store: FeatureStore notifying about changed data
+        :param interval: Seconds between two renders if no data changed
+        :param debounce: Seconds to wait after changed data arrived, so that changes of several sources are rendered
+            together
+        """
+        job = scheduler.add_job(self.render_all, trigger='interval', seconds=interval, id='pre_render_all',
+                                max_instances=1, coalesce=True, next_run_time=datetime.datetime.now())
+
+        def on_change(name, snapshot):
+            self._log.debug("Source=%s changed, pre-rendering all regions", name)
+            job.modify(next_run_time=datetime.datetime.now() + datetime.timedelta(seconds=debounce))
+
+        feature_store.add_listener(on_change)
+
+    def _revalidate(self, region):
+        with self._revalidating_lock:
+            if region in self._revalidating:
+                return
+            self._revalidating.add(region)
+
+        def revalidate():
+            try:
+                self.render(region)
+            except Exception:
+                self._log.exception("Revalidating region=%s failed", region)
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(region)
+
+        self._executor.submit(revalidate)
+
+    def _render_and_publish(self, region, previous):
+        timings = Timings()
+        with timings.stage('load'):
+            features = self._load_features(region)
+        if self._history is not None and not is_custom_region(region):
+            with timings.stage('history'):
+                self._history.record(region, features)
+        with timings.stage('hash'):
+            features_hash = content_hash(region, features, self._get_title())
+
+        if (previous is not None and previous.content_hash == features_hash and not previous.degraded and
+                previous.file_name.endswith(self._extension) and previous.file_name in self._artifact_store):
+            self._log.debug("Inputs of region=%s did not change, keeping the published map", region)
+            previous.checked = time.time()
+            self._keep(region, previous.file_name)
+            self._publish(region, previous)
+            timings.count('reused')
+            self._send_timings(region, timings)
+            return previous
+
+        # A region with a published map does not wait for a render slot, it keeps serving its map instead
+        admit = self._admission.admit(wait=previous is None) if self._admission is not None else nullcontext(False)
+        try:
+            with admit as degraded:
+                with timings.stage('total'):
+                    result = self._render_region(region, features, None, degraded)
+        except Saturated:
+            if previous is None:
+                raise
+            self._log.warning("Render slots of region=%s are saturated, keeping the published map", region)
+            timings.count('shed')
+            self._send_timings(region, timings)
+            return previous
+        if result.timings is not None:
+            timings.merge(result.timings)
+        now = time.time()
+        file_name = self._artifact_store.put(result.image, self._extension)
+        self._keep(region, file_name)
+        published = PublishedMap(region, file_name, result.info, result.failed, now, features_hash, now, degraded)
+
+        self._publish(region, published)
+        self._log.info("Published region=%s file=%s", region, file_name)
+        self._send_timings(region, timings)
+        return published
+
+    def _publish(self, region, published):
+        # Custom regions are chosen by the clients, their maps must not stay in the cache forever
+        self._cache.set(self._key(region), published, timeout=self._custom_max_age if is_custom_region(region) else 0)
+
+    def _keep(self, region, file_name):
+        if is_custom_region(region):
+            self._artifact_store.touch(file_name)
+        else:
+            self._artifact_store.pin(region, file_name)
+
+    def _send_timings(self, region, timings):
+        if self._metrics is not None:
+            # Custom regions are aggregated, every one of them would otherwise create its own metrics
+            self._metrics.send_timings("render." + ("custom" if is_custom_region(region) else region), timings)
+
+    @staticmethod
+    def _key(region):
+        return "published_" + region
+
+    @staticmethod
+    def _age(published):
+        return time.time() - published.checked
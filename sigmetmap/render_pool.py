@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from snapshot_history import expand
+
+# SigmetMap of the current worker process, created once by the pool initializer
+_worker_sigmet_map = None
+
+
+class RenderPoolBusy(Exception):
+    """
+    Raised when more renders are pending than the pool accepts.
+    """
+
+
+class RenderTimeout(Exception):
+    """
+    Raised when a render did not finish within the pool's timeout.
+    """
+
+
+def _initialize_worker(sigmet_map_factory, started):
+    global _worker_sigmet_map
+    _worker_sigmet_map = sigmet_map_factory()
+    with started.get_lock():
+        started.value += 1
+
+
+def _render(region, features, output_path, degraded):
+    return _worker_sigmet_map.render(region, features, output_path, degraded)
+
+
+def _animate(region, snapshots, format, frame_seconds):
+    # Snapshots are sent compacted, which keeps the transfer to the worker small
+    frames = [(snapshot.time, expand(data)) for snapshot, data in snapshots]
+    return _worker_sigmet_map.animate(region, frames, format, frame_seconds)
+
+
+class RenderPool:
+    """
+    Renders maps in long lived worker processes.
+
+    Every worker creates its SigmetMap once when it is started, so imports, projections and base maps are already
+    loaded when a render arrives. Workers are started by a fork server rather than forked from the calling process:
+    replacement workers and restarted pools are created while other threads of the process are running, and a
+    forked worker would inherit the locks they hold. The factory therefore has to be importable by the workers. Renders never share pyplot state with other threads and can use all cores.
+    Workers are replaced after max_tasks_per_child renders and the whole pool is replaced if a render times out.
+    """
+    _log = logging.getLogger('render_pool')
+
+    def __init__(self, sigmet_map_factory, processes=None, max_pending=32, timeout=30, max_tasks_per_child=200,
+                 start_timeout=300):
+        """
+        :param sigmet_map_factory: Callable creating the SigmetMap used by a worker, defined at the top level of a
+            module which the workers can import without side effects
+        :param processes: Number of worker processes, None for one per CPU
+        :param max_pending: Maximum number of renders running or waiting for a worker
+        :param timeout: Seconds after which a render is abandoned
+        :param max_tasks_per_child: Number of renders after which a worker is replaced
+        :param start_timeout: Seconds wait_started waits by default for the workers to create their SigmetMap
+        """
+        self._sigmet_map_factory = sigmet_map_factory
+        self._processes = processes
+        self._timeout = timeout
+        self._max_tasks_per_child = max_tasks_per_child
+        self._start_timeout = start_timeout
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._context = multiprocessing.get_context('forkserver')
+        # Number of workers which created their SigmetMap
+        self._started = self._context.Value('i', 0)
+        self._pool_lock = threading.Lock()
+        self._pool = self._create_pool()
+
+    def render(self, region, features, output_path, degraded=False):
+        """
+        Renders the features of a region in a worker process.
+
+        :param region: Region to render
+        :param features: Features of the region
+        :param output_path: Path to where the plot will be saved, None returns the image in the PlotResult
+        :param degraded: True renders in the cheaper degraded mode
+        :return: PlotResult of the render
+        :raises RenderPoolBusy: If max_pending renders are already pending
+        :raises RenderTimeout: If the render did not finish within the timeout
+        """
+        return self._run(_render, (region, features, output_path, degraded), self._timeout, region)
+
+    def animate(self, region, snapshots, format, frame_seconds, timeout=None):
+        """
+        Renders an animation of the snapshots of a region in a worker process.
+
+        :param region: Region to render
+        :param snapshots: List of (RegionSnapshot, compacted features) as provided by SnapshotHistory, oldest first
+        :param format: Animation format
+        :param frame_seconds: Duration of every frame
+        :param timeout: Seconds after which the animation is abandoned, defaults to the timeout of one render per
+            frame
+        :return: PlotResult with the encoded animation
+        :raises RenderPoolBusy: If max_pending renders are already pending
+        :raises RenderTimeout: If the animation did not finish within the timeout
+        """
+        if timeout is None:
+            timeout = self._timeout * max(1, len(snapshots))
+        return self._run(_animate, (region, snapshots, format, frame_seconds), timeout, region)
+
+    def _run(self, function, args, timeout, region):
+        if not self._pending.acquire(blocking=False):
+            raise RenderPoolBusy("Too many renders pending")
+        try:
+            pool = self._pool
+            result = pool.apply_async(function, args)
+            try:
+                return result.get(timeout)
+            except multiprocessing.TimeoutError:
+                self._log.error("Render of region=%s timed out after %ss, restarting the workers", region, timeout)
+                self._restart(pool)
+                raise RenderTimeout("Render of region %s timed out" % region)
+        finally:
+            self._pending.release()
+
+    def wait_started(self, timeout=None):
+        """
+        Waits until every worker of the pool created its SigmetMap.
+
+        :param timeout: Seconds to wait at most, defaults to start_timeout
+        :return: True if all workers started
+        """
+        timeout = timeout if timeout is not None else self._start_timeout
+        processes = self._processes if self._processes is not None else os.cpu_count()
+        deadline = time.monotonic() + timeout
+        while self._started.value < processes:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self):
+        with self._pool_lock:
+            self._pool.close()
+            self._pool.join()
+
+    def _create_pool(self):
+        return self._context.Pool(self._processes, initializer=_initialize_worker,
+                                    initargs=(self._sigmet_map_factory, self._started),
+                                    maxtasksperchild=self._max_tasks_per_child)
+
+    def _restart(self, pool):
+        with self._pool_lock:
+            # Another render may have restarted the pool already
+            if self._pool is not pool:
+                return
+            self._pool = self._create_pool()
+        pool.terminate()
@@ -0,0 +1,29 @@
+"""
+Creates the SigmetMap of a render worker.
+
+Render workers are started by a fork server and inherit nothing from the process which created the render pool. Every
+worker imports this module and builds its own SigmetMap from config.py, with the shapefiles read and the base maps
+prepared before the first render arrives.
+"""
+import config
+
+
+def create_sigmet_map():
+    import matplotlib
+    matplotlib.use('Agg')
+    from admission import DegradedMode
+    from base_map import BaseMapCache, load_natural_earth
+    from image_encoder import ImageEncoder
+    from label_placement import create_label_placer
+    from sigmet_map import MapProvider, FeatureProvider, SigmetMap, LegendProvider
+
+    map_provider = MapProvider(BaseMapCache(max_custom=config.custom_regions['max_base_maps']))
+    degraded_mode = DegradedMode(config.degraded['dpi'], create_label_placer(config.degraded['labels']),
+                                 config.degraded['metar_stride'])
+    # The features are loaded by the process owning the pool and passed along with every render
+    sigmet_map = SigmetMap(map_provider, FeatureProvider(), LegendProvider(),
+                           label_placer=create_label_placer(config.labels), profile_dir=config.profiling['dir'],
+                           image_encoder=ImageEncoder(**config.image), degraded_mode=degraded_mode)
+    load_natural_earth()
+    map_provider.prepare()
+    return sigmet_map
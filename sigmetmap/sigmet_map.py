@@ -1,38 +1,159 @@
 import datetime
-import json  # reading geojson files
+import functools
 import logging
-import pandas as pd
-from multiprocessing.pool import ThreadPool
-from urllib.request import urlopen
+import os
+import resource
+import threading
+import time
 
 import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import matplotlib.pyplot as plt  # plotting data
-from shapely.geometry import box  # manipulating geometry
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 # CONSTANTS/CONFIGURATION
+from base_map import BaseMapCache
 from color_scheme import DefaultColorScheme, NorthAmericaColorScheme
-from model import PlotDefinition, Features
+from custom_region import is_custom_region, custom_extent, lambert_conformal_parameters
+from feature_store import CWA_URL, FeatureStore, json_decoder, clip_feature_collection, clip_metars
+from fetcher import Fetcher
+from geometry_cache import GeometryCache
+from admission import DegradedMode
+from animation import AnimationWriter, FrameEncoder
+from image_encoder import ImageEncoder
+from instrumentation import Timings, profiled
+from model import PlotDefinition, PlotResult, Features
 from plot_features import PlotFeatures
 
 
 class SigmetMap:
-    def __init__(self, map_provider, feature_provider, legend_provider):
+    _log = logging.getLogger('sigmet_map')
+
+    def __init__(self, map_provider, feature_provider, legend_provider, geometry_cache=None, label_placer=None,
+                 profile_dir=None, image_encoder=None, degraded_mode=None):
+        """
+        :param map_provider: MapProvider creating the regions' maps
+        :param feature_provider: FeatureProvider loading the regions' features
+        :param legend_provider: LegendProvider providing the title
+        :param geometry_cache: GeometryCache shared by all renders
+        :param label_placer: Label placement engine, adjust_text if None
+        :param profile_dir: If set every render is profiled with cProfile and its stats are written to this directory
+        :param image_encoder: ImageEncoder writing the images, a PNG encoder if None
+        :param degraded_mode: DegradedMode of renders under load
+        """
         self._map_provider = map_provider
         self._feature_provider = feature_provider
         self._legend_provider = legend_provider
+        self._geometry_cache = geometry_cache if geometry_cache is not None else GeometryCache()
+        self._label_placer = label_placer
+        self._profile_dir = profile_dir
+        self._image_encoder = image_encoder if image_encoder is not None else ImageEncoder()
+        self._degraded_mode = degraded_mode if degraded_mode is not None else DegradedMode()
+        map_provider.add_eviction_listener(self._geometry_cache.forget)
+        map_provider.add_eviction_listener(self._image_encoder.forget)
 
     def plot(self, region, output_path):
-        plot_definition = self._map_provider.create(region)
-        features = self._feature_provider.load(plot_definition.bbox_string)
+        return self.render(region, self.load_features(region), output_path)
+
+    def load_features(self, region):
+        """
+        Loads the features of a region without rendering them.
+
+        :param region: Region for which to load the features
+        :return: Features object of the region
+        """
+        return self._feature_provider.load(self._map_provider.get_bbox_string(region))
+
+    def render(self, region, features, output_path, degraded=False):
+        """
+        Renders already loaded features onto the map of a region.
+
+        :param region: Region to render
+        :param features: Features object as returned by load_features
+        :param output_path: Path to where the plot will be saved, None returns the image in the PlotResult
+        :param degraded: True renders in the cheaper degraded mode
+        :return: PlotResult
+        """
+        label_placer = self._label_placer
+        if degraded:
+            features = self._degraded_mode.thin(features)
+            if self._degraded_mode.label_placer is not None:
+                label_placer = self._degraded_mode.label_placer
+        timings = Timings()
+        profile_path = None
+        if self._profile_dir is not None:
+            profile_path = os.path.join(self._profile_dir, "%s-%d.prof" % (region, time.time() * 1000))
+
+        with profiled(profile_path), timings.stage('render'):
+            with timings.stage('create'):
+                plot_definition = self._map_provider.create(region)
+            if degraded:
+                plot_definition.fig.set_dpi(self._degraded_mode.dpi)
+            try:
+                plot_features = PlotFeatures(plot_definition, self._legend_provider.get_title, self._geometry_cache,
+                                             label_placer, timings, self._image_encoder)
+                result = plot_features.plot(features, output_path)
+            finally:
+                if degraded:
+                    plot_definition.fig.set_dpi(self._map_provider.dpi)
+                self._map_provider.release(plot_definition)
+
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        timings.count('peak_memory_kb', peak_memory)
+        if degraded:
+            timings.count('degraded')
+        self._log.info("Rendered region=%s in %.3fs peak_memory=%dkB", region, timings.durations['render'],
+                       peak_memory)
+        return result
+
+    def animate(self, region, frames, format='apng', frame_seconds=0.5):
+        """
+        Renders an animated loop of the features of a region at several points in time.
 
-        plot_features = PlotFeatures(plot_definition, self._legend_provider.get_title)
-        return plot_features.plot(features, output_path)
+        All frames are drawn on one figure: the base map is drawn once and every frame only draws its features.
+
+        :param region: Region to render
+        :param frames: List of (time in seconds since the epoch, Features), oldest first
+        :param format: Animation format, see animation.ANIMATION_FORMATS
+        :param frame_seconds: Duration of every frame
+        :return: PlotResult with the encoded animation and the info of the last frame
+        :raises ValueError: If there are no frames
+        """
+        if not frames:
+            raise ValueError("An animation of region %s needs at least one frame" % region)
+        timings = Timings()
+        writer = AnimationWriter(format, frame_seconds)
+        result = None
+        with timings.stage('render'):
+            with timings.stage('create'):
+                plot_definition = self._map_provider.create(region)
+            try:
+                with timings.stage('background'):
+                    frame_encoder = FrameEncoder(plot_definition, self._image_encoder, writer)
+                for frame_time, features in frames:
+                    plot_features = PlotFeatures(plot_definition,
+                                                 functools.partial(self._legend_provider.get_title, frame_time),
+                                                 self._geometry_cache, self._label_placer, timings, frame_encoder,
+                                                 now=frame_time)
+                    result = plot_features.plot(features, None)
+                    self._map_provider.clear(plot_definition)
+            finally:
+                self._map_provider.release(plot_definition)
+        with timings.stage('animation'):
+            image = writer.finish()
+        timings.count('frames', len(frames))
+        self._log.info("Rendered %d frames of region=%s in %.3fs", len(frames), region, timings.durations['render'])
+        return PlotResult(None, result.info, result.failed, timings, image)
 
 
 class MapProvider:
     """
     Provides PlotDefinitions with figures already created and the regions base map already rendered.
+
+    Figures are reused: a PlotDefinition has to be handed back with release after the render, which removes all
+    artists added on top of the base map and keeps the figure for the next render of the region.
+
+    Besides the built-in regions any custom region created with custom_region.custom_region can be rendered. Its
+    projection is derived from its extent, and its base map is kept in the LRU of the base map cache.
     """
     _log = logging.getLogger('map_provider')
 
@@ -55,6 +176,23 @@ class MapProvider:
     # If no color is provided the default DefaultColorScheme will be used for that region
     _region_custom_color = {"na": NorthAmericaColorScheme}
 
+    def __init__(self, base_map_cache=None, max_idle_figures=1, dpi=90):
+        """
+        :param base_map_cache: Cache of the regions' base maps
+        :param max_idle_figures: Number of released figures kept per region for reuse
+        :param dpi: Resolution of the figures, which are encoded from their canvas without rescaling
+        """
+        self._base_map_cache = base_map_cache if base_map_cache is not None else BaseMapCache()
+        self._max_idle_figures = max_idle_figures
+        self._dpi = dpi
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        self._base_map_cache.add_eviction_listener(self._forget_idle)
+
+    @property
+    def dpi(self):
+        return self._dpi
+
     def get_regions(self):
         """
         Provides a list of regions supported by this MapProvider
@@ -62,112 +200,196 @@ class MapProvider:
         """
         return list(self._region_projections.keys())
 
+    def prepare(self):
+        """
+        Builds the base maps of all regions, so that no request has to pay for building them.
+        """
+        for region in self.get_regions():
+            self.get_base_map(region)
+
+    def get_bbox_string(self, region):
+        """
+        :param region: Name of the region
+        :return: Minimum bounding box covering the visible region "x_min,y_min,x_max,y_max" in PlateCarree
+        """
+        return self.get_base_map(region).bbox_string
+
+    def get_extent(self, region):
+        """
+        :param region: Name of the region
+        :return: Extent of the region [west, east, south, north] in degrees
+        """
+        if is_custom_region(region):
+            return custom_extent(region)
+        return self._region_extent[region]
+
+    def is_supported(self, region):
+        """
+        :param region: Name of a built-in or a custom region
+        :return: True if the region can be rendered
+        """
+        if region in self._region_projections:
+            return True
+        try:
+            return bool(custom_extent(region))
+        except ValueError:
+            return False
+
+    def add_eviction_listener(self, listener):
+        """
+        :param listener: Callable receiving the name of every custom region whose base map was evicted, so that
+            everything else cached for the region can be dropped as well
+        """
+        self._base_map_cache.add_eviction_listener(listener)
+
     def create(self, region):
-        color_scheme = self._region_custom_color.get(region, DefaultColorScheme)
-        fig = plt.figure(figsize=(12, 12))  # create a figure to contain the plot elements
+        """
+        Provides a PlotDefinition of the region with the base map already rendered, reusing a released figure of
+        the region if possible.
 
-        projection = self._region_projections[region]
-        ax = plt.axes(projection=projection)
-        ax.set_extent(self._region_extent[region])
+        :param region: Name of the region
+        :return: PlotDefinition, which has to be handed back with release
+        """
+        with self._idle_lock:
+            idle = self._idle.get(region)
+            if idle:
+                return idle.pop()
+
+        base_map = self.get_base_map(region)
+        color_scheme = base_map.color_scheme
+        # Figures are not created through pyplot, which would keep a reference to every figure forever
+        fig = Figure(figsize=(12, 12), dpi=self._dpi)  # create a figure to contain the plot elements
+        FigureCanvasAgg(fig)
+
+        projection = base_map.projection
+        ax = fig.add_subplot(1, 1, 1, projection=projection)
+        ax.set_extent(base_map.extent)
         ax.background_patch.set_facecolor(color_scheme.MAP_COLOR_WATER)
 
-        self._add_base_features(ax, color_scheme)
+        self._add_base_features(ax, base_map)
 
-        # Since the original extend box is a rectangle only in the PlateCarree projection we need to
-        # project this bounding box onto the actual projection obtaining a more complex shape in general
-        unprojected_poly = box(ax.viewLim.x0, ax.viewLim.y0, ax.viewLim.x1, ax.viewLim.y1)
-        region_box = ccrs.PlateCarree().project_geometry(unprojected_poly, projection)
+        plot_definition = PlotDefinition(projection, fig, ax, base_map.region_box, base_map.bbox_string,
+                                         color_scheme, region)
+        plot_definition.base_artists = set(ax.get_children())
+        return plot_definition
 
-        # Returns minimum bounding region (minx, miny, maxx, maxy)
-        # This region covers all of the actually visible map or more, since it is a box in the
-        # PlatteCarree projection which completely fills the actual projection
-        x_min, y_min, x_max, y_max = region_box.bounds
-        bbox = str(x_min) + "," + str(y_min) + "," + str(x_max) + "," + str(y_max)
+    def release(self, plot_definition):
+        """
+        Removes everything which was plotted on top of the base map and keeps the figure for the next render.
 
-        return PlotDefinition(projection, fig, ax, region_box, bbox, color_scheme)
+        :param plot_definition: PlotDefinition provided by create, which must not be used afterwards
+        """
+        self.clear(plot_definition)
+        with self._idle_lock:
+            idle = self._idle.setdefault(plot_definition.region, [])
+            if len(idle) < self._max_idle_figures:
+                idle.append(plot_definition)
 
     @staticmethod
-    def _add_base_features(ax, color_scheme):
+    def clear(plot_definition):
+        """
+        Removes everything which was plotted on top of the base map, e.g. between the frames of an animation.
+
+        :param plot_definition: PlotDefinition provided by create
+        """
+        ax = plot_definition.ax
+        for artist in ax.get_children():
+            if artist not in plot_definition.base_artists:
+                artist.remove()
+        for loc in ('left', 'center', 'right'):
+            ax.set_title('', loc=loc)
+
+    def get_base_map(self, region):
+        """
+        :param region: Name of the region
+        :return: BaseMap of the region, built on first use
+        """
+        if is_custom_region(region):
+            return self._base_map_cache.get(region, _custom_projection(region), custom_extent(region),
+                                            DefaultColorScheme, custom=True)
+        color_scheme = self._region_custom_color.get(region, DefaultColorScheme)
+        return self._base_map_cache.get(region, self._region_projections[region], self._region_extent[region],
+                                        color_scheme)
+
+    def _forget_idle(self, region):
+        with self._idle_lock:
+            self._idle.pop(region, None)
+
+    @staticmethod
+    def _add_base_features(ax, base_map):
         """
         Adds Countries, Coastlines, Land, Lakes and Water to the base map.
 
+        The geometries are already projected into the region's projection, so they are added in that projection.
+
         :param ax: Axis to which the features will be rendered
-        :param color_scheme: The color scheme to use for the base map features
-        """
-        # COUNTRIES AND LAND MASSES
-        ax.add_feature(cfeature.NaturalEarthFeature(
-            category='cultural',
-            name='admin_0_countries',
-            scale='50m',
-            facecolor=color_scheme.MAP_COLOR_LAND,
-            edgecolor=color_scheme.MAP_COLOR_COUNTRIES,
-            linewidth=0.3))
-        # COASTLINES
-        ax.add_feature(cfeature.NaturalEarthFeature(
-            category='physical',
-            name='coastline',
-            scale='50m',
-            facecolor='none',
-            edgecolor=color_scheme.MAP_COLOR_COASTLINES,
-            linewidth=0.5))
-        # LAKES
-        ax.add_feature(cfeature.NaturalEarthFeature(
-            category='physical',
-            name='lakes',
-            scale='50m',
-            facecolor=color_scheme.MAP_COLOR_WATER,
-            edgecolor=color_scheme.MAP_COLOR_COASTLINES,
-            linewidth=0.25))
+        :param base_map: The cached base map of the region
+        """
+        for layer in base_map.layers:
+            ax.add_geometries(layer.geometries, crs=base_map.projection, **layer.style)
+
+
+@functools.lru_cache(maxsize=64)
+def _custom_projection(region):
+    return ccrs.LambertConformal(**lambert_conformal_parameters(custom_extent(region)))
 
 
 class FeatureProvider:
+    """
+    Provides the features of one region.
+
+    The worldwide SIGMETs, AIRMETs and METARs are read from a shared FeatureStore and clipped to the region,
+    only the CWAs are queried per region.
+    """
     _log = logging.getLogger('feature_provider')
 
+    def __init__(self, feature_store=None, fetcher=None):
+        self._fetcher = fetcher if fetcher is not None else Fetcher()
+        if feature_store is None:
+            # Nothing schedules the refreshes of a store created here, it refreshes outdated sources when read
+            feature_store = FeatureStore(self.load_from_web, refresh_on_read=True)
+        self._feature_store = feature_store
+
     def load_from_web(self, definition):
-        name, url, decoder = definition
-        response = urlopen(url)
-        response_decoded = decoder(response)
-        return name, response_decoded
+        return self._fetcher.load(definition)
 
     def load(self, bbox):
         """
         Load advanced map features like SIGMETs, AIRMETs and METARs for the region provided in bbox.
 
-        The features are loaded via https from the aviationweather.gov GeoJSON webservices.
+        The CWAs are loaded via https from the aviationweather.gov GeoJSON webservice, all other features are
+        taken from the current snapshot of the feature store. If the CWAs did not change since the last call for
+        the same bbox the previously decoded CWAs are reused.
 
         :param bbox: Region for which to load the features
-        :return: Features object containing all features loaded from the web
+        :return: Features object containing all features of the region
         """
-        self._log.info("Downloading features for bbox=%s", bbox)
-
-        def json_decoder(response):
-            response_decoded = response.read().decode("utf-8")
-            return json.loads(response_decoded)
+        self._log.info("Loading features for bbox=%s", bbox)
+        bounds = tuple(float(coordinate) for coordinate in bbox.split(","))
 
-        def csv_metar_decoder(response):
-            return pd.read_csv(response, skiprows=5, compression='gzip')
+        snapshot = self._feature_store.snapshot()
+        cwa_us = self.load_cwa(bbox)
 
-        definitions = [("sigmets_international",
-                        "https://www.aviationweather.gov/gis/scripts/IsigmetJSON.php", json_decoder),
-                       ("sigmets_us",
-                        "https://www.aviationweather.gov/gis/scripts/SigmetJSON.php", json_decoder),
-                       ("cwa_us",
-                        "https://aviationweather.gov/cgi-bin/json/CwaJSON.php?zoom=4&bbox=" + bbox, json_decoder),
-                       ("metars",
-                        "https://www.aviationweather.gov/adds/dataserver_current/current/metars.cache.csv.gz",
-                        csv_metar_decoder)]
+        def clip(name):
+            return clip_feature_collection(snapshot.payloads[name], snapshot.bounds[name], bounds)
 
-        features_decoded = {}
-        results = ThreadPool(5).imap_unordered(self.load_from_web, definitions)
+        return Features(clip('sigmets_international'), clip('sigmets_us'), cwa_us,
+                        clip_metars(snapshot.payloads['metars'], bounds))
 
-        for name, result in results:
-            features_decoded[name] = result
-
-        return Features(features_decoded['sigmets_international'], features_decoded['sigmets_us'],
-                        features_decoded['cwa_us'],
-                        features_decoded['metars'])
+    def load_cwa(self, bbox):
+        """
+        :param bbox: Region for which to load the CWAs "x_min,y_min,x_max,y_max"
+        :return: GEOJSON feature collection of the CWAs
+        """
+        _, cwa_us = self.load_from_web(("cwa_us", CWA_URL + bbox, json_decoder))
+        return cwa_us
 
 
 class LegendProvider:
-    def get_title(self):
-        return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%MZ")
+    def get_title(self, timestamp=None):
+        """
+        :param timestamp: Time shown in the title in seconds since the epoch, defaults to now
+        """
+        if timestamp is None:
+            return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%MZ")
+        return datetime.datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%d %H:%MZ")
@@ -1,18 +1,28 @@
-import matplotlib
-matplotlib.use('Agg')
-import logging
-import os
-import secrets
 import time
+
+# Startup is measured from the first import of the service
+started = time.perf_counter()
+
+import datetime
+import logging
+import mimetypes
 import config
 
-from flask import Flask, jsonify, url_for, abort
+from flask import Flask, jsonify, url_for, abort, request, make_response
 from flask_caching import Cache
 from flask_graphite import FlaskGraphite
 from apscheduler.schedulers.background import BackgroundScheduler
 
 # CONSTANTS/CONFIGURATION
-from sigmet_map import MapProvider, FeatureProvider, SigmetMap, LegendProvider
+# Only light modules are imported here, the rendering stack is imported by the warm-up
+from admission import AdmissionControl, DegradedMode, Saturated
+from artifact_store import ArtifactStore
+from custom_region import custom_region, custom_region_around
+from instrumentation import MetricsSender
+from render_pool import RenderPool, RenderPoolBusy, RenderTimeout
+from render_worker import create_sigmet_map
+from single_flight import SingleFlight
+from warm_up import WarmUp
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -25,19 +35,126 @@ app.config["FLASK_GRAPHITE_HOST"] = config.metrics['host']
 app.config["FLASK_GRAPHITE_PORT"] = config.metrics['port']
 
 metric_sender.init_app(app)
+metrics = MetricsSender(getattr(app, 'graphite', None))
 
-cache = Cache(app, config={'CACHE_TYPE': 'simple'})
+# Shared by all worker processes of the service
+cache = Cache(app, config={'CACHE_TYPE': 'filesystem', 'CACHE_DIR': config.render_cache['dir'],
+                           'CACHE_DEFAULT_TIMEOUT': 0, 'CACHE_THRESHOLD': config.render_cache['threshold']})
+single_flight = SingleFlight(config.render_cache['lock_dir'])
+artifact_store = ArtifactStore(**config.artifacts)
+admission = AdmissionControl(**config.admission, metrics=metrics)
+sched = BackgroundScheduler()
 
-# Application Setup
-map_provider = MapProvider()
-feature_provider = FeatureProvider()
-legend_provider = LegendProvider()
-sigmet_map_plotter = SigmetMap(map_provider, feature_provider, legend_provider)
-plots_dir = "static/"
+# Created by the warm-up
+map_provider = None
+feature_store = None
+feature_provider = None
+legend_provider = None
+image_encoder = None
+sigmet_map_plotter = None
+pre_renderer = None
+hazard_index = None
+animations = None
+map_tiles = None
+vector_overlays = None
+
+
+def import_rendering():
+    global map_provider, feature_store, feature_provider, legend_provider, image_encoder, sigmet_map_plotter
+    import matplotlib
+    matplotlib.use('Agg')
+    from base_map import BaseMapCache
+    from feature_store import FeatureStore, GLOBAL_SOURCES, WORLDWIDE_CWA_SOURCE
+    from fetcher import Fetcher
+    from image_encoder import ImageEncoder
+    from label_placement import create_label_placer
+    from sigmet_map import MapProvider, FeatureProvider, SigmetMap, LegendProvider
+
+    map_provider = MapProvider(BaseMapCache(max_custom=config.custom_regions['max_base_maps']))
+    fetcher = Fetcher(config.fetch, metrics=metrics)
+    # The worldwide CWAs are only used by the hazard queries and the tiles, the maps query the CWAs of their region
+    feature_store = FeatureStore(fetcher.load, sources=GLOBAL_SOURCES + [WORLDWIDE_CWA_SOURCE],
+                                 refresh_intervals=config.feature_refresh)
+    feature_provider = FeatureProvider(feature_store, fetcher)
+    legend_provider = LegendProvider()
+    image_encoder = ImageEncoder(**config.image)
+    degraded_mode = DegradedMode(config.degraded['dpi'], create_label_placer(config.degraded['labels']),
+                                 config.degraded['metar_stride'])
+    sigmet_map_plotter = SigmetMap(map_provider, feature_provider, legend_provider,
+                                   label_placer=create_label_placer(config.labels),
+                                   profile_dir=config.profiling['dir'], image_encoder=image_encoder,
+                                   degraded_mode=degraded_mode)
+
+
+def load_shapefiles():
+    from base_map import load_natural_earth
+    load_natural_earth()
+
+
+def wait_for_render_pool():
+    if not render_pool.wait_started():
+        raise RuntimeError("The render workers did not start")
 
-# Background Task Setup
-sched = BackgroundScheduler()
-sched.start()
+
+def start_services():
+    global pre_renderer, hazard_index, animations, map_tiles, vector_overlays
+    from animation import Animations
+    from hazard_index import HazardIndex
+    from image_encoder import ImageEncoder
+    from map_tiles import MapTiles
+    from prerender import PreRenderer
+    from snapshot_history import SnapshotHistory
+    from vector_overlay import VectorOverlays
+
+    history = SnapshotHistory(cache, **config.history)
+    pre_renderer = PreRenderer(map_provider.get_regions(), sigmet_map_plotter.load_features, render_pool.render,
+                               legend_provider.get_title, artifact_store, cache, single_flight,
+                               fresh=config.render_cache['fresh'], max_stale=config.render_cache['max_stale'],
+                               metrics=metrics, extension=image_encoder.extension, history=history,
+                               admission=admission, custom_max_age=config.custom_regions['max_age'])
+    animations = Animations(history, render_pool.animate, artifact_store, cache, single_flight,
+                            admission=admission, **config.animation)
+    hazard_index = HazardIndex(feature_store, **config.hazards)
+    # Tiles have to stay transparent, so they are always PNGs
+    tile_encoder = ImageEncoder(**dict(config.image, format='png'))
+    map_tiles = MapTiles(feature_store, image_encoder=tile_encoder, max_zoom=config.tiles['max_zoom'],
+                         max_tiles=config.tiles['max_tiles'], size=config.tiles['size'],
+                         max_age=config.tiles['max_age'])
+    vector_overlays = VectorOverlays(sigmet_map_plotter.load_features, map_provider.get_base_map, cache,
+                                     custom_max_age=config.custom_regions['max_age'], **config.overlay)
+
+    # Background Task Setup
+    feature_store.schedule(sched)
+    pre_renderer.schedule(sched, feature_store, config.prerender['interval'])
+    sched.start()
+
+
+# The workers are started by a fork server, so they never inherit a lock held by a thread of this process. They warm
+# up in parallel with the warm-up of this process.
+render_pool = RenderPool(create_sigmet_map, **config.render_pool)
+
+# The process answers right away, requests other than the readiness check are rejected until the warm-up finished
+warm_up = WarmUp(started, metrics)
+warm_up.add_step('imports', import_rendering)
+warm_up.add_step('shapefiles', load_shapefiles)
+warm_up.add_step('base_maps', lambda: map_provider.prepare())
+warm_up.add_step('render_pool', wait_for_render_pool)
+warm_up.add_step('services', start_services)
+warm_up.start()
+
+
+@app.before_request
+def require_warm_up():
+    if not warm_up.ready and request.endpoint not in ('ready', 'index'):
+        response = jsonify(error="warming up")
+        response.status_code = 503
+        response.retry_after = 5
+        return response
+
+
+@app.route('/ready')
+def ready():
+    return jsonify(warm_up.report()), 200 if warm_up.ready else 503
 
 
 @app.route('/')
@@ -46,25 +163,167 @@ def index():
 
 
 @app.route('/sigmet_map/<region>')
-@cache.memoize(timeout=60)
 def sigmet_map(region):
+    if not map_provider.is_supported(region):
+        abort(404)
+    return published_map_response(pre_renderer.get(region))
+
+
+@app.route('/sigmet_map/custom')
+def sigmet_map_custom():
+    """
+    Map of an arbitrary extent, given as bbox=west,south,east,north or as center=lon,lat with a span in degrees.
+    """
+    try:
+        if 'bbox' in request.args:
+            west, south, east, north = (float(value) for value in request.args['bbox'].split(","))
+            region = custom_region(west, east, south, north)
+        elif 'center' in request.args:
+            longitude, latitude = (float(value) for value in request.args['center'].split(","))
+            region = custom_region_around(longitude, latitude, request.args.get('span', 20, type=float))
+        else:
+            abort(400)
+    except ValueError:
+        abort(400)
+    return published_map_response(pre_renderer.get(region))
+
+
+def published_map_response(published):
+    url = url_for('artifact', name=published.file_name)
+    response = jsonify(region=published.region, url=url, infos=published.info, failed=published.failed,
+                       degraded=published.degraded)
+    # A degraded map is replaced by a regular render of the same inputs, which must not revalidate as unchanged
+    response.set_etag(published.content_hash + ('-degraded' if published.degraded else ''))
+    response.last_modified = datetime.datetime.fromtimestamp(published.published, datetime.timezone.utc)
+    return response.make_conditional(request)
+
+
+@app.route('/sigmet_map/<region>/overlay')
+def sigmet_map_overlay(region):
+    if not map_provider.is_supported(region):
+        abort(404)
+    zoom = request.args.get('zoom', 0, type=int)
+    if not 0 <= zoom <= vector_overlays.max_zoom:
+        abort(400)
+
+    overlay = vector_overlays.get(region, zoom)
+    if request.accept_encodings['gzip']:
+        response = make_response(overlay.gzipped)
+        response.content_encoding = 'gzip'
+        response.set_etag(overlay.content_hash + '-gzip')
+    else:
+        response = make_response(overlay.body)
+        response.set_etag(overlay.content_hash)
+    response.mimetype = 'application/json'
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+
+@app.route('/sigmet_map/<region>/animation')
+def sigmet_map_animation(region):
+    """
+    Animated loop of the recorded snapshots of a region, format=apng, gif or mp4 and optionally the number of the most
+    recent frames.
+    """
     if region not in map_provider.get_regions():
         abort(404)
+    frames = request.args.get('frames', None, type=int)
+    try:
+        published = animations.get(region, request.args.get('format', 'apng'), frames)
+    except ValueError:
+        abort(400)
+    if published is None:
+        abort(404)
+    return published_map_response(published)
+
+
+@app.route('/tiles/<int:zoom>/<int:x>/<int:y>.png')
+def tile(zoom, x, y):
+    try:
+        map_tile = map_tiles.get(zoom, x, y)
+    except ValueError:
+        abort(404)
+    response = make_response(map_tile.image)
+    response.mimetype = 'image/png'
+    response.cache_control.public = True
+    response.cache_control.max_age = config.tiles['max_age']
+    response.set_etag(map_tile.content_hash)
+    return response.make_conditional(request)
+
+
+def parse_coordinates(argument):
+    """
+    Parses "lon,lat;lon,lat;..." into a list of (longitude, latitude).
+    """
+    try:
+        coordinates = [tuple(float(value) for value in pair.split(",")) for pair in argument.split(";") if pair]
+    except ValueError:
+        abort(400)
+    if not coordinates or any(len(pair) != 2 for pair in coordinates):
+        abort(400)
+    return coordinates
+
+
+@app.route('/hazards')
+def hazards():
+    """
+    Hazards affecting a point, airports or a route, given as point=lon,lat, airports=lon,lat;lon,lat;... or
+    route=lon,lat;lon,lat;... with an optional buffer in nautical miles.
+    """
+    buffer = request.args.get('buffer', 0, type=float)
+    if buffer < 0:
+        abort(400)
+    if 'point' in request.args:
+        point = parse_coordinates(request.args['point'])
+        if len(point) != 1:
+            abort(400)
+        longitude, latitude = point[0]
+        return jsonify(hazard_index.query_point(longitude, latitude, buffer))
+    if 'airports' in request.args:
+        return jsonify(airports=hazard_index.query_airports(parse_coordinates(request.args['airports']), buffer))
+    if 'route' in request.args:
+        return jsonify(hazard_index.query_route(parse_coordinates(request.args['route']), buffer))
+    abort(400)
+
+
+@app.route('/artifacts/<name>')
+def artifact(name):
+    data = artifact_store.get(name)
+    if data is None:
+        abort(404)
+    response = make_response(data)
+    response.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    # Artifacts are named after their content, so they never change
+    response.cache_control.public = True
+    response.cache_control.max_age = config.artifacts['max_age']
+    response.cache_control.immutable = True
+    response.set_etag(name)
+    return response.make_conditional(request)
+
+
+@app.errorhandler(RenderPoolBusy)
+def render_pool_busy(error):
+    return jsonify(error=str(error)), 503
+
+
+@app.errorhandler(Saturated)
+def saturated(error):
+    response = jsonify(error=str(error))
+    response.status_code = 503
+    response.retry_after = 5
+    return response
+
 
-    # Use a random file path, which should never ever collide
-    file_name = secrets.token_urlsafe(32) + ".png"
-    plot_result = sigmet_map_plotter.plot(region, plots_dir + file_name)
-    url = url_for('static', filename=file_name)
-    return jsonify(url=url, infos=plot_result.info, failed=plot_result.failed)
+@app.errorhandler(RenderTimeout)
+def render_timeout(error):
+    return jsonify(error=str(error)), 504
 
 
 @sched.scheduled_job(trigger='interval', minutes=10)
 def cleanup():
-    now = time.time()
-    for file in os.listdir(plots_dir):
-        created = os.path.getctime(plots_dir + file)
-        if (now - created) >= config.cleanup['max_age']:
-            os.unlink(plots_dir + file)
+    artifact_store.expire()
+    # Every custom region leaves a lock file behind
+    single_flight.expire(config.custom_regions['max_age'])
 
 
 if __name__ == '__main__':
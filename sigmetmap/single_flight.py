@@ -0,0 +1,71 @@
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+
+class SingleFlight:
+    """
+    Lock per key which is shared by all threads and processes using the same lock directory.
+
+    Only the holder of the lock of a key performs the expensive work for that key, everybody else either waits
+    for it and then reads its result, or skips the work.
+    """
+    _log = logging.getLogger('single_flight')
+
+    def __init__(self, lock_dir):
+        """
+        :param lock_dir: Directory containing one lock file per key, created if missing
+        """
+        self._lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def expire(self, max_age):
+        """
+        Removes the lock files which were not used for max_age seconds and are not locked.
+
+        A process which opened a lock file right before it was removed may still lock the removed file, the work
+        for its key is then at worst done twice.
+
+        :param max_age: Seconds since the last use of a lock file
+        :return: Number of removed lock files
+        """
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self._lock_dir):
+            if not entry.name.endswith(".lock") or now - entry.stat().st_mtime <= max_age:
+                continue
+            try:
+                with open(entry.path, "r") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.unlink(entry.path)
+                    removed += 1
+            except (BlockingIOError, FileNotFoundError):
+                continue
+        if removed:
+            self._log.info("Removed %d unused lock files", removed)
+        return removed
+
+    @contextmanager
+    def lock(self, key, blocking=True):
+        """
+        Acquires the lock of key for the duration of the with block.
+
+        :param key: Key to lock, has to be usable as a file name
+        :param blocking: If False the lock is not waited for
+        :return: Context manager yielding True if the lock was acquired, False if it is held by somebody else and
+            blocking is False
+        """
+        # Every call opens the file itself, flock locks of separate open files also exclude threads of one process
+        with open(os.path.join(self._lock_dir, key + ".lock"), "w") as lock_file:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
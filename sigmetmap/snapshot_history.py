@@ -0,0 +1,127 @@
+import logging
+import pickle
+import time
+import zlib
+
+from content_hash import content_hash
+from model import Features, Metars, RegionSnapshot, SIGMET_SOURCES
+
+
+def compact(features):
+    """
+    Serializes the features of a region with only the properties which are plotted.
+
+    :param features: Features of the region
+    :return: zlib compressed bytes
+    """
+    collections = {}
+    for source, label_property, text_property in SIGMET_SOURCES:
+        collections[source] = [{"type": "Feature", "geometry": feat["geometry"],
+                                "properties": {name: feat["properties"][name]
+                                               for name in (label_property, text_property, "geom")
+                                               if name in feat["properties"]}}
+                               for feat in getattr(features, source).get("features", [])]
+    metars = features.metars
+    columns = (metars.longitude, metars.latitude, metars.category, metars.observation_time)
+    return zlib.compress(pickle.dumps((collections, columns), pickle.HIGHEST_PROTOCOL), 6)
+
+
+def expand(data):
+    """
+    :param data: Bytes created by compact
+    :return: Features
+    """
+    collections, columns = pickle.loads(zlib.decompress(data))
+    return Features(*({"features": collections[source]} for source, _, _ in SIGMET_SOURCES), Metars(*columns))
+
+
+class SnapshotHistory:
+    """
+    Keeps the recent features of every region in a ring buffer, so that animations can replay how they evolved.
+
+    A snapshot is taken at most every interval seconds and only if the features changed since the last snapshot.
+    Snapshots are stored compacted and compressed. Every region keeps at most max_snapshots snapshots which take at
+    most max_bytes, the oldest ones are dropped first.
+
+    The history is kept in the cache shared by all worker processes. It is written by whichever process pre-renders
+    the region, which is only ever one process at a time.
+    """
+    _log = logging.getLogger('snapshot_history')
+
+    def __init__(self, cache, max_snapshots=36, max_bytes=16 * 1024 * 1024, interval=600):
+        """
+        :param cache: Cache shared by all processes, storing the snapshots
+        :param max_snapshots: Maximum number of snapshots per region
+        :param max_bytes: Maximum size of the compressed snapshots of one region
+        :param interval: Minimum number of seconds between two snapshots of a region
+        """
+        self._cache = cache
+        self._max_snapshots = max_snapshots
+        self._max_bytes = max_bytes
+        self._interval = interval
+
+    def record(self, region, features, now=None):
+        """
+        Adds a snapshot of the features, unless the last snapshot is younger than interval or has the same content.
+
+        :param region: Name of the region
+        :param features: Features of the region
+        :param now: Time of the snapshot, defaults to the current time
+        :return: True if a snapshot was added
+        """
+        now = now if now is not None else time.time()
+        index = self.index(region)
+        if index and now - index[-1].time < self._interval:
+            return False
+        features_hash = content_hash(region, features, "")
+        if index and index[-1].content_hash == features_hash:
+            return False
+
+        data = compact(features)
+        self._cache.set(self._data_key(region, features_hash), data, timeout=0)
+        index.append(RegionSnapshot(now, features_hash, len(data)))
+        dropped = []
+        while len(index) > 1 and (len(index) > self._max_snapshots or
+                                  sum(snapshot.size for snapshot in index) > self._max_bytes):
+            dropped.append(index.pop(0))
+        self._cache.set(self._index_key(region), index, timeout=0)
+        # A snapshot with the same content might still be part of the history
+        kept = set(snapshot.content_hash for snapshot in index)
+        for snapshot in dropped:
+            if snapshot.content_hash not in kept:
+                self._cache.delete(self._data_key(region, snapshot.content_hash))
+        self._log.debug("Recorded snapshot of region=%s size=%d, keeping %d snapshots", region, len(data),
+                        len(index))
+        return True
+
+    def index(self, region):
+        """
+        :param region: Name of the region
+        :return: List of the RegionSnapshots of the region, oldest first
+        """
+        return list(self._cache.get(self._index_key(region)) or [])
+
+    def snapshots(self, region, count=None):
+        """
+        :param region: Name of the region
+        :param count: Number of the most recent snapshots, None for all
+        :return: List of (RegionSnapshot, compacted features), oldest first. Snapshots whose data is missing are
+            skipped.
+        """
+        index = self.index(region)
+        if count is not None:
+            index = index[-count:] if count > 0 else []
+        snapshots = []
+        for snapshot in index:
+            data = self._cache.get(self._data_key(region, snapshot.content_hash))
+            if data is not None:
+                snapshots.append((snapshot, data))
+        return snapshots
+
+    @staticmethod
+    def _index_key(region):
+        return "history_" + region
+
+    @staticmethod
+    def _data_key(region, features_hash):
+        return "snapshot_%s_%s" % (region, features_hash)
@@ -0,0 +1,223 @@
+import gzip
+import json
+import logging
+import threading
+import time
+
+import cartopy.crs as ccrs
+import numpy as np
+from shapely import vectorized
+from shapely.geometry import box, Polygon, MultiPolygon, Point
+
+from content_hash import content_hash
+from custom_region import is_custom_region
+from geometry_cache import GeometryCache
+from model import Metars, VectorOverlay, SIGMET_SOURCES
+
+# Number of locks shared by the overlays of all regions and zoom levels
+LOCK_STRIPES = 64
+
+
+class VectorOverlays:
+    """
+    Provides the SIGMET, AIRMET, CWA and METAR overlay of a region as compact JSON for rendering on the client.
+
+    Features are clipped to the region box and projected into the region's projection like on the rendered map and
+    carry the same numbered labels. Coordinates are simplified and quantized to the size of one pixel at the
+    requested zoom level, zoom level 0 being the resolution of the rendered map and every further level doubling it.
+
+    Overlays are built without matplotlib and kept in the cache shared by all worker processes. An overlay which was
+    checked within fresh seconds is served without loading the features of the region.
+    """
+    _log = logging.getLogger('vector_overlays')
+
+    def __init__(self, load_features, get_base_map, cache, geometry_cache=None, fresh=60, base_width=1080,
+                 tolerance=1.0, max_zoom=6, custom_max_age=3600):
+        """
+        :param load_features: Callable loading the Features of a region, load_features(region)
+        :param get_base_map: Callable providing the BaseMap of a region, get_base_map(region)
+        :param cache: Cache shared by all processes, storing the built overlays
+        :param geometry_cache: GeometryCache of the repaired feature geometries
+        :param fresh: Seconds after which the inputs of an overlay are checked again
+        :param base_width: Width in pixels of the rendered map, which is the resolution of zoom level 0
+        :param tolerance: Simplification tolerance in pixels
+        :param max_zoom: Highest supported zoom level
+        :param custom_max_age: Seconds after their last check after which overlays of custom regions expire from the
+            cache
+        """
+        self._load_features = load_features
+        self._get_base_map = get_base_map
+        self._cache = cache
+        self._geometry_cache = geometry_cache if geometry_cache is not None else GeometryCache()
+        self._fresh = fresh
+        self._base_width = base_width
+        self._tolerance = tolerance
+        self.max_zoom = max_zoom
+        self._custom_max_age = custom_max_age
+        # Overlays share a fixed number of locks, custom regions would otherwise add a lock per extent
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def get(self, region, zoom=0):
+        """
+        Provides the overlay of the region, building it only if its inputs changed.
+
+        :param region: Name of the region
+        :param zoom: Zoom level from 0 to max_zoom
+        :return: VectorOverlay
+        :raises ValueError: If the zoom level is not supported
+        """
+        if not 0 <= zoom <= self.max_zoom:
+            raise ValueError("Zoom level %d is not between 0 and %d" % (zoom, self.max_zoom))
+
+        key = "overlay_%s_%d" % (region, zoom)
+        overlay = self._cache.get(key)
+        if overlay is not None and time.time() - overlay.checked <= self._fresh:
+            return overlay
+
+        with self._lock(key):
+            # Another thread might have built the overlay while waiting for the lock
+            overlay = self._cache.get(key)
+            if overlay is not None and time.time() - overlay.checked <= self._fresh:
+                return overlay
+
+            features = self._load_features(region)
+            # The overlay does not contain the title, the zoom level is part of the cache key
+            features_hash = content_hash(region, features, "")
+            if overlay is not None and overlay.content_hash == features_hash:
+                overlay.checked = time.time()
+            else:
+                body = json.dumps(self.build(region, features, zoom), separators=(',', ':')).encode("utf-8")
+                overlay = VectorOverlay(region, zoom, features_hash, body, gzip.compress(body, 6), time.time())
+                self._log.info("Built overlay of region=%s zoom=%d size=%d gzipped=%d", region, zoom, len(body),
+                               len(overlay.gzipped))
+            self._cache.set(key, overlay, timeout=self._custom_max_age if is_custom_region(region) else 0)
+            return overlay
+
+    def build(self, region, features, zoom):
+        """
+        Clips, projects, simplifies and quantizes the features of a region.
+
+        :param region: Name of the region
+        :param features: Features of the region
+        :param zoom: Zoom level
+        :return: JSON serializable overlay. Quantized coordinates x are projected coordinates
+            x * scale + translate, labels are numbered like on the rendered map and refer to the info texts.
+        """
+        base_map = self._get_base_map(region)
+        projection = base_map.projection
+        x0, y0, x1, y1 = base_map.view_limits
+        view_box = box(x0, y0, x1, y1)
+        scale = (x1 - x0) / (self._base_width * 2 ** zoom)
+        quantizer = _Quantizer(x0, y0, scale)
+        data_crs = ccrs.PlateCarree()
+
+        overlay_features = []
+        info = {}
+        failed = []
+        for source, label_property, text_property in SIGMET_SOURCES:
+            collection = getattr(features, source)["features"]
+            self._geometry_cache.sync(region, source, collection)
+            for feat in collection:
+                try:
+                    entry = self._geometry_cache.get(feat)
+                except ValueError:
+                    failed.append(feat['properties'][text_property])
+                    continue
+                if entry.geometry is None:
+                    continue
+                # Only features with a visible part are labeled, which numbers them like PlotFeatures does
+                centroid = self._geometry_cache.region_centroid(entry, region, base_map.region_box)
+                if centroid is None:
+                    continue
+
+                idx = len(info) + 1
+                info[idx] = feat["properties"][text_property]
+                label = feat["properties"][label_property]
+                label = base_map.color_scheme.TEXT_REPLACEMENT.get(label, label)
+
+                visible = entry.geometry.intersection(base_map.region_box)
+                projected = projection.project_geometry(visible, data_crs).intersection(view_box)
+                geometry = quantizer.geometry(projected.simplify(scale * self._tolerance, preserve_topology=True))
+                label_x, label_y = projection.transform_point(centroid.x, centroid.y, data_crs)
+                overlay_features.append({"id": idx, "source": source, "label": label,
+                                         "unknown": feat["properties"].get("geom", "") == "UNK",
+                                         "label_position": quantizer.point(label_x, label_y),
+                                         "geometry": geometry})
+
+        return {"region": region,
+                "crs": projection.proj4_init,
+                "transform": {"scale": [scale, scale], "translate": [x0, y0]},
+                "size": quantizer.point(x1, y1),
+                "features": overlay_features,
+                "metars": self._metars(features.metars, base_map, quantizer),
+                "info": info,
+                "failed": failed}
+
+    @staticmethod
+    def _metars(metars, base_map, quantizer):
+        longitude = metars.longitude.astype(float)
+        latitude = metars.latitude.astype(float)
+        inside = vectorized.contains(base_map.region_box, longitude, latitude)
+        projected = base_map.projection.transform_points(ccrs.PlateCarree(), longitude[inside], latitude[inside])
+        return {"categories": list(Metars.CATEGORIES),
+                "x": quantizer.values(projected[:, 0], 0).tolist(),
+                "y": quantizer.values(projected[:, 1], 1).tolist(),
+                "category": metars.category[inside].tolist(),
+                "observation_time": metars.observation_time[inside].tolist()}
+
+    def _lock(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class _Quantizer:
+    """
+    Converts projected coordinates to integer multiples of scale relative to the origin (x0, y0).
+    """
+
+    def __init__(self, x0, y0, scale):
+        self._origin = np.array([x0, y0])
+        self._scale = scale
+
+    def values(self, coordinates, axis):
+        return np.round((coordinates - self._origin[axis]) / self._scale).astype(np.int64)
+
+    def point(self, x, y):
+        return [int(round((x - self._origin[0]) / self._scale)), int(round((y - self._origin[1]) / self._scale))]
+
+    def ring(self, coords):
+        quantized = np.round((np.asarray(coords)[:, :2] - self._origin) / self._scale).astype(np.int64)
+        # Drop points which collapsed onto their predecessor
+        keep = np.ones(len(quantized), dtype=bool)
+        keep[1:] = (np.diff(quantized, axis=0) != 0).any(axis=1)
+        quantized = quantized[keep]
+        return quantized.tolist() if len(quantized) >= 4 else None
+
+    def polygon(self, polygon):
+        exterior = self.ring(polygon.exterior.coords)
+        if exterior is None:
+            return None
+        interiors = [self.ring(interior.coords) for interior in polygon.interiors]
+        return [exterior] + [interior for interior in interiors if interior is not None]
+
+    def geometry(self, geometry):
+        """
+        :param geometry: Projected shapely geometry
+        :return: GEOJSON geometry with quantized coordinates, None if nothing is left at this resolution
+        """
+        if geometry.is_empty:
+            return None
+        if isinstance(geometry, Point):
+            return {"type": "Point", "coordinates": self.point(geometry.x, geometry.y)}
+        if isinstance(geometry, Polygon):
+            polygons = [geometry]
+        elif isinstance(geometry, MultiPolygon):
+            polygons = list(geometry.geoms)
+        else:
+            # Clipping can leave a collection of polygons and lines, only the polygons are drawn
+            polygons = [part for part in getattr(geometry, 'geoms', []) if isinstance(part, Polygon)]
+        quantized = [coordinates for coordinates in map(self.polygon, polygons) if coordinates is not None]
+        if not quantized:
+            return None
+        if len(quantized) == 1:
+            return {"type": "Polygon", "coordinates": quantized[0]}
+        return {"type": "MultiPolygon", "coordinates": quantized}
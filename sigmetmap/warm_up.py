@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+
+from instrumentation import Timings
+
+
+class WarmUp:
+    """
+    Runs the warm-up steps of a service process in a background thread, so the process answers requests right away
+    and reports ready once everything is loaded.
+
+    Every step is timed. When all steps finished, the time since the process started is recorded as startup and
+    all durations are sent to the metrics as startup.<step>_ms. A process whose warm-up failed never becomes ready.
+    """
+    _log = logging.getLogger('warm_up')
+
+    def __init__(self, started=None, metrics=None):
+        """
+        :param started: time.perf_counter() when the process started, defaults to now
+        :param metrics: MetricsSender receiving the durations of the steps
+        """
+        self._started = started if started is not None else time.perf_counter()
+        self._metrics = metrics
+        self._steps = []
+        self._ready = threading.Event()
+        self.timings = Timings()
+        self.error = None
+
+    def add_step(self, name, step):
+        """
+        :param name: Name of the step, used for its timing
+        :param step: Callable without arguments, steps are run in the order they were added
+        """
+        self._steps.append((name, step))
+
+    def start(self):
+        threading.Thread(target=self.run, name='warm_up', daemon=True).start()
+
+    def run(self):
+        try:
+            for name, step in self._steps:
+                with self.timings.stage(name):
+                    step()
+                self._log.info("Warm-up step=%s took %.0fms", name, self.timings.durations[name] * 1000)
+        except Exception as error:
+            self._log.exception("Warm-up failed, the process will not become ready")
+            self.error = error
+            return
+        self.timings.record('startup', time.perf_counter() - self._started)
+        self._ready.set()
+        self._log.info("Ready after %.0fms", self.timings.durations['startup'] * 1000)
+        if self._metrics is not None:
+            self._metrics.send_timings("startup", self.timings)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: Seconds to wait at most, None waits until the warm-up finished
+        :return: True if the process is ready
+        """
+        return self._ready.wait(timeout)
+
+    def report(self):
+        """
+        :return: Dictionary of the readiness, the error of a failed warm-up and the durations of the finished steps
+        """
+        return {"ready": self.ready,
+                "error": str(self.error) if self.error is not None else None,
+                "durations_ms": {name: round(duration * 1000, 1) for name, duration in self.timings.durations.items()}}
@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from admission import AdmissionControl, DegradedMode, Saturated
+from model import Features, Metars
+
+
+class AdmissionControlTest(unittest.TestCase):
+
+    def test_render_without_waiting_is_shed_when_saturated(self):
+        admission = AdmissionControl(max_concurrent=1)
+
+        with admission.admit() as degraded:
+            self.assertFalse(degraded)
+            self.assertTrue(admission.saturated)
+            with self.assertRaises(Saturated):
+                with admission.admit(wait=False):
+                    pass
+        self.assertFalse(admission.saturated)
+        self.assertEqual(1, admission.shed)
+
+    def test_render_is_shed_when_the_queue_is_full(self):
+        admission = AdmissionControl(max_concurrent=1, max_queued=0)
+
+        with admission.admit():
+            with self.assertRaises(Saturated):
+                with admission.admit():
+                    pass
+
+    def test_render_is_shed_after_queue_timeout(self):
+        admission = AdmissionControl(max_concurrent=1, queue_timeout=0.01)
+
+        with admission.admit():
+            with self.assertRaises(Saturated):
+                with admission.admit():
+                    pass
+
+    def test_queued_renders_are_degraded(self):
+        admission = AdmissionControl(max_concurrent=1, degrade_queued=1)
+        results = []
+
+        def queued():
+            with admission.admit() as degraded:
+                results.append(degraded)
+
+        with admission.admit():
+            threads = [threading.Thread(target=queued) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            deadline = time.time() + 5
+            while admission._queued < 2 and time.time() < deadline:
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+
+        # The first render leaving the queue still sees the second one waiting, the last one has no queue behind it
+        self.assertEqual([True, False], results)
+        self.assertEqual(1, admission.degraded)
+
+
+class DegradedModeTest(unittest.TestCase):
+
+    def test_every_other_metar_is_kept(self):
+        metars = Metars(np.arange(5, dtype=np.float32), np.arange(5, dtype=np.float32), np.zeros(5, np.int8),
+                        np.zeros(5, np.int64))
+        features = Features({"features": []}, {"features": []}, {"features": []}, metars)
+
+        thinned = DegradedMode(metar_stride=2).thin(features)
+
+        self.assertEqual([0, 2, 4], thinned.metars.longitude.tolist())
+        self.assertIs(features, DegradedMode(metar_stride=1).thin(features))
+
+
+if __name__ == '__main__':
+    unittest.main()
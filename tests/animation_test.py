@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+
+import numpy as np
+from cachelib import SimpleCache
+from PIL import Image
+
+from animation import AnimationWriter, Animations
+from artifact_store import ArtifactStore
+from color_scheme import DefaultColorScheme, metar_colors
+from model import PlotResult, RegionSnapshot
+from single_flight import SingleFlight
+
+
+class FakeHistory:
+
+    def __init__(self):
+        self.snapshot_list = [(RegionSnapshot(1000, "a", 1), b"a"), (RegionSnapshot(1600, "b", 1), b"b")]
+
+    def index(self, region):
+        return [snapshot for snapshot, _ in self.snapshot_list]
+
+    def snapshots(self, region, count=None):
+        return self.snapshot_list[-count:]
+
+
+class AnimationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = FakeHistory()
+        self.animated = []
+        self.animations = Animations(self.history, self.animate, ArtifactStore(), SimpleCache(),
+                                     SingleFlight(tempfile.mkdtemp()))
+
+    def animate(self, region, snapshots, format, frame_seconds):
+        self.animated.append([snapshot.content_hash for snapshot, _ in snapshots])
+        return PlotResult(None, {}, [], image=b"".join(data for _, data in snapshots))
+
+    def test_frames_are_written_as_a_loop(self):
+        for format, signature in [('apng', b"acTL"), ('gif', b"NETSCAPE2.0")]:
+            writer = AnimationWriter(format)
+            for color in ['red', 'blue', 'red']:
+                writer.add(Image.new('RGBA', (40, 30), color))
+
+            self.assertIn(signature, writer.finish())
+
+    def test_unsupported_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            AnimationWriter('avi')
+
+    def test_animation_is_rendered_again_only_if_the_snapshots_changed(self):
+        first = self.animations.get("eu", 'gif')
+        self.assertEqual(first.file_name, self.animations.get("eu", 'gif').file_name)
+
+        self.history.snapshot_list.append((RegionSnapshot(2200, "c", 1), b"c"))
+        latest = self.animations.get("eu", 'gif', frames=2)
+
+        self.assertEqual([["a", "b"], ["b", "c"]], self.animated)
+        self.assertNotEqual(first.content_hash, latest.content_hash)
+
+    def test_frames_are_clamped_to_the_recorded_snapshots(self):
+        all_frames = self.animations.get("eu", 'gif', frames=5000)
+
+        self.assertEqual(all_frames.file_name, self.animations.get("eu", 'gif', frames=2).file_name)
+        self.assertEqual(all_frames.file_name, self.animations.get("eu", 'gif').file_name)
+        self.assertEqual(1, len(self.animated))
+        self.animations.get("eu", 'gif', frames=-3)
+        self.assertEqual([["a", "b"], ["b"]], self.animated)
+
+    def test_metars_of_an_old_frame_are_faded_from_the_frame_time(self):
+        frame_time = 1538654400
+        observation_time = np.array([frame_time - 30 * 60], np.int64)
+        category = np.array([0], np.int8)
+
+        colors = metar_colors(DefaultColorScheme, category, observation_time, now=frame_time)
+
+        self.assertAlmostEqual(DefaultColorScheme.METAR_ALPHA, colors[0, 3])
+        self.assertEqual(0, metar_colors(DefaultColorScheme, category, observation_time)[0, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
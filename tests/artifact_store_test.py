@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+import unittest
+
+from artifact_store import ArtifactStore
+
+
+class ArtifactStoreTest(unittest.TestCase):
+
+    def test_identical_content_is_stored_once(self):
+        store = ArtifactStore()
+
+        first = store.put(b"map", ".png")
+        second = store.put(b"map", ".png")
+
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith(".png"))
+        self.assertEqual(1, len(store))
+        self.assertEqual(b"map", store.get(first))
+
+    def test_least_recently_used_artifacts_are_evicted_from_memory(self):
+        store = ArtifactStore(max_bytes=8)
+        first = store.put(b"aaaa", ".png")
+        second = store.put(b"bbbb", ".png")
+        store.get(first)
+
+        third = store.put(b"cccc", ".png")
+
+        self.assertIsNone(store.get(second))
+        self.assertEqual(b"aaaa", store.get(first))
+        self.assertEqual(b"cccc", store.get(third))
+
+    def test_evicted_artifacts_are_read_from_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ArtifactStore(max_bytes=4, directory=directory)
+            first = store.put(b"aaaa", ".png")
+            store.put(b"bbbb", ".png")
+
+            self.assertEqual(b"aaaa", store.get(first))
+            # Another process sharing the directory
+            self.assertEqual(b"aaaa", ArtifactStore(directory=directory).get(first))
+
+    def test_expired_artifacts_are_removed_unless_pinned(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ArtifactStore(directory=directory, max_age=60)
+            old = store.put(b"old", ".png")
+            published = store.put(b"published", ".png")
+            store.pin("eu", published)
+            past = time.time() - 120
+            os.utime(os.path.join(directory, old), (past, past))
+            store._index[old] = past
+            store._index[published] = past
+
+            self.assertEqual(1, store.expire())
+
+            self.assertIsNone(store.get(old))
+            self.assertFalse(os.path.exists(os.path.join(directory, old)))
+            self.assertEqual(b"published", store.get(published))
+
+    def test_touched_artifacts_expire_once_no_longer_touched(self):
+        store = ArtifactStore(max_age=60)
+        touched = store.put(b"custom", ".png")
+        store._index[touched] = time.time() - 120
+
+        store.touch(touched)
+        self.assertEqual(0, store.expire())
+
+        store._index[touched] = time.time() - 120
+        self.assertEqual(1, store.expire())
+
+    def test_artifacts_of_previous_runs_are_indexed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            key = ArtifactStore(directory=directory).put(b"map", ".png")
+
+            self.assertIn(key, ArtifactStore(directory=directory))
+
+    def test_keys_outside_of_the_directory_are_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(ArtifactStore(directory=directory).get("../secret"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from batch_render import render_all, render_batch, write_atomically
+from feature_store import FeatureStore
+from image_encoder import ImageEncoder
+from instrumentation import Timings
+from model import PlotResult
+
+
+class SigmetMapStub:
+
+    def load_features(self, region):
+        return region
+
+
+class RenderPoolStub:
+
+    def __init__(self, failing=()):
+        self.failing = failing
+
+    def render(self, region, features, output_path):
+        if region in self.failing:
+            raise RuntimeError("Rendering %s failed" % region)
+        return PlotResult(output_path, {1: features.upper()}, [], Timings(), image=features.encode("utf-8"))
+
+
+class BatchRenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.store = FeatureStore(lambda definition: (definition[0], {"features": []}),
+                                  sources=[("sigmets_international", "http://sigmets", None)])
+
+    def test_failed_write_leaves_the_previous_file(self):
+        path = os.path.join(self.output_dir, "eu.png")
+        write_atomically(path, b"previous")
+
+        with self.assertRaises(TypeError):
+            write_atomically(path, "not bytes")
+
+        with open(path, 'rb') as written:
+            self.assertEqual(b"previous", written.read())
+        self.assertEqual(["eu.png"], os.listdir(self.output_dir))
+
+    def test_render_all_writes_image_and_info_of_every_region(self):
+        timings, errors = render_all(["eu", "na"], SigmetMapStub(), RenderPoolStub(), ImageEncoder(),
+                                     self.output_dir)
+
+        self.assertEqual({}, errors)
+        self.assertEqual(["eu", "na"], list(timings))
+        with open(os.path.join(self.output_dir, "eu.png"), 'rb') as image:
+            self.assertEqual(b"eu", image.read())
+        with open(os.path.join(self.output_dir, "na.json")) as info:
+            self.assertEqual({"1": "NA"}, json.load(info)["infos"])
+
+    def test_failed_region_is_reported_with_a_non_zero_exit_status(self):
+        out = io.StringIO()
+
+        status = render_batch(["eu", "na"], SigmetMapStub(), RenderPoolStub(failing=["na"]), self.store,
+                              ImageEncoder(), self.output_dir, out)
+
+        self.assertEqual(1, status)
+        self.assertIn("na       failed: Rendering na failed", out.getvalue())
+        self.assertEqual(["eu.json", "eu.png"], sorted(os.listdir(self.output_dir)))
+        self.assertEqual(0, render_batch(["eu"], SigmetMapStub(), RenderPoolStub(), self.store, ImageEncoder(),
+                                         self.output_dir, io.StringIO()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+"""
+Offline benchmark of the map rendering pipeline.
+
+Replays the recorded upstream payloads in reference/ (see generate_test_data.py) through a fixture backed
+FeatureProvider for every region, times each stage of the pipeline, measures peak memory and the throughput of
+repeated renders and stores the results per commit, so regressions can be compared across commits. Synthetic
+scenarios scale the recorded SIGMETs and METARs to find the load at which rendering breaks down.
+
+Run it from the tests directory like generate_test_data.py:
+
+    python benchmark.py --repeat 5 --compare benchmark_results/<previous commit>.json
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from instrumentation import Timings
+from model import Metars, Features
+from sigmet_map import FeatureProvider, MapProvider, SigmetMap, LegendProvider
+
+# Scale factors of the SIGMETs, AIRMETs and CWAs and of the METARs per scenario
+SCENARIOS = {'recorded': (1, 1),
+             'sigmets_10x': (10, 1),
+             'metars_10x': (1, 10),
+             'all_10x': (10, 10)}
+
+# Size of the synthetic base data of a region whose recorded fixture is empty
+SYNTHETIC_SIGMETS = 20
+SYNTHETIC_METARS = 1500
+
+# A scenario whose renders exceed this many seconds on average is reported as broken
+MAX_RENDER_SECONDS = 30
+
+
+class ReplayFeatureProvider(FeatureProvider):
+    """
+    Loads every source from the payloads intercepted by generate_test_data.py instead of the web.
+    """
+    _log = logging.getLogger('replay_feature_provider')
+
+    def __init__(self, ref_dir, prefix):
+        self.ref_dir = ref_dir
+        self.prefix = prefix
+        super().__init__()
+
+    def load_from_web(self, definition):
+        name, url, decoder = definition
+        path = os.path.join(self.ref_dir, self.prefix + "_" + name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self._log.warning("No recorded payload for source=%s region=%s, using an empty one", name, self.prefix)
+            return name, empty_payload(name)
+        with open(path, "rb") as response:
+            return name, decoder(response)
+
+
+class LegendProviderStub(LegendProvider):
+
+    def get_title(self):
+        return "TESTDATA"
+
+
+def empty_payload(name):
+    if name == "metars":
+        return Metars(np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int8),
+                      np.empty(0, dtype=np.int64))
+    return {"type": "FeatureCollection", "features": []}
+
+
+def synthetic_features(extent, rng, sigmets=SYNTHETIC_SIGMETS, metars=SYNTHETIC_METARS):
+    """
+    Creates random SIGMET polygons and METARs within the extent, used if no payloads were recorded.
+
+    :param extent: [west, east, south, north] in degrees
+    :param rng: numpy RandomState
+    :return: Features
+    """
+    west, east, south, north = extent
+    features = []
+    for number in range(sigmets):
+        longitude, latitude = rng.uniform(west, east), rng.uniform(south, north)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 6))
+        radius = rng.uniform(1, 5, 6)
+        shell = [[float(longitude + r * np.cos(a)), float(latitude + r * np.sin(a))] for a, r in zip(angles, radius)]
+        shell.append(shell[0])
+        features.append({"type": "Feature",
+                         "properties": {"hazard": ("TS", "TURB", "ICE", "MTW")[number % 4],
+                                        "rawSigmet": "SYNTHETIC SIGMET %d" % number},
+                         "geometry": {"type": "Polygon", "coordinates": [shell]}})
+
+    now = int(time.time())
+    metar_data = Metars(rng.uniform(west, east, metars).astype(np.float32),
+                        rng.uniform(south, north, metars).astype(np.float32),
+                        rng.randint(0, len(Metars.CATEGORIES), metars).astype(np.int8),
+                        now - rng.randint(0, 3 * 60 * 60, metars).astype(np.int64))
+    return Features({"type": "FeatureCollection", "features": features}, empty_payload("sigmets_us"),
+                    empty_payload("cwa_us"), metar_data)
+
+
+def scale_features(features, sigmet_factor, metar_factor, rng, jitter=2.0):
+    """
+    Multiplies the features, every copy is shifted by a random offset so the copies do not overlap exactly.
+
+    :param features: Features to scale
+    :param sigmet_factor: Number of copies of every SIGMET, AIRMET and CWA
+    :param metar_factor: Number of copies of every METAR
+    :param rng: numpy RandomState
+    :param jitter: Maximum offset of a copy in degrees
+    :return: Features
+    """
+    def scale_collection(collection):
+        scaled = []
+        for copy_number in range(sigmet_factor):
+            offset = (0.0, 0.0) if copy_number == 0 else tuple(rng.uniform(-jitter, jitter, 2))
+            for feat in collection.get("features", []):
+                scaled.append(_shifted(feat, offset))
+        return dict(collection, features=scaled)
+
+    metars = features.metars
+    copies = metar_factor - 1
+    offsets = rng.uniform(-jitter, jitter, (2, len(metars) * copies)).astype(np.float32)
+    scaled_metars = Metars(np.concatenate([metars.longitude, np.tile(metars.longitude, copies) + offsets[0]]),
+                           np.concatenate([metars.latitude, np.tile(metars.latitude, copies) + offsets[1]]),
+                           np.tile(metars.category, metar_factor), np.tile(metars.observation_time, metar_factor))
+
+    return Features(scale_collection(features.sigmets_international), scale_collection(features.sigmets_us),
+                    scale_collection(features.cwa_us), scaled_metars)
+
+
+def _shifted(feat, offset):
+    shifted = copy.deepcopy(feat)
+    geometry = shifted["geometry"]
+    if geometry["type"] == "Point":
+        geometry["coordinates"] = [geometry["coordinates"][0] + offset[0], geometry["coordinates"][1] + offset[1]]
+    elif geometry["type"] == "Polygon":
+        geometry["coordinates"] = [[[point[0] + offset[0], point[1] + offset[1]] for point in ring]
+                                   for ring in geometry["coordinates"]]
+    return shifted
+
+
+def feature_count(features):
+    return sum(len(collection.get("features", []))
+               for collection in (features.sigmets_international, features.sigmets_us, features.cwa_us))
+
+
+def benchmark_region(sigmet_map, map_provider, region, scenario, repeat, output_dir, rng):
+    """
+    Renders one region repeatedly with the scaled features of the scenario.
+
+    :return: Dictionary with the mean stage durations in milliseconds, counts, throughput and peak memory
+    """
+    sigmet_factor, metar_factor = SCENARIOS[scenario]
+
+    load_timings = Timings()
+    with load_timings.stage('load'):
+        features = sigmet_map.load_features(region)
+    if feature_count(features) == 0 and len(features.metars) == 0:
+        features = synthetic_features(map_provider.get_extent(region), rng)
+    features = scale_features(features, sigmet_factor, metar_factor, rng)
+
+    output_path = os.path.join(output_dir, "%s_%s.png" % (region, scenario))
+    # The first render warms up the figure and the geometry cache and is not measured
+    sigmet_map.render(region, features, output_path)
+
+    timings = Timings()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        timings.merge(sigmet_map.render(region, features, output_path).timings)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    sigmet_map.render(region, features, output_path)
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages = {name: round(duration * 1000 / repeat, 3) for name, duration in timings.durations.items()}
+    stages['load'] = round(load_timings.durations['load'] * 1000, 3)
+    return {'stages_ms': stages,
+            'sigmets': feature_count(features),
+            'metars': len(features.metars),
+            'renders_per_second': round(repeat / elapsed, 3),
+            'python_peak_kb': python_peak // 1024,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'image_bytes': os.path.getsize(output_path),
+            'broken': elapsed / repeat > MAX_RENDER_SECONDS}
+
+
+def commit_id():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], universal_newlines=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"]) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def compare(results, previous):
+    """
+    Prints the relative change of the total render time and the throughput of every region and scenario.
+    """
+    for key, result in sorted(results['regions'].items()):
+        before = previous['regions'].get(key)
+        if before is None:
+            continue
+        render_before, render_now = before['stages_ms'].get('render'), result['stages_ms'].get('render')
+        if render_before and render_now:
+            print("%-20s render %8.1fms -> %8.1fms (%+.1f%%)  %6.2f -> %6.2f renders/s" %
+                  (key, render_before, render_now, (render_now / render_before - 1) * 100,
+                   before['renders_per_second'], result['renders_per_second']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks rendering all regions from the recorded fixtures")
+    parser.add_argument("--ref-dir", default="reference/")
+    parser.add_argument("--results-dir", default="benchmark_results/")
+    parser.add_argument("--repeat", type=int, default=3, help="measured renders per region and scenario")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run, may be given several times, all by default")
+    parser.add_argument("--region", action="append", help="region to run, may be given several times")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    rng = np.random.RandomState(20181004)
+    map_provider = MapProvider()
+    map_provider.prepare()
+    regions = args.region or map_provider.get_regions()
+
+    results = {'commit': commit_id(), 'created': time.time(), 'repeat': args.repeat, 'regions': {}}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for region in regions:
+            sigmet_map = SigmetMap(map_provider, ReplayFeatureProvider(args.ref_dir, region), LegendProviderStub())
+            for scenario in args.scenario or sorted(SCENARIOS):
+                result = benchmark_region(sigmet_map, map_provider, region, scenario, args.repeat, output_dir, rng)
+                results['regions']["%s/%s" % (region, scenario)] = result
+                print("%-20s %8.1fms %6.2f renders/s sigmets=%d metars=%d peak=%dkB%s" %
+                      ("%s/%s" % (region, scenario), result['stages_ms']['render'], result['renders_per_second'],
+                       result['sigmets'], result['metars'], result['python_peak_kb'],
+                       " BROKEN" if result['broken'] else ""))
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_path = os.path.join(args.results_dir, results['commit'] + ".json")
+    with open(results_path, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    print("Results written to %s" % results_path)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(results, json.load(previous_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+
+from content_hash import content_hash
+from model import Features, Metars
+
+
+def features(hazard):
+    sigmets = {"type": "FeatureCollection",
+               "features": [{"type": "Feature", "properties": {"hazard": hazard},
+                             "geometry": {"type": "Point", "coordinates": [10, 50]}}]}
+    metars = Metars(np.array([10.0], dtype=np.float32), np.array([50.0], dtype=np.float32),
+                    np.array([0], dtype=np.int8), np.array([1538654400], dtype=np.int64))
+    return Features(sigmets, {"features": []}, {"features": []}, metars)
+
+
+class ContentHashTest(unittest.TestCase):
+
+    def test_equal_inputs_have_equal_hashes(self):
+        self.assertEqual(content_hash("eu", features("TS"), "2018-10-04 12:00Z"),
+                         content_hash("eu", features("TS"), "2018-10-04 12:00Z"))
+
+    def test_changed_inputs_change_the_hash(self):
+        reference = content_hash("eu", features("TS"), "2018-10-04 12:00Z")
+
+        self.assertNotEqual(reference, content_hash("eu", features("ICE"), "2018-10-04 12:00Z"))
+        self.assertNotEqual(reference, content_hash("na", features("TS"), "2018-10-04 12:00Z"))
+        self.assertNotEqual(reference, content_hash("eu", features("TS"), "2018-10-04 12:01Z"))
+
+
+if __name__ == '__main__':
+    unittest.main()
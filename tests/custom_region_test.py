@@ -0,0 +1,52 @@
+import unittest
+
+from custom_region import custom_region, custom_region_around, custom_extent, is_custom_region, \
+    lambert_conformal_parameters
+
+
+class CustomRegionTest(unittest.TestCase):
+
+    def test_extent_is_rounded_into_the_name(self):
+        region = custom_region(-10.04, 27.01, 32.96, 70.0)
+
+        self.assertEqual("custom_-10.0_27.0_33.0_70.0", region)
+        self.assertTrue(is_custom_region(region))
+        self.assertEqual([-10.0, 27.0, 33.0, 70.0], custom_extent(region))
+
+    def test_negative_zero_is_named_like_zero(self):
+        self.assertEqual(custom_region(0.0, 10, 40, 50), custom_region(-0.01, 10, 40, 50))
+
+    def test_region_around_a_center(self):
+        self.assertEqual("custom_0.0_20.0_40.0_60.0", custom_region_around(10, 50, 20))
+
+    def test_unsupported_extents_are_rejected(self):
+        for extent in [(10, 0, 40, 50), (0, 10, 50, 40), (0, 10, 80, 90), (0, 200, 0, 10), (0, 0.5, 40, 50)]:
+            with self.assertRaises(ValueError):
+                custom_region(*extent)
+
+    def test_only_names_of_custom_regions_are_accepted(self):
+        for region in ["eu", "custom_a_b_c_d", "custom_0_10_40_50", "custom_0.0_10.0_40.0"]:
+            with self.assertRaises(ValueError):
+                custom_extent(region)
+
+    def test_standard_parallels_at_one_and_five_sixths(self):
+        parameters = lambert_conformal_parameters([0, 20, 40, 70])
+
+        self.assertEqual((45, 65), parameters['standard_parallels'])
+        self.assertEqual(10, parameters['central_longitude'])
+        self.assertEqual(55, parameters['central_latitude'])
+        self.assertEqual(-30, parameters['cutoff'])
+
+    def test_southern_extent_opens_towards_the_south_pole(self):
+        parameters = lambert_conformal_parameters([100, 160, -50, -10])
+
+        self.assertEqual(30, parameters['cutoff'])
+
+    def test_parallels_symmetric_to_the_equator_are_moved_apart(self):
+        parameters = lambert_conformal_parameters([0, 20, -30, 30])
+
+        self.assertNotAlmostEqual(0, sum(parameters['standard_parallels']))
+
+
+if __name__ == '__main__':
+    unittest.main()
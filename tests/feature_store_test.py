@@ -0,0 +1,70 @@
+import time
+import unittest
+
+from feature_store import FeatureStore, feature_bounds, clip_feature_collection
+
+
+def polygon_feature(x, y):
+    return {"type": "Feature", "properties": {},
+            "geometry": {"type": "Polygon",
+                         "coordinates": [[[x, y], [x + 1, y], [x + 1, y + 1], [x, y + 1], [x, y]]]}}
+
+
+class FeatureStoreTest(unittest.TestCase):
+
+    def test_clip_feature_collection(self):
+        collection = {"type": "FeatureCollection", "features": [polygon_feature(0, 0), polygon_feature(50, 50)]}
+
+        clipped = clip_feature_collection(collection, feature_bounds(collection), (-10, -10, 10, 10))
+
+        self.assertEqual(clipped["features"], [collection["features"][0]])
+        self.assertEqual(len(collection["features"]), 2)
+
+    def test_sources_are_loaded_once(self):
+        loaded = []
+
+        def loader(definition):
+            loaded.append(definition[0])
+            return definition[0], {"features": [polygon_feature(0, 0)]}
+
+        store = FeatureStore(loader, sources=[("a", "http://a", None), ("b", "http://b", None)])
+        first = store.snapshot()
+        second = store.snapshot()
+
+        self.assertIs(first, second)
+        self.assertEqual(sorted(loaded), ["a", "b"])
+
+    def test_outdated_sources_are_refreshed_on_read(self):
+        loaded = []
+
+        def loader(definition):
+            loaded.append(definition[0])
+            return definition[0], {"features": [polygon_feature(len(loaded), 0)]}
+
+        sources = [("a", "http://a", None)]
+        unscheduled = FeatureStore(loader, sources=sources, refresh_intervals={"a": 0}, refresh_on_read=True)
+        first = unscheduled.snapshot()
+        time.sleep(0.01)
+
+        self.assertIsNot(first, unscheduled.snapshot())
+        scheduled = FeatureStore(loader, sources=sources, refresh_intervals={"a": 0})
+        self.assertIs(scheduled.snapshot(), scheduled.snapshot())
+        self.assertEqual(3, len(loaded))
+
+    def test_failed_refresh_keeps_previous_payload(self):
+        payloads = [{"features": []}]
+
+        def loader(definition):
+            if not payloads:
+                raise IOError("upstream down")
+            return definition[0], payloads.pop()
+
+        store = FeatureStore(loader, sources=[("a", "http://a", None)])
+        previous = store.snapshot()
+        store.refresh("a")
+
+        self.assertIs(store.snapshot().payloads["a"], previous.payloads["a"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import gzip
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from feature_store import json_decoder
+from fetcher import Fetcher, FetchError
+
+
+class UpstreamStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    payload = {"features": []}
+    failures = 0
+    requests = []
+
+    def do_GET(self):
+        UpstreamStub.requests.append((self.path, self.client_address[1], self.headers.get('If-None-Match')))
+        if UpstreamStub.failures > 0:
+            UpstreamStub.failures -= 1
+            self._respond(500, b"")
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self._respond(304, b"")
+        else:
+            self._respond(200, gzip.compress(json.dumps(UpstreamStub.payload).encode("utf-8")),
+                          {'ETag': '"v1"', 'Content-Encoding': 'gzip'})
+
+    def _respond(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        UpstreamStub.failures = 0
+        UpstreamStub.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamStub)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/sigmets" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_not_modified_reuses_decoded_payload(self):
+        fetcher = Fetcher()
+
+        _, first = fetcher.load(("sigmets", self.url, json_decoder))
+        _, second = fetcher.load(("sigmets", self.url, json_decoder))
+        fetcher.close()
+
+        self.assertEqual(first, {"features": []})
+        self.assertIs(first, second)
+        self.assertEqual(UpstreamStub.requests[1][2], '"v1"')
+
+    def test_least_recently_fetched_validators_are_dropped(self):
+        fetcher = Fetcher(max_validated=1)
+
+        fetcher.load(("sigmets", self.url, json_decoder))
+        fetcher.load(("cwa", self.url + "?bbox=1,2,3,4", json_decoder))
+        fetcher.load(("sigmets", self.url, json_decoder))
+        fetcher.close()
+
+        self.assertEqual([None, None, None], [etag for _, _, etag in UpstreamStub.requests])
+
+    def test_connections_are_reused(self):
+        fetcher = Fetcher()
+
+        fetcher.load(("sigmets", self.url, json_decoder))
+        fetcher.load(("sigmets", self.url, json_decoder))
+        fetcher.close()
+
+        self.assertEqual(UpstreamStub.requests[0][1], UpstreamStub.requests[1][1])
+
+    def test_retry_budget(self):
+        fetcher = Fetcher({'default': {'retries': 1, 'backoff': 0}})
+        UpstreamStub.failures = 1
+
+        _, payload = fetcher.load(("sigmets", self.url, json_decoder))
+        UpstreamStub.failures = 2
+        with self.assertRaises(FetchError):
+            Fetcher({'default': {'retries': 1, 'backoff': 0}}).load(("sigmets", self.url, json_decoder))
+        fetcher.close()
+
+        self.assertEqual(payload, {"features": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
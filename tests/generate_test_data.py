@@ -1,4 +1,5 @@
 import datetime
+import io
 import json
 from unittest import mock
 from urllib.request import urlopen
@@ -10,22 +11,21 @@ from sigmet_map import FeatureProvider, MapProvider, SigmetMap, LegendProvider
 class InterceptingFeatureProvider(FeatureProvider):
 
     def __init__(self, ref_dir, prefix):
+        super().__init__()
         self.ref_dir = ref_dir
         self.prefix = prefix
         self.intercepted = []
 
     def load_from_web(self, definition):
         name, url, decoder = definition
-        response = urlopen(url)
-        response_decoded = decoder(response)
+        # The response can only be read once, so it is recorded before it is decoded from the recorded content
+        content = urlopen(url).read()
+        self._write(name, content)
 
-        self._write(name, response)
+        return name, decoder(io.BytesIO(content))
 
-        return name, response_decoded
-
-    def _write(self, name, response):
+    def _write(self, name, content):
         f = open(self.ref_dir + self.prefix + "_" + name, "wb")
-        content = response.read()
         f.write(content)
         f.close()
 
@@ -38,14 +38,14 @@ class LegendProviderStub(LegendProvider):
 
 ref_dir = "reference/"
 
-feature_provider = InterceptingFeatureProvider(ref_dir, 'none')
 map_provider = MapProvider()
 legend_provider = LegendProviderStub()
-sigmet_map = SigmetMap(map_provider, feature_provider, legend_provider)
 
 
 def generate_region(region):
-    feature_provider.prefix = region
+    # A new provider per region, so the shared sources are downloaded and intercepted for every region
+    feature_provider = InterceptingFeatureProvider(ref_dir, region)
+    sigmet_map = SigmetMap(map_provider, feature_provider, legend_provider)
     result = sigmet_map.plot("%s" % region, "reference/%s.png" % region)
     with open(ref_dir + region + "_result_info.json", "w") as text_file:
         text_file.write(json.dumps(result.info))
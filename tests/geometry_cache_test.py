@@ -0,0 +1,57 @@
+import unittest
+
+from shapely.geometry import box
+
+from geometry_cache import GeometryCache
+
+
+def polygon_feature(x, y):
+    return {"type": "Feature", "properties": {},
+            "geometry": {"type": "Polygon",
+                         "coordinates": [[[x, y], [x + 2, y], [x + 2, y + 2], [x, y + 2], [x, y]]]}}
+
+
+class GeometryCacheTest(unittest.TestCase):
+
+    def test_unchanged_features_are_reused(self):
+        cache = GeometryCache()
+
+        first = cache.get(polygon_feature(0, 0))
+        second = cache.get(polygon_feature(0, 0))
+
+        self.assertIs(first, second)
+
+    def test_region_centroid(self):
+        cache = GeometryCache()
+        region_box = box(1, 1, 10, 10)
+
+        visible = cache.region_centroid(cache.get(polygon_feature(0, 0)), "eu", region_box)
+        invisible = cache.region_centroid(cache.get(polygon_feature(20, 20)), "eu", region_box)
+
+        self.assertAlmostEqual(visible.x, 1.5)
+        self.assertAlmostEqual(visible.y, 1.5)
+        self.assertIsNone(invisible)
+
+    def test_features_leaving_all_feeds_are_evicted(self):
+        cache = GeometryCache()
+        shared, removed = polygon_feature(0, 0), polygon_feature(20, 20)
+        cache.sync("eu", "sigmets_international", [shared, removed])
+        cache.sync("na", "sigmets_international", [shared])
+        cache.get(shared)
+        cache.get(removed)
+
+        cache.sync("eu", "sigmets_international", [shared])
+
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.get(shared).geometry.is_valid)
+
+    def test_unsupported_geometry(self):
+        feat = {"type": "Feature", "properties": {},
+                "geometry": {"type": "LineString", "coordinates": [[0, 0], [1, 1]]}}
+
+        with self.assertRaises(ValueError):
+            GeometryCache().get(feat)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+
+from feature_store import FeatureStore
+from hazard_index import HazardIndex
+from model import Metars
+
+
+def sigmet(hazard, x, y, size=1):
+    return {"type": "Feature", "properties": {"hazard": hazard, "rawSigmet": hazard + " SIGMET"},
+            "geometry": {"type": "Polygon", "coordinates": [[[x, y], [x + size, y], [x + size, y + size],
+                                                             [x, y + size], [x, y]]]}}
+
+
+class HazardIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sigmets = {"features": [sigmet("TS", 0, 0), sigmet("ICE", 10, 10)]}
+        cwa = sigmet("IFR", 20, -20)
+        cwa["properties"] = {"hazard": "IFR", "cwaText": "ZMA CWA"}
+        self.cwa = {"features": [cwa]}
+        self.loaded = []
+        metars = Metars(np.array([0.5, 20.0], dtype=np.float32), np.array([0.5, 20.0], dtype=np.float32),
+                        np.array([2, 0], dtype=np.int8), np.array([1538654400, 1538654400], dtype=np.int64))
+        sigmets_us = {"features": []}
+        # The fetcher returns the previously decoded payload if a source did not change
+        self.payloads = {"sigmets_international": lambda: self.sigmets,
+                         "sigmets_us": lambda: sigmets_us,
+                         "metars": lambda: metars,
+                         "cwa_us": lambda: self.cwa}
+        self.store = FeatureStore(self.load, sources=[(name, "http://" + name, None) for name in self.payloads])
+        self.index = HazardIndex(self.store)
+
+    def load(self, definition):
+        self.loaded.append(definition[0])
+        return definition[0], self.payloads[definition[0]]()
+
+    def test_point_inside_a_sigmet(self):
+        result = self.index.query_point(0.5, 0.5)
+
+        self.assertEqual(["TS"], [hazard["hazard"] for hazard in result["hazards"]])
+        self.assertEqual(["IFR"], [metar["flight_category"] for metar in result["metars"]])
+
+    def test_route_with_buffer(self):
+        self.assertEqual([], self.index.query_route([(5, 3), (5, 9)])["hazards"])
+
+        result = self.index.query_route([(5, 3), (5, 9)], buffer=6 * 60)
+
+        self.assertEqual(["TS", "ICE"], [hazard["hazard"] for hazard in result["hazards"]])
+
+    def test_negative_buffer_does_not_fail(self):
+        result = self.index.query_point(0.5, 0.5, buffer=-100)
+
+        self.assertEqual(["TS"], [hazard["hazard"] for hazard in result["hazards"]])
+        self.assertEqual([], result["metars"])
+        self.assertEqual({"hazards": [], "metars": []}, self.index.query_route([]))
+
+    def test_airports(self):
+        results = self.index.query_airports([(0.5, 0.5), (30, 30), (10.5, 10.5)])
+
+        self.assertEqual([["TS"], [], ["ICE"]],
+                         [[hazard["hazard"] for hazard in result["hazards"]] for result in results])
+
+    def test_worldwide_cwas_are_loaded_once_by_the_feature_store(self):
+        for _ in range(3):
+            result = self.index.query_point(20.5, -19.5)
+
+        self.assertEqual([("cwa_us", "ZMA CWA")], [(hazard["source"], hazard["text"]) for hazard in result["hazards"]])
+        self.assertEqual(1, self.loaded.count("cwa_us"))
+
+    def test_only_changed_sources_are_indexed_again(self):
+        self.index.query_point(0.5, 0.5)
+        unchanged = self.index._indexes["sigmets_us"]
+
+        self.sigmets = {"features": [sigmet("TURB", 30, 30)]}
+        self.store.refresh("sigmets_international")
+        self.store.refresh("sigmets_us")
+
+        self.assertEqual(["TURB"], [hazard["hazard"] for hazard in self.index.query_point(30.5, 30.5)["hazards"]])
+        self.assertIs(unchanged, self.index._indexes["sigmets_us"])
+
+
+if __name__ == '__main__':
+    unittest.main()
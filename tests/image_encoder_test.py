@@ -0,0 +1,80 @@
+import io
+import os
+import tempfile
+import unittest
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image, features as pil_features
+
+from image_encoder import ImageEncoder
+from instrumentation import Timings
+from model import PlotDefinition
+
+
+def plot_definition(region="eu"):
+    fig = Figure(figsize=(4, 4), dpi=90)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot([0, 1], [0, 1])
+    ax.set_title("2018-10-04 12:00Z", loc='right')
+    return PlotDefinition(None, fig, ax, None, None, None, region)
+
+
+class ImageEncoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def encode(self, encoder, definition, name):
+        path = os.path.join(self.directory.name, name)
+        encoder.encode(definition, path, Timings())
+        return Image.open(path)
+
+    def test_crop_matches_print_figure_tight_bbox(self):
+        definition = plot_definition()
+        reference = io.BytesIO()
+        definition.fig.canvas.print_figure(reference, format="png", pad_inches=0.2, bbox_inches="tight",
+                                           bbox_extra_artists=[], dpi=90)
+        expected = Image.open(reference).size
+
+        image = self.encode(ImageEncoder(quantize_colors=None), definition, "eu.png")
+
+        self.assertLessEqual(abs(image.size[0] - expected[0]), 2)
+        self.assertLessEqual(abs(image.size[1] - expected[1]), 2)
+        self.assertEqual("RGBA", image.mode)
+
+    def test_tight_bbox_is_computed_once_per_region(self):
+        encoder = ImageEncoder()
+        definition = plot_definition()
+        self.encode(encoder, definition, "first.png")
+        crop = encoder._crops[("eu", 360, 360, 90)]
+
+        definition.ax.set_title("2018-10-04 12:01Z", loc='right')
+        self.encode(encoder, definition, "second.png")
+
+        self.assertEqual(1, len(encoder._crops))
+        self.assertIs(crop, encoder._crops[("eu", 360, 360, 90)])
+
+    def test_quantized_png_uses_a_palette(self):
+        image = self.encode(ImageEncoder(quantize_colors=64), plot_definition(), "eu.png")
+
+        self.assertEqual("P", image.mode)
+
+    @unittest.skipUnless(pil_features.check('webp'), "Pillow was built without WebP support")
+    def test_webp(self):
+        encoder = ImageEncoder(format='webp')
+        image = self.encode(encoder, plot_definition(), "eu" + encoder.extension)
+
+        self.assertEqual("WEBP", image.format)
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ImageEncoder(format='bmp')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from instrumentation import Timings, MetricsSender, profiled
+
+
+class RecordingClient:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, metric, value):
+        self.sent.append((metric, value))
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def test_stages_accumulate_and_merge(self):
+        timings = Timings()
+        with timings.stage('labels'):
+            pass
+        with timings.stage('labels'):
+            pass
+        timings.count('metars', 3)
+
+        other = Timings()
+        with other.stage('encode'):
+            pass
+        other.count('metars', 2)
+        timings.merge(other)
+
+        self.assertEqual({'labels', 'encode'}, set(timings.durations))
+        self.assertEqual(5, timings.counts['metars'])
+
+    def test_sends_durations_in_milliseconds_and_counts(self):
+        client = RecordingClient()
+        timings = Timings()
+        timings.durations['encode'] = 0.25
+        timings.count('metars', 7)
+
+        MetricsSender(client).send_timings('render.eu', timings)
+
+        self.assertIn(('sigmet_map.render.eu.encode_ms', 250.0), client.sent)
+        self.assertIn(('sigmet_map.render.eu.metars', 7), client.sent)
+
+    def test_failing_client_does_not_raise(self):
+        class FailingClient:
+            def send(self, metric, value):
+                raise OSError("graphite unreachable")
+
+        MetricsSender(FailingClient()).send('render.eu.total_ms', 1)
+
+    def test_profiled_writes_stats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'eu.prof')
+            with profiled(path):
+                sum(range(1000))
+
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from label_placement import GreedyLabelPlacer, SpatialGrid
+
+
+class LabelPlacementTest(unittest.TestCase):
+
+    def test_spatial_grid(self):
+        grid = SpatialGrid(10)
+        grid.insert((0, 0, 15, 5))
+
+        self.assertTrue(grid.collides((12, 2, 30, 4)))
+        self.assertFalse(grid.collides((16, 0, 30, 5)))
+
+    def test_greedy_placement_removes_overlaps(self):
+        fig = Figure(figsize=(6, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(1, 1, 1)
+        ax.set_xlim(0, 10)
+        ax.set_ylim(0, 10)
+        texts = [ax.text(5, 5, "TS\n%d." % idx, ha='center', va='center') for idx in range(1, 4)]
+
+        GreedyLabelPlacer().place(ax, texts)
+
+        renderer = fig.canvas.get_renderer()
+        extents = [text.get_window_extent(renderer) for text in texts]
+        for idx, extent in enumerate(extents):
+            for other in extents[idx + 1:]:
+                self.assertFalse(extent.overlaps(other))
+        self.assertEqual(texts[0].get_position(), (5, 5))
+        self.assertEqual(len(ax.texts), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
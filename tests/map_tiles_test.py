@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+
+from feature_store import FeatureStore
+from map_tiles import MapTiles, tile_bounds, web_mercator
+from model import Metars
+
+
+def sigmet(hazard, x, y, size=1):
+    return {"type": "Feature", "properties": {"hazard": hazard, "rawSigmet": hazard + " SIGMET"},
+            "geometry": {"type": "Polygon", "coordinates": [[[x, y], [x + size, y], [x + size, y + size],
+                                                             [x, y + size], [x, y]]]}}
+
+
+class MapTilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sigmets = {"features": [sigmet("TS", 10, 45), sigmet("ICE", -100, 35)]}
+        self.metars = Metars(np.array([11.0], dtype=np.float32), np.array([46.0], dtype=np.float32),
+                             np.array([2], dtype=np.int8), np.array([1538654400], dtype=np.int64))
+        sigmets_us = {"features": []}
+        self.payloads = {"sigmets_international": lambda: self.sigmets,
+                         "sigmets_us": lambda: sigmets_us,
+                         "metars": lambda: self.metars}
+        self.store = FeatureStore(self.load, sources=[(name, "http://" + name, None) for name in self.payloads])
+        self.tiles = MapTiles(self.store)
+
+    def load(self, definition):
+        return definition[0], self.payloads[definition[0]]()
+
+    def test_tile_bounds_cover_the_web_mercator_world(self):
+        x_min, y_min, x_max, y_max = tile_bounds(0, 0, 0)
+        x, y = web_mercator(180, 85.0511287798)
+
+        self.assertAlmostEqual(x_max, x, places=3)
+        self.assertAlmostEqual(y_max, y, places=3)
+        self.assertAlmostEqual(-x_min, x_max)
+        self.assertEqual(tile_bounds(1, 1, 1)[:2], (0.0, y_min))
+
+    def test_tiles_without_features_are_transparent(self):
+        # Tile 0/0 at zoom level 3 covers the north western Pacific
+        empty = self.tiles.get(3, 0, 0)
+        europe = self.tiles.get(3, 4, 2)
+
+        self.assertNotEqual(empty.content_hash, europe.content_hash)
+        self.assertTrue(europe.image.startswith(b"\x89PNG"))
+        self.assertEqual(empty.image, self.tiles.get(3, 0, 1).image)
+
+    def test_cached_tiles_are_served_until_their_features_change(self):
+        europe = self.tiles.get(3, 4, 2)
+        america = self.tiles.get(3, 1, 3)
+        self.assertIs(europe, self.tiles.get(3, 4, 2))
+
+        self.sigmets = {"features": [sigmet("TS", 10, 45), sigmet("ICE", -100, 30)]}
+        self.store.refresh("sigmets_international")
+
+        self.assertIs(europe, self.tiles.get(3, 4, 2))
+        self.assertIsNot(america, self.tiles.get(3, 1, 3))
+
+    def test_tiles_with_metars_expire_after_max_age(self):
+        tiles = MapTiles(self.store, max_age=0)
+
+        # Tile 2/1 at zoom level 2 covers the METAR in Europe, tile 0/1 only the SIGMET in North America
+        self.assertIsNot(tiles.get(2, 2, 1), tiles.get(2, 2, 1))
+        self.assertIs(tiles.get(2, 0, 1), tiles.get(2, 0, 1))
+
+    def test_unknown_tiles_are_rejected(self):
+        for zoom, x, y in [(3, 8, 0), (3, 0, -1), (99, 0, 0)]:
+            with self.assertRaises(ValueError):
+                self.tiles.get(zoom, x, y)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import gzip
+import io
+import unittest
+
+from metar_ingest import csv_metar_decoder
+from model import Metars
+
+CSV = """No errors
+No warnings
+3 ms
+data source=metars
+4 results
+raw_text,station_id,observation_time,latitude,longitude,temp_c,flight_category
+LOWW 041200Z,LOWW,2018-10-04T12:00:00Z,48.1,16.5,10,VFR
+KXXX 041200Z,KXXX,invalid,40.0,-100.0,3,
+KYYY 041220Z,KYYY,2018-10-04T12:20:00Z,,,3,IFR
+KZZZ 041100Z,KZZZ,2018-10-04T11:00:00Z,41.0,-101.0,3,LIFR
+"""
+
+
+class MetarIngestTest(unittest.TestCase):
+
+    def test_only_plotted_columns_are_kept(self):
+        metars = csv_metar_decoder(io.BytesIO(gzip.compress(CSV.encode("utf-8"))))
+
+        self.assertEqual(len(metars), 3)
+        self.assertEqual(metars.longitude.tolist(), [16.5, -100.0, -101.0])
+        self.assertEqual([Metars.CATEGORIES[code] for code in metars.category], ['VFR', '?', 'LIFR'])
+        self.assertEqual(metars.observation_time.tolist(), [1538654400, Metars.MISSING_TIME, 1538650800])
+        self.assertEqual(metars.nbytes, 3 * (4 + 4 + 1 + 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
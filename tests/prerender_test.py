@@ -0,0 +1,141 @@
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from cachelib import SimpleCache
+
+from admission import AdmissionControl
+from artifact_store import ArtifactStore
+from custom_region import custom_region
+from model import Features, Metars, PlotResult
+from prerender import PreRenderer
+from single_flight import SingleFlight
+
+
+class PreRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.artifact_store = ArtifactStore()
+        self.hazard = "TS"
+        self.rendered = []
+        self.failing = False
+
+    def load_features(self, region):
+        sigmets = {"features": [{"type": "Feature", "properties": {"hazard": self.hazard},
+                                 "geometry": {"type": "Point", "coordinates": [10, 50]}}]}
+        metars = Metars(np.empty(0, np.float32), np.empty(0, np.float32), np.empty(0, np.int8),
+                        np.empty(0, np.int64))
+        return Features(sigmets, {"features": []}, {"features": []}, metars)
+
+    def render(self, region, features, output_path, degraded=False):
+        if self.failing:
+            raise RuntimeError("Rendering %s failed" % region)
+        self.rendered.append(region)
+        return PlotResult(output_path, {1: self.hazard}, [], image=self.hazard.encode("utf-8"))
+
+    def pre_renderer(self, fresh=60, admission=None, regions=("eu",), custom_max_age=3600):
+        self.cache = SimpleCache()
+        return PreRenderer(list(regions), self.load_features, self.render, lambda: "2018-10-04 12:00Z",
+                           self.artifact_store, self.cache, SingleFlight(self.lock_dir), fresh=fresh,
+                           admission=admission, custom_max_age=custom_max_age)
+
+    def test_render_publishes_the_stored_image(self):
+        published = self.pre_renderer().render("eu")
+
+        self.assertEqual("eu", published.region)
+        self.assertEqual({1: "TS"}, published.info)
+        self.assertEqual(b"TS", self.artifact_store.get(published.file_name))
+
+    def test_failed_render_keeps_the_published_map(self):
+        pre_renderer = self.pre_renderer()
+        published = pre_renderer.get("eu")
+        self.hazard = "ICE"
+        self.failing = True
+
+        pre_renderer.render_all()
+
+        self.assertEqual(published.file_name, pre_renderer.get("eu").file_name)
+        self.assertIn(published.file_name, self.artifact_store)
+
+    def test_render_all_publishes_every_region(self):
+        pre_renderer = self.pre_renderer(regions=("eu", "na", "sa"))
+
+        pre_renderer.render_all()
+
+        self.assertEqual(["eu", "na", "sa"], sorted(self.rendered))
+        self.assertEqual(["eu", "na", "sa"], [pre_renderer.get(region).region for region in ("eu", "na", "sa")])
+        self.assertEqual(3, len(self.rendered))
+
+    def test_published_maps_of_custom_regions_expire(self):
+        pre_renderer = self.pre_renderer(custom_max_age=1)
+        region = custom_region(5, 10, 45, 50)
+        pre_renderer.get("eu")
+        pre_renderer.get(region)
+        time.sleep(1.1)
+
+        self.assertIsNone(self.cache.get("published_" + region))
+        self.assertIsNotNone(self.cache.get("published_eu"))
+
+    def test_unchanged_inputs_are_not_rendered_again(self):
+        pre_renderer = self.pre_renderer()
+
+        first = pre_renderer.get("eu")
+        second = pre_renderer.render("eu")
+
+        self.assertEqual(first.file_name, second.file_name)
+        self.assertEqual(len(self.rendered), 1)
+        self.assertEqual(b"TS", self.artifact_store.get(first.file_name))
+
+    def test_map_published_by_another_process_is_reused(self):
+        directory = tempfile.mkdtemp()
+        other_store = ArtifactStore(directory=directory)
+        self.artifact_store = ArtifactStore(directory=directory)
+        first = self.pre_renderer().render("eu")
+        self.artifact_store = other_store
+        pre_renderer = PreRenderer(["eu"], self.load_features, self.render, lambda: "2018-10-04 12:00Z",
+                                   self.artifact_store, self.cache, SingleFlight(self.lock_dir))
+
+        second = pre_renderer.render("eu")
+
+        self.assertEqual(first.file_name, second.file_name)
+        self.assertEqual(len(self.rendered), 1)
+        self.assertEqual(b"TS", self.artifact_store.get(second.file_name))
+
+    def test_stale_map_is_served_while_revalidating(self):
+        pre_renderer = self.pre_renderer(fresh=0)
+        stale = pre_renderer.get("eu")
+        self.hazard = "ICE"
+        time.sleep(0.01)
+
+        served = pre_renderer.get("eu")
+        deadline = time.time() + 5
+        while pre_renderer.get("eu").info != {1: "ICE"} and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(served.info, {1: "TS"})
+        self.assertNotEqual(pre_renderer.get("eu").file_name, stale.file_name)
+        self.assertEqual(len(self.rendered), 2)
+
+    def test_render_is_skipped_while_locked_elsewhere(self):
+        pre_renderer = self.pre_renderer()
+
+        with SingleFlight(self.lock_dir).lock("published_eu"):
+            self.assertIsNone(pre_renderer.render("eu"))
+        self.assertEqual(self.rendered, [])
+
+    def test_published_map_is_kept_while_saturated(self):
+        admission = AdmissionControl(max_concurrent=1)
+        pre_renderer = self.pre_renderer(admission=admission)
+        published = pre_renderer.get("eu")
+        self.hazard = "ICE"
+
+        with admission.admit():
+            self.assertEqual(published.file_name, pre_renderer.render("eu").file_name)
+        self.assertEqual(1, admission.shed)
+        self.assertEqual({1: "ICE"}, pre_renderer.render("eu").info)
+
+
+if __name__ == '__main__':
+    unittest.main()
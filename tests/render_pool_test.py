@@ -0,0 +1,51 @@
+import os
+import time
+import unittest
+
+from render_pool import RenderPool, RenderPoolBusy, RenderTimeout
+
+
+class SigmetMapStub:
+
+    def render(self, region, features, output_path, degraded=False):
+        time.sleep(features)
+        return region, output_path, os.getpid()
+
+
+class RenderPoolTest(unittest.TestCase):
+
+    def test_render_runs_in_worker(self):
+        pool = RenderPool(SigmetMapStub, processes=1)
+
+        region, output_path, pid = pool.render("eu", 0, "eu.png")
+        pool.close()
+
+        self.assertEqual((region, output_path), ("eu", "eu.png"))
+        self.assertNotEqual(pid, os.getpid())
+
+    def test_wait_until_all_workers_started(self):
+        pool = RenderPool(SigmetMapStub, processes=2)
+
+        self.assertTrue(pool.wait_started(timeout=10))
+        pool.close()
+
+    def test_busy_when_too_many_pending(self):
+        pool = RenderPool(SigmetMapStub, processes=1, max_pending=0)
+
+        with self.assertRaises(RenderPoolBusy):
+            pool.render("eu", 0, "eu.png")
+        pool.close()
+
+    def test_timeout_restarts_workers(self):
+        pool = RenderPool(SigmetMapStub, processes=1, timeout=0.5)
+
+        with self.assertRaises(RenderTimeout):
+            pool.render("eu", 5, "eu.png")
+        region, _, _ = pool.render("na", 0, "na.png")
+        pool.close()
+
+        self.assertEqual(region, "na")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import cartopy.crs as ccrs
+import numpy as np
+from shapely.geometry import box, LineString
+
+from color_scheme import DefaultColorScheme
+from label_placement import create_label_placer
+from model import BaseMap, Features, Metars
+from sigmet_map import LegendProvider, MapProvider, SigmetMap
+
+
+class BaseMapCacheStub:
+    """
+    Provides the base map of Europe without any NaturalEarth layers.
+    """
+
+    def get(self, region, projection, extent, color_scheme, custom=False):
+        x0, x1, y0, y1 = extent
+        domain = LineString([(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)])
+        view_limits = projection.project_geometry(domain, projection.as_geodetic()).bounds
+        region_box = ccrs.PlateCarree().project_geometry(box(*view_limits), projection)
+        return BaseMap(region, projection, extent, region_box, "", color_scheme, [], view_limits)
+
+    def add_eviction_listener(self, listener):
+        pass
+
+
+def features(hazard, observation_time):
+    sigmet = {"type": "Feature", "properties": {"hazard": hazard, "rawSigmet": hazard + " SIGMET"},
+              "geometry": {"type": "Polygon", "coordinates": [[[5, 45], [10, 45], [10, 50], [5, 50], [5, 45]]]}}
+    metars = Metars(np.array([10.0], dtype=np.float32), np.array([50.0], dtype=np.float32),
+                    np.array([0], dtype=np.int8), np.array([observation_time], dtype=np.int64))
+    return Features({"features": [sigmet]}, {"features": []}, {"features": []}, metars)
+
+
+class SigmetMapAnimationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sigmet_map = SigmetMap(MapProvider(BaseMapCacheStub()), None, LegendProvider(),
+                                    label_placer=create_label_placer({'engine': 'greedy'}))
+
+    def test_snapshots_are_rendered_as_a_loop(self):
+        # Snapshots from days ago, the METARs are faded relative to the time of their frame
+        frames = [(1538654400, features("TS", 1538654400)), (1538655000, features("ICE", 1538655000))]
+
+        result = self.sigmet_map.animate("eu", frames, 'gif')
+
+        self.assertIn(b"NETSCAPE2.0", result.image)
+        self.assertEqual(["ICE SIGMET"], list(result.info.values()))
+        self.assertEqual(2, result.timings.counts['frames'])
+
+    def test_animation_without_frames_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.sigmet_map.animate("eu", [], 'gif')
+
+
+if __name__ == '__main__':
+    unittest.main()
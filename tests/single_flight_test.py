@@ -0,0 +1,39 @@
+import fcntl
+import os
+import tempfile
+import time
+import unittest
+
+from single_flight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.single_flight = SingleFlight(self.lock_dir)
+
+    def test_lock_is_exclusive(self):
+        with self.single_flight.lock("eu") as acquired:
+            self.assertTrue(acquired)
+            with self.single_flight.lock("eu", blocking=False) as acquired_twice:
+                self.assertFalse(acquired_twice)
+
+    def test_only_unused_lock_files_expire(self):
+        for key in ("custom", "locked", "recent"):
+            with self.single_flight.lock(key):
+                pass
+        hour_ago = time.time() - 3600
+        for key in ("custom", "locked"):
+            os.utime(os.path.join(self.lock_dir, key + ".lock"), (hour_ago, hour_ago))
+
+        with open(os.path.join(self.lock_dir, "locked.lock")) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            removed = self.single_flight.expire(60)
+
+        self.assertEqual(1, removed)
+        self.assertEqual(["locked.lock", "recent.lock"], sorted(os.listdir(self.lock_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+from cachelib import SimpleCache
+
+from model import Features, Metars
+from snapshot_history import SnapshotHistory, compact, expand
+
+
+def features(hazard, station_count=1):
+    sigmets = {"features": [{"type": "Feature",
+                             "properties": {"hazard": hazard, "rawSigmet": hazard + " SIGMET", "unused": "x" * 100},
+                             "geometry": {"type": "Point", "coordinates": [10, 50]}}]}
+    metars = Metars(np.arange(station_count, dtype=np.float32), np.arange(station_count, dtype=np.float32),
+                    np.zeros(station_count, np.int8), np.full(station_count, 1538654400, np.int64))
+    return Features(sigmets, {"features": []}, {"features": []}, metars)
+
+
+class SnapshotHistoryTest(unittest.TestCase):
+
+    def test_compacted_features_keep_the_plotted_properties(self):
+        expanded = expand(compact(features("TS", 3)))
+
+        self.assertEqual({"hazard": "TS", "rawSigmet": "TS SIGMET"},
+                         expanded.sigmets_international["features"][0]["properties"])
+        self.assertEqual([0.0, 1.0, 2.0], expanded.metars.longitude.tolist())
+        self.assertEqual([], expanded.cwa_us["features"])
+
+    def test_snapshots_are_taken_every_interval_if_the_features_changed(self):
+        history = SnapshotHistory(SimpleCache(), interval=600)
+
+        self.assertTrue(history.record("eu", features("TS"), now=1000))
+        self.assertFalse(history.record("eu", features("ICE"), now=1300))
+        self.assertFalse(history.record("eu", features("TS"), now=1600))
+        self.assertTrue(history.record("eu", features("ICE"), now=1700))
+
+        self.assertEqual([1000, 1700], [snapshot.time for snapshot, _ in history.snapshots("eu")])
+        self.assertEqual("ICE", expand(history.snapshots("eu", 1)[0][1]).sigmets_international["features"][0]
+                         ["properties"]["hazard"])
+
+    def test_oldest_snapshots_are_dropped_first(self):
+        cache = SimpleCache()
+        history = SnapshotHistory(cache, max_snapshots=2, interval=0)
+        for now, hazard in enumerate(["TS", "ICE", "TURB"]):
+            history.record("eu", features(hazard), now=now)
+
+        self.assertEqual([1, 2], [snapshot.time for snapshot in history.index("eu")])
+        self.assertEqual(2, len(history.snapshots("eu")))
+
+    def test_size_of_the_history_is_limited(self):
+        history = SnapshotHistory(SimpleCache(), max_bytes=1, interval=0)
+        history.record("eu", features("TS", 1000), now=0)
+        history.record("eu", features("ICE", 1000), now=1)
+
+        # The newest snapshot is kept even if it alone exceeds the limit
+        self.assertEqual([1], [snapshot.time for snapshot in history.index("eu")])
+
+
+if __name__ == '__main__':
+    unittest.main()
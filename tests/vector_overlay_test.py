@@ -0,0 +1,82 @@
+import gzip
+import json
+import unittest
+
+import cartopy.crs as ccrs
+import numpy as np
+from cachelib import SimpleCache
+from shapely.geometry import box, LineString
+
+from color_scheme import DefaultColorScheme
+from model import BaseMap, Features, Metars
+from vector_overlay import VectorOverlays
+
+
+def base_map():
+    projection = ccrs.LambertConformal(central_longitude=10.0, central_latitude=50.0, standard_parallels=(40, 55))
+    x0, x1, y0, y1 = [-10, 27, 33, 70]
+    domain = LineString([(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)])
+    view_limits = projection.project_geometry(domain, projection.as_geodetic()).bounds
+    region_box = ccrs.PlateCarree().project_geometry(box(*view_limits), projection)
+    return BaseMap("eu", projection, [x0, x1, y0, y1], region_box, "", DefaultColorScheme, [], view_limits)
+
+
+def polygon(hazard, x0, y0, x1, y1):
+    return {"type": "Feature", "properties": {"hazard": hazard, "rawSigmet": hazard + " SIGMET"},
+            "geometry": {"type": "Polygon", "coordinates": [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]}}
+
+
+class VectorOverlaysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_map = base_map()
+        self.loads = 0
+        self.sigmets = [polygon("CONVECTIVE", 5, 45, 10, 50), polygon("ICE", -100, -10, -90, 0),
+                        polygon("TURB", 20, 60, 25, 65)]
+
+    def load_features(self, region):
+        self.loads += 1
+        metars = Metars(np.array([10.0, -100.0], dtype=np.float32), np.array([50.0, 0.0], dtype=np.float32),
+                        np.array([0, 2], dtype=np.int8), np.array([1538654400, 1538654400], dtype=np.int64))
+        return Features({"features": self.sigmets}, {"features": []}, {"features": []}, metars)
+
+    def overlays(self, fresh=60):
+        return VectorOverlays(self.load_features, lambda region: self.base_map, SimpleCache(), fresh=fresh)
+
+    def test_visible_features_are_numbered_like_the_rendered_map(self):
+        overlay = json.loads(self.overlays().get("eu").body)
+
+        self.assertEqual([1, 2], [feature["id"] for feature in overlay["features"]])
+        self.assertEqual(["Conv", "TURB"], [feature["label"] for feature in overlay["features"]])
+        self.assertEqual({"1": "CONVECTIVE SIGMET", "2": "TURB SIGMET"}, overlay["info"])
+        self.assertEqual(1, len(overlay["metars"]["x"]))
+
+    def test_coordinates_are_quantized_within_the_view(self):
+        overlay = json.loads(self.overlays().get("eu", zoom=1).body)
+        width, height = overlay["size"]
+
+        for feature in overlay["features"]:
+            for x, y in feature["geometry"]["coordinates"][0]:
+                self.assertIsInstance(x, int)
+                self.assertTrue(0 <= x <= width and 0 <= y <= height)
+
+    def test_gzipped_body_matches(self):
+        overlay = self.overlays().get("eu")
+
+        self.assertEqual(overlay.body, gzip.decompress(overlay.gzipped))
+
+    def test_fresh_overlay_is_served_without_loading(self):
+        overlays = self.overlays()
+        first = overlays.get("eu")
+        second = overlays.get("eu")
+
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(1, self.loads)
+
+    def test_unsupported_zoom_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.overlays().get("eu", zoom=99)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from warm_up import WarmUp
+
+
+class WarmUpTest(unittest.TestCase):
+
+    def test_ready_after_all_steps(self):
+        steps = []
+        warm_up = WarmUp()
+        warm_up.add_step('first', lambda: steps.append('first'))
+        warm_up.add_step('second', lambda: steps.append('second'))
+        self.assertFalse(warm_up.ready)
+
+        warm_up.start()
+
+        self.assertTrue(warm_up.wait(5))
+        self.assertEqual(['first', 'second'], steps)
+        report = warm_up.report()
+        self.assertTrue(report["ready"])
+        self.assertEqual({'first', 'second', 'startup'}, set(report["durations_ms"]))
+
+    def test_failed_step_never_becomes_ready(self):
+        steps = []
+        warm_up = WarmUp()
+        warm_up.add_step('failing', lambda: 1 / 0)
+        warm_up.add_step('skipped', lambda: steps.append('skipped'))
+
+        warm_up.run()
+
+        self.assertFalse(warm_up.ready)
+        self.assertEqual([], steps)
+        self.assertIn("division by zero", warm_up.report()["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()